@@ -19,65 +19,51 @@
 """
 Automatic AGIO
 
-Must be frequently called by a cron job
+Must be frequently called by a cron job. With --dry-run, only print the agios
+that would be charged.
 
 """
 
+import argparse
+import sys
 import asyncio
 import settings
 import api.transactions
 import api.redis
 
-from PyQt5 import QtSql
-from database import Database
+
+def report(summary, dry_run):
+    for line in summary['lines']:
+        print("{:<20} {:>10.2f} {:>8.2f}".format(line['note'], line['balance'], line['price']))
+    print("{} {} agio(s), {:.2f} €".format(
+        "Would charge" if dry_run else "Charged",
+        summary['count'],
+        summary['total'],
+    ))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Charge the agios of the notes in the red")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the agios to charge")
+    args = parser.parse_args()
+
     LOOP = asyncio.get_event_loop()
     LOOP.run_until_complete(api.redis.connect())
 
-    with Database() as database:
-        database.transaction()
-        cursor = QtSql.QSqlQuery(database)
-        cursor.prepare("""
-        SELECT id, nickname, note FROM notes WHERE
-            NOT EXISTS(
-                SELECT note, category FROM note_categories_assoc JOIN note_categories
-                ON note_categories.hidden=TRUE AND note_categories.id=category WHERE note=notes.id
-            )
-            AND overdraft_date < (DATE(NOW()) - INTERVAL '%s DAYS')
-            AND agios_inscription=TRUE
-            AND (last_agio < (DATE(NOW()) - INTERVAL '%s DAYS') OR last_agio IS NULL)
-            """ % (settings.AGIO_THRESHOLD, settings.AGIO_EVERY)
-        )
-        cursor.exec_()
-
-        transactions = []
-        while cursor.next():
-            update = QtSql.QSqlQuery(database)
-            update.prepare("""
-                UPDATE notes
-                SET note=note + note * ? / 100, last_agio=DATE(NOW())
-                WHERE id=?
-                """
-            )
-            update.addBindValue(settings.AGIO_PERCENT)
-            update.addBindValue(cursor.value("id"))
-            if update.exec_():
-                balance = cursor.value("note")
-                transactions.append({
-                    'note': cursor.value("nickname"),
-                    'category': 'AGIO',
-                    'product': '',
-                    'price_name': '',
-                    'quantity': 1,
-                    'price': balance * settings.AGIO_PERCENT / 100,
-                })
-
-        api.transactions.log_transactions(transactions)
-        database.commit()
+    summary = api.transactions.apply_agios(
+        settings.AGIO_PERCENT,
+        settings.AGIO_THRESHOLD,
+        settings.AGIO_EVERY,
+        dry_run=args.dry_run,
+    )
+    if summary is None:
+        print("Can't apply the agios")
+        sys.exit(1)
+    report(summary, args.dry_run)
 
     async def wait_5s():
         await asyncio.sleep(5)
 
-    LOOP.run_until_complete(wait_5s())
+    if summary['count'] and not args.dry_run:
+        # Let the messages and the SDE queue be sent.
+        LOOP.run_until_complete(wait_5s())
@@ -20,8 +20,11 @@
 Base api, with common functions.
 """
 
-from database import Cursor
-import copy
+from PyQt5 import QtCore, QtSql
+from database import Cursor, STATEMENTS
+import contextlib
+import itertools
+import re
 
 
 def make_get_unique(getter):
@@ -42,30 +45,86 @@ def make_get_unique(getter):
     return get_unique
 
 
+def _where(filter_):
+    """ Build the WHERE clause matching filter_ and the values to bind.
+    Keys ending with __gt are compared with >, the others with =.
+    """
+    filters = []
+    values = {}
+    for key, value in filter_.items():
+        if key.endswith('__gt'):
+            key = key[:-4]
+            filters.append("{key}>:{key}".format(key=key))
+        else:
+            filters.append("{key}=:{key}".format(key=key))
+        values[":{}".format(key)] = value
+    return "WHERE" * bool(filters) + " " + " AND ".join(filters), values
+
+
+@contextlib.contextmanager
 def filtered_getter(table, filter_, reverse=False, max_=None, order_by="id"):
     """ This creates a request in the table table with the filter filter_ and
-        returns the cursor of this request for future use.
+        gives the cursor of this request for future use. It is a context
+        manager so the prepared statement can be reused once the rows are read.
     """
-    with Cursor() as cursor:
-        filters = []
-        for key in copy.copy(filter_):
-            if key.endswith('__gt'):
-                filter_[key[:-4]] = filter_[key]
-                del filter_[key]
-                filters.append("{key}>:{key}".format(key=key[:-4]))
-            else:
-                filters.append("{key}=:{key}".format(key=key))
-
-        cursor.prepare("SELECT * FROM {} {} {} {} {} {}".format(
-            table,
-            "WHERE" * bool(len(filters)),
-            " AND ".join(filters),
-            "ORDER BY {} DESC".format(order_by) * reverse,
-            "ORDER BY {} ASC".format(order_by) * (not reverse),
-            "LIMIT {}".format(max_) * bool(max_),
-        ))
-        for key, arg in filter_.items():
-            cursor.bindValue(":{}".format(key), arg)
-        if cursor.exec_():
-            return cursor
+    where, values = _where(filter_)
+    key = ("filtered_getter", table, tuple(filter_), reverse, max_, order_by)
+    with STATEMENTS.prepared(key, lambda: "SELECT * FROM {} {} {} {} {}".format(
+        table,
+        where,
+        "ORDER BY {} DESC".format(order_by) * reverse,
+        "ORDER BY {} ASC".format(order_by) * (not reverse),
+        "LIMIT {}".format(max_) * bool(max_),
+    )) as cursor:
+        cursor.bindValues(values)
+        cursor.exec_()
+        yield cursor
+
+
+STREAM_CURSOR_IDS = itertools.count()
+
 
+def _inline_values(cursor, clause, values):
+    """ Replace the placeholders of clause by the values, escaped by the
+    driver of cursor. This is needed for statements PostgreSQL can't prepare.
+    """
+    def literal(match):
+        value = values[match.group(0)]
+        field = QtSql.QSqlField("value", QtCore.QVariant(value).type())
+        field.setValue(value)
+        return cursor.driver().formatValue(field)
+
+    return re.sub(r":\w+", literal, clause)
+
+
+def streamed_getter(table, filter_, batch_size, order_by="id"):
+    """ Same as filtered_getter but the rows are read through a server side
+    cursor, batch_size rows at a time, so a huge table never has to fit in
+    memory. The cursor of each batch is yielded in turn, already on its first
+    row.
+
+    The cursor is declared WITH HOLD so other queries can run on the
+    connection between two batches. Outside of a transaction, PostgreSQL
+    materialises its whole result when the DECLARE is committed, on the
+    server.
+    """
+    name = "stream_{}_{}".format(table, next(STREAM_CURSOR_IDS))
+    where, values = _where(filter_)
+    with Cursor() as cursor:
+        # DECLARE can't be prepared, the values are inlined instead.
+        if not cursor.exec_("DECLARE {} NO SCROLL CURSOR WITH HOLD FOR SELECT * FROM {} {} ORDER BY {} ASC".format(
+            name, table, _inline_values(cursor, where, values), order_by
+        )):
+            return
+        try:
+            while True:
+                with Cursor() as batch:
+                    batch.setForwardOnly(True)
+                    if not batch.exec_("FETCH {} FROM {}".format(int(batch_size), name)):
+                        return
+                    # size() isn't known for forward only queries.
+                    if not batch.next():
+                        return
+                    yield batch
+        finally:
+            cursor.exec_("CLOSE {}".format(name))
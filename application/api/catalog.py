@@ -0,0 +1,140 @@
+# Copyright (C) 2014-2018 Bastien Orivel <b2orivel@enib.fr>
+# Copyright (C) 2014-2018 Arnaud Levaufre <a2levauf@enib.fr>
+#
+# This file is part of Enibar.
+#
+# Enibar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Enibar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Enibar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Catalog
+=======
+
+In memory copy of the categories, products, price descriptors and prices so
+validating a basket doesn't query the database for every line. It is loaded
+on first use and dropped on the enibar-panels and enibar-settings messages.
+The returned dicts are shared, don't modify them.
+"""
+
+import api.categories
+import api.prices
+import api.products
+
+
+class Catalog:
+    """ Categories indexed by id and name, products by id and (category, name),
+        price descriptors by id and (category, label) and prices by
+        (product, label).
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._reset()
+        # (index, key) still missing after a reload, they don't trigger
+        # another one until the catalog is invalidated.
+        self.misses = set()
+
+    def _reset(self):
+        self.loaded = False
+        self.categories = {}
+        self.categories_by_name = {}
+        self.products = {}
+        self.products_by_name = {}
+        self.descriptors = {}
+        self.descriptors_by_label = {}
+        self.prices = {}
+
+    def load(self):
+        """ (Re)load everything from the database """
+        self._reset()
+        for category in api.categories.get():
+            self.categories[category['id']] = category
+            self.categories_by_name[category['name']] = category
+        for product in api.products.get():
+            self.products[product['id']] = product
+            self.products_by_name[product['category'], product['name']] = product
+        for descriptor in api.prices.get_descriptor():
+            self.descriptors[descriptor['id']] = descriptor
+            self.descriptors_by_label[descriptor['category'], descriptor['label']] = descriptor
+        for price in api.prices.get():
+            self.prices[price['product'], price['label']] = price
+        self.loaded = True
+
+    def lookup(self, index, key):
+        """ Get an item from one of the indexes. The catalog is reloaded once if
+            the item is missing in case a change wasn't notified yet, an item
+            still missing then is known to be missing until the next
+            invalidation.
+
+        :param str index: Name of the index
+        :param key: Key of the item in this index
+        :return dict: The item or None
+        """
+        if not self.loaded:
+            self.load()
+        item = getattr(self, index).get(key)
+        if item is None and (index, key) not in self.misses:
+            self.load()
+            item = getattr(self, index).get(key)
+            if item is None:
+                self.misses.add((index, key))
+        return item
+
+
+CATALOG = Catalog()
+
+
+def invalidate():
+    """ Drop the catalog, it is loaded again on next use """
+    CATALOG.clear()
+
+
+def get_category(name=None, id_=None):
+    """ Get a category by name or id
+
+    :return dict: The category or None
+    """
+    if id_ is not None:
+        return CATALOG.lookup('categories', id_)
+    return CATALOG.lookup('categories_by_name', name)
+
+
+def get_product(category, name):
+    """ Get a product
+
+    :param int category: Category id
+    :param str name: Product name
+    :return dict: The product or None
+    """
+    return CATALOG.lookup('products_by_name', (category, name))
+
+
+def get_descriptor(category, label):
+    """ Get a price descriptor
+
+    :param int category: Category id
+    :param str label: Price descriptor label
+    :return dict: The price descriptor or None
+    """
+    return CATALOG.lookup('descriptors_by_label', (category, label))
+
+
+def get_price(product, label):
+    """ Get a price, alcohol majoration included
+
+    :param int product: Product id
+    :param str label: Price descriptor label
+    :return dict: The price or None
+    """
+    return CATALOG.lookup('prices', (product, label))
@@ -85,12 +85,12 @@ def get(**filter_):
     """
     global CATEGORY_FIELDS_CACHE
 
-    cursor = api.base.filtered_getter("categories", filter_)
-    while cursor.next():
-        if CATEGORY_FIELDS_CACHE == {}:
-            CATEGORY_FIELDS_CACHE = {f: cursor.indexOf(f) for f in CATEGORY_FIELDS}
-        yield {field: cursor.value(CATEGORY_FIELDS_CACHE[field]) for field in
-               CATEGORY_FIELDS}
+    with api.base.filtered_getter("categories", filter_) as cursor:
+        while cursor.next():
+            if CATEGORY_FIELDS_CACHE == {}:
+                CATEGORY_FIELDS_CACHE = {f: cursor.indexOf(f) for f in CATEGORY_FIELDS}
+            yield {field: cursor.value(CATEGORY_FIELDS_CACHE[field]) for field in
+                   CATEGORY_FIELDS}
 
 
 get_unique = api.base.make_get_unique(get)
@@ -27,14 +27,18 @@ Handle all mail related task.
 
 import os
 import base64
+import collections
+import concurrent.futures
+import functools
 import smtplib
 import re
 import datetime
+import string
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from database import Cursor
 import api.base
-import api.notes
 import settings
 
 
@@ -55,6 +59,14 @@ COMPLETION_FIELD = {
 }
 
 
+# Number of SMTP connections used at the same time by send_mails
+SMTP_CONNECTIONS = 4
+# Number of mails sent on a connection before opening a new one, servers often
+# limit it.
+MAILS_PER_CONNECTION = 100
+MAIL_LOG = "mail.log"
+
+
 # Interval units used to match database schedule unit to Qt combobox indexes
 INTERVAL_UNITS = [
     "day",
@@ -63,69 +75,177 @@ INTERVAL_UNITS = [
 ]
 
 # Filters used too match notes we must send email to. Indexes are relevant and
-# must match Qt combobox indexes.
+# must match Qt combobox indexes. Each filter is a SQL condition on notes_cache
+# and the function parsing its argument, if it takes one.
 FILTERS = [
-    lambda x, y: True,
-    lambda x, y: x['mail'] in y.split(','),
-    lambda x, y: x['note'] >= float(y),
-    lambda x, y: x['note'] < float(y),
+    ("TRUE", None),
+    ("mail = ANY(STRING_TO_ARRAY(:arg, ','))", lambda arg: ",".join(parse_mails(arg))),
+    ("note >= :arg", float),
+    ("note < :arg", float),
 ]
 
 
+def parse_mails(mails):
+    """ Parse a comma separated list of mails
+
+    :param str mails: The list of mails
+    :return set: The mails
+    """
+    return {mail for mail in mails.split(',') if mail}
+
+
 def get_recipients(filter_, filter_arg):
-    """ Get a list of all notes matching filter
+    """ Get a list of all the visible notes registered to mails and matching
+    filter. Only the fields usable in a message are fetched.
 
     :param int filter_: Selected filter
     :param str filter_arg: Argument provided to filter
     :return list: Matching notes
     """
     try:
-        filter_fnc = FILTERS[filter_]
-        return api.notes.get(lambda x: filter_fnc(x, filter_arg) and x['mails_inscription'])
-    except:
+        condition, parse = FILTERS[filter_]
+        arg = parse(filter_arg) if parse else None
+    except (IndexError, TypeError, ValueError):
         return []
 
+    recipients = []
+    with Cursor() as cursor:
+        cursor.prepare("""
+            SELECT id, nickname, lastname, firstname, mail, tel, birthdate,
+                promo, CAST(note AS DOUBLE PRECISION) AS note, overdraft_date,
+                ecocups
+            FROM notes_cache
+            WHERE mails_inscription AND NOT COALESCE(hidden, FALSE)
+            AND {}
+            ORDER BY id
+            """.format(condition)
+        )
+        if parse:
+            cursor.bindValue(':arg', arg)
+        cursor.exec_()
+        while cursor.next():
+            recipients.append({field: cursor.value(field) for field in COMPLETION_FIELD.values()})
+    return recipients
+
+
+class SMTPSession:
+    """ SMTP connection opened on first use and reused for the next mails, it
+    is opened again after MAILS_PER_CONNECTION mails or after an error.
+    """
+    def __init__(self):
+        self.server = None
+        self.sent = 0
 
-def send_mail(to, subject, message, from_="cafeteria@enib.fr"):
+    def sendmail(self, from_, to, mail):
+        if self.server is None:
+            self.server = smtplib.SMTP(settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT)
+        try:
+            self.server.sendmail(from_, to, mail)
+        except Exception:
+            self.close()
+            raise
+        self.sent += 1
+        if self.sent >= MAILS_PER_CONNECTION:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+        self.sent = 0
+
+
+def send_mail(to, subject, message, from_="cafeteria@enib.fr", session=None, logfile=None):
     """ Send mail
 
     :param str to: Mail recipient
     :param str subject: Mail subject
     :param str message: Mail message
     :param str from_: Mail sender
+    :param SMTPSession session: Connection to use, a new one is opened if None
+    :param MailLog logfile: Log to use, mail.log is opened if None
     """
+    if session is None:
+        srv, port = settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT
+        with smtplib.SMTP(srv, port) as server:
+            return send_mail(to, subject, message, from_, server, logfile)
+
+    mail = MIMEMultipart('alternative')
+    mail['subject'] = subject
+    mail['To'] = to
+    mail['From'] = from_
+    now = datetime.datetime.now()
+    mail['Date'] = now.strftime("%a, %d %h %Y %X %z")
+    mail['Message-ID'] = '<{}.{}@{}>'.format(
+        base64.b32encode(os.urandom(8)).decode()[:13],
+        base64.b32encode(os.urandom(8)).decode()[:13],
+        'enibar.enib.net'
+    )
+
+    text = MIMEText(message, "plain")
+    content = re.sub("\n", "<br/>", message)
+    message = "<!dotcype html>\n<html><body>{}</body></html>".format(content)
+    html = MIMEText(message, "html")
+
+    mail.attach(text)
+    mail.attach(html)
+    try:
+        session.sendmail(from_, to, mail.as_string())
+        log_mail(to, subject, message, from_, logfile=logfile)
+        return True
+    except Exception as e:
+        log_mail(to, subject, message, from_, str(e), logfile=logfile)
+        return False
 
-    srv, port = settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT
-    with smtplib.SMTP(srv, port) as server:
-        mail = MIMEMultipart('alternative')
-        mail['subject'] = subject
-        mail['To'] = to
-        mail['From'] = from_
-        now = datetime.datetime.now()
-        mail['Date'] = now.strftime("%a, %d %h %Y %X %z")
-        mail['Message-ID'] = '<{}.{}@{}>'.format(
-            base64.b32encode(os.urandom(8)).decode()[:13],
-            base64.b32encode(os.urandom(8)).decode()[:13],
-            'enibar.enib.net'
-        )
 
-        text = MIMEText(message, "plain")
-        content = re.sub("\n", "<br/>", message)
-        message = "<!dotcype html>\n<html><body>{}</body></html>".format(content)
-        html = MIMEText(message, "html")
+def send_mails(mails, connections=SMTP_CONNECTIONS):
+    """ Send many mails over a few SMTP connections used at the same time,
+    each of them being reused for many mails. This doesn't touch Qt so it can
+    be run on a worker thread.
 
-        mail.attach(text)
-        mail.attach(html)
-        try:
-            server.sendmail(from_, to, mail.as_string())
-            log_mail(to, subject, message, from_)
-            return True
-        except Exception as e:
-            log_mail(to, subject, message, from_, str(e))
-            return False
+    :param list mails: [(to, subject, message, from_), ]
+    :param int connections: Number of connections
+    :return list: True for every mail sent, in the order of mails
+    """
+    results = [False] * len(mails)
+    with MailLog() as logfile:
+        def worker(indexes):
+            session = SMTPSession()
+            try:
+                for i in indexes:
+                    results[i] = send_mail(*mails[i], session, logfile)
+            finally:
+                session.close()
+
+        with concurrent.futures.ThreadPoolExecutor(connections) as pool:
+            list(pool.map(worker, [range(i, len(mails), connections) for i in range(connections)]))
+    return results
+
+
+class MailLog:
+    """ Buffered mail.log shared by the mails of a batch, every record is
+    written at once so records of different threads don't interleave.
+    """
+    def __init__(self):
+        self.file = None
+        self.lock = threading.Lock()
 
+    def __enter__(self):
+        self.file = open(MAIL_LOG, "a", buffering=64 * 1024)
+        return self
 
-def log_mail(to, subject, message, from_, error=None):
+    def __exit__(self, *args):
+        self.file.close()
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(record)
+
+
+def log_mail(to, subject, message, from_, error=None, logfile=None):
     """ Log sent and not sent mail
 
     :param str to: Mail recipient
@@ -133,50 +253,72 @@ def log_mail(to, subject, message, from_, error=None):
     :param str message: Mail message
     :param str from_: Mail sender
     :param str error: error while sending
+    :param MailLog logfile: Log to write to, mail.log is opened if None
     """
+    if not error:
+        status = "Mail sent on {} from {} to {}\n".format(
+            datetime.datetime.now(),
+            from_,
+            to
+        )
+    else:
+        status = "Mail not sent on {} from {} to {} with error {}\n".format(
+            datetime.datetime.now(),
+            from_,
+            to,
+            error
+        )
+    record = "{}Subject : {}\nMessage :\n\n{}\n\n\n{}\n".format(
+        status, subject, message, "-" * 255
+    )
+
+    if logfile is None:
+        with MailLog() as logfile:
+            logfile.write(record)
+    else:
+        logfile.write(record)
 
-    with open("mail.log", "a") as logfile:
-        if not error:
-            logfile.write("Mail sent on {} from {} to {}\n".format(
-                datetime.datetime.now(),
-                from_,
-                to
-            ))
-        else:
-            logfile.write("Mail not sent on {} from {} to {} with error {}\n".format(
-                datetime.datetime.now(),
-                from_,
-                to,
-                error
-            ))
-        logfile.write("Subject : {}\n".format(subject))
-        logfile.write("Message :\n\n{}\n\n\n".format(message))
-        logfile.write("-" * 255 + "\n")
+
+# Fields converted to a readable form before being put in a message
+FIELD_FORMATTERS = {
+    'birthdate': lambda value: datetime.date.fromtimestamp(value).strftime("%d/%m/%Y"),
+    'overdraft_date': lambda value: value.toString("dd/MM/yyyy") if value and value.isValid() else "Jamais",
+}
+PLACEHOLDERS = re.compile("{(" + "|".join(map(re.escape, COMPLETION_FIELD)) + ")}")
+# Number of compiled messages kept by compile_message
+COMPILED_MESSAGES = 64
+
+
+@functools.lru_cache(maxsize=COMPILED_MESSAGES)
+def compile_message(message):
+    """ Compile a message in a function rendering it for a note. Placeholders
+    are converted to their column name once, and only the fields used by the
+    message are formatted when rendering it.
+
+    :param str message: input text with placeholders
+    :return function: render(note) giving the text for this note
+    """
+    template = PLACEHOLDERS.sub(lambda match: "{" + COMPLETION_FIELD[match.group(1)] + "}", message)
+    fields = {re.match(r"\w*", name).group()
+              for _, name, _, _ in string.Formatter().parse(template) if name}
+    formatters = {field: FIELD_FORMATTERS[field] for field in fields if field in FIELD_FORMATTERS}
+
+    def render(note):
+        values = {field: formatter(note[field]) for field, formatter in formatters.items()}
+        return template.format_map(collections.ChainMap(values, note))
+    return render
 
 
 def format_message(message, note):
     """ Format massge
-    Convert placeholders to their values.
+    Convert placeholders to their values. Prefer compile_message when the
+    same message is formatted for many notes.
 
     :param str message: input text to convert
     :param dict note: A dict describing a note
     :return str: text with converted placeholders to their values
     """
-    note = dict(note)  # Create a copy of note to avoid modifying the real note
-    for field in COMPLETION_FIELD:
-        message = re.sub(
-            "{" + field + "}", "{" + COMPLETION_FIELD[field] + "}", message
-        )
-
-    # Change all date to readable format
-    note['birthdate'] = datetime.date.fromtimestamp(note['birthdate'])
-    note['birthdate'] = note['birthdate'].strftime("%d/%m/%Y")
-    if note['overdraft_date'] and note['overdraft_date'].isValid():
-        note['overdraft_date'] = note['overdraft_date'].toString("dd/MM/yyyy")
-    else:
-        note['overdraft_date'] = "Jamais"
-
-    return message.format(**note)
+    return compile_message(message)(note)
 
 
 def get_models(**filter_):
@@ -185,15 +327,15 @@ def get_models(**filter_):
     :param kwargs **filters: Filter to apply when fetching models
     :return generator: Models
     """
-    cursor = api.base.filtered_getter("mail_models", filter_, order_by="name")
-    while cursor.next():
-        yield {
-            'name': cursor.value('name'),
-            'subject': cursor.value('subject'),
-            'message': cursor.value('message'),
-            'filter': cursor.value('filter'),
-            'filter_value': cursor.value('filter_value'),
-        }
+    with api.base.filtered_getter("mail_models", filter_, order_by="name") as cursor:
+        while cursor.next():
+            yield {
+                'name': cursor.value('name'),
+                'subject': cursor.value('subject'),
+                'message': cursor.value('message'),
+                'filter': cursor.value('filter'),
+                'filter_value': cursor.value('filter_value'),
+            }
 
 
 def save_model(name, subject, message, filter_, filter_value):
@@ -247,21 +389,21 @@ def get_scheduled_mails(**filter_):
     :param kwargs **filters: Filter to apply when fetching mails
     :return generator: scheduled mails
     """
-    cursor = api.base.filtered_getter("scheduled_mails", filter_, order_by="name")
-    while cursor.next():
-        yield {
-            'name': cursor.value('name'),
-            'active': cursor.value('active'),
-            'schedule_interval': cursor.value('schedule_interval'),
-            'schedule_unit': cursor.value('schedule_unit'),
-            'schedule_day': cursor.value('schedule_day'),
-            'subject': cursor.value('subject'),
-            'message': cursor.value('message'),
-            'filter': cursor.value('filter'),
-            'filter_value': cursor.value('filter_value'),
-            'sender': cursor.value('sender'),
-            'last_sent': cursor.value('last_sent'),
-        }
+    with api.base.filtered_getter("scheduled_mails", filter_, order_by="name") as cursor:
+        while cursor.next():
+            yield {
+                'name': cursor.value('name'),
+                'active': cursor.value('active'),
+                'schedule_interval': cursor.value('schedule_interval'),
+                'schedule_unit': cursor.value('schedule_unit'),
+                'schedule_day': cursor.value('schedule_day'),
+                'subject': cursor.value('subject'),
+                'message': cursor.value('message'),
+                'filter': cursor.value('filter'),
+                'filter_value': cursor.value('filter_value'),
+                'sender': cursor.value('sender'),
+                'last_sent': cursor.value('last_sent'),
+            }
 
 
 def save_scheduled_mails(name, active, sched_int, sched_unit, sched_day,
@@ -163,12 +163,12 @@ def get(**filter_):
     """
     global NOTE_CATEGORY_FIELDS_CACHE
 
-    cursor = api.base.filtered_getter("note_categories", filter_)
-    while cursor.next():
-        if NOTE_CATEGORY_FIELDS_CACHE == {}:
-            NOTE_CATEGORY_FIELDS_CACHE = {f: cursor.indexOf(f) for f in NOTE_CATEGORY_FIELDS}
-        yield {field: cursor.value(NOTE_CATEGORY_FIELDS_CACHE[field]) for field in
-               NOTE_CATEGORY_FIELDS}
+    with api.base.filtered_getter("note_categories", filter_) as cursor:
+        while cursor.next():
+            if NOTE_CATEGORY_FIELDS_CACHE == {}:
+                NOTE_CATEGORY_FIELDS_CACHE = {f: cursor.indexOf(f) for f in NOTE_CATEGORY_FIELDS}
+            yield {field: cursor.value(NOTE_CATEGORY_FIELDS_CACHE[field]) for field in
+                   NOTE_CATEGORY_FIELDS}
 
 
 get_unique = api.base.make_get_unique(get)
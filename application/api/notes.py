@@ -22,10 +22,10 @@ Notes
 
 """
 
-from PyQt5 import QtSql
+from PyQt5 import QtCore, QtSql
 import api.transactions
 import api.redis
-from database import Cursor, Database
+from database import Cursor, Database, STATEMENTS
 import datetime
 import os.path
 import settings
@@ -33,33 +33,201 @@ import shutil
 import tempfile
 import rapi
 
-NOTES_CACHE = {}
+
+class NotesStore:
+    """ In memory notes store. Notes are stored by nickname and indexed by id,
+        mail and (firstname, lastname) so equality lookups don't have to scan
+        every note.
+    """
+    def __init__(self, notes=None):
+        self.notes = {}
+        self.by_id = {}
+        self.by_mail = {}
+        self.by_name = {}
+        self.loaded = False
+        if notes:
+            self.load(notes)
+
+    def load(self, notes):
+        """ Replace the content of the store
+
+        :param dict notes: A dict formed like {nickname: note, }
+        """
+        self.notes = {}
+        self.by_id = {}
+        self.by_mail = {}
+        self.by_name = {}
+        for nick, note in notes.items():
+            self[nick] = note
+        self.loaded = True
+
+    def _index(self, note):
+        self.by_id[note['id']] = note
+        self.by_mail.setdefault(note['mail'], []).append(note)
+        name = (note['firstname'], note['lastname'])
+        self.by_name.setdefault(name, []).append(note)
+
+    def _unindex(self, note):
+        if self.by_id.get(note['id']) is note:
+            del self.by_id[note['id']]
+        for index, key in ((self.by_mail, note['mail']),
+                           (self.by_name, (note['firstname'], note['lastname']))):
+            bucket = [n for n in index.get(key, []) if n is not note]
+            if bucket:
+                index[key] = bucket
+            else:
+                index.pop(key, None)
+
+    def __setitem__(self, nick, note):
+        if nick in self.notes:
+            self._unindex(self.notes[nick])
+        self.notes[nick] = note
+        self._index(note)
+
+    def __getitem__(self, nick):
+        return self.notes[nick]
+
+    def __delitem__(self, nick):
+        self._unindex(self.notes.pop(nick))
+
+    def __contains__(self, nick):
+        return nick in self.notes
+
+    def __iter__(self):
+        return iter(self.notes)
+
+    def __len__(self):
+        return len(self.notes)
+
+    def values(self):
+        return self.notes.values()
+
+    def get(self, nick, default=None):
+        return self.notes.get(nick, default)
+
+
+# Built on first access by get_cache, scripts that don't read the notes never
+# load them.
+NOTES_CACHE = NotesStore()
 
 
 def rebuild_cache():
     """ Build a cache with all notes inside. This improve greatly the perfs of
         get actions
     """
-    global NOTES_CACHE
-    NOTES_CACHE = rapi.notes.get_cache()
+    NOTES_CACHE.load(rapi.notes.get_cache())
+
+
+def get_cache():
+    """ Get the notes cache, build it if it wasn't yet
+
+    :return NotesStore: The cache
+    """
+    if not NOTES_CACHE.loaded:
+        rebuild_cache()
+    return NOTES_CACHE
 
 
 def rebuild_note_cache(nick):
-    """ Rebuild a row in the cache
+    """ Rebuild a row in the cache. Nothing is done if the cache isn't built,
+        the note will be loaded with the others.
     """
+    if not NOTES_CACHE.loaded:
+        return
     new = rapi.notes.get_note_cache(nick)
     if new:
         NOTES_CACHE[nick] = new
 
 
+# Fields sent along the enibar-notes messages so subscribers can patch their
+# cache without fetching the note again.
+PAYLOAD_FIELDS = ['note', 'ecocups', 'tot_cons', 'tot_refill', 'overdraft_date', 'version']
+
+
+def get_payloads(nicks):
+    """ Get the balance related fields of some notes, in a form that can be
+        sent in an enibar-notes message.
+
+    :param list nicks: Nicknames of the notes
+    :return dict: {nickname: payload, } payload is None for unknown notes
+    """
+    payloads = dict.fromkeys(nicks)
+    ids = [note['id'] for note in map(get_by_nick, payloads) if note]
+    if not ids:
+        return payloads
+
+    with Cursor() as cursor:
+        cursor.prepare("SELECT nickname, {} FROM notes WHERE id IN ({})".format(
+            ", ".join(PAYLOAD_FIELDS),
+            ", ".join(str(int(id_)) for id_ in ids)
+        ))
+        if not cursor.exec_():
+            return payloads
+        while cursor.next():
+            overdraft_date = cursor.value('overdraft_date')
+            if overdraft_date and overdraft_date.isValid():
+                overdraft_date = overdraft_date.toString(QtCore.Qt.ISODate)
+            else:
+                overdraft_date = None
+            payloads[cursor.value('nickname')] = {
+                'note': float(cursor.value('note')),
+                'ecocups': int(cursor.value('ecocups')),
+                'tot_cons': float(cursor.value('tot_cons')),
+                'tot_refill': float(cursor.value('tot_refill')),
+                'overdraft_date': overdraft_date,
+                'version': int(cursor.value('version')),
+            }
+    return payloads
+
+
+def patch_note_cache(nick, payload):
+    """ Patch a row in the cache with a payload built by get_payloads. The row
+        is fetched from the database instead if there is no payload or if some
+        updates of the note were missed.
+
+    :param str nick: The nickname of the note
+    :param dict payload: The payload or None
+    """
+    if not NOTES_CACHE.loaded:
+        return
+    note = NOTES_CACHE.get(nick)
+    if note is None or payload is None:
+        rebuild_note_cache(nick)
+        return
+
+    if payload['version'] <= note['version']:
+        # We already know about this update.
+        return
+
+    if payload['version'] != note['version'] + 1:
+        rebuild_note_cache(nick)
+        return
+
+    note.update(payload)
+    if payload['overdraft_date'] is not None:
+        note['overdraft_date'] = QtCore.QDate.fromString(payload['overdraft_date'], QtCore.Qt.ISODate)
+
+
+def apply_notes_message(message):
+    """ Update the cache with an enibar-notes message. The message is either a
+        list of nicknames or a dict of {nickname: payload, }.
+    """
+    if isinstance(message, dict):
+        for nick, payload in message.items():
+            patch_note_cache(nick, payload)
+    else:
+        for nick in message:
+            rebuild_note_cache(nick)
+
+
 def change_values(nick, *, do_not=False, **kwargs):
     """ Change the value of the columns for the note with the nickname
         `nickname`
     """
-    with Cursor() as cursor:
-        setter = ", ".join("{key}=:{key}".format(key=key) for key in kwargs)
-        cursor.prepare("UPDATE notes SET {} WHERE nickname=:nick".format(
-            setter))
+    statement = ("notes.change_values", tuple(kwargs))
+    with STATEMENTS.prepared(statement, lambda: "UPDATE notes SET {} WHERE nickname=:nick".format(
+        ", ".join("{key}=:{key}".format(key=key) for key in kwargs)
+    )) as cursor:
         for key, value in kwargs.items():
             cursor.bindValue(':{}'.format(key), value)
         cursor.bindValue(':nick', nick)
@@ -70,12 +238,13 @@ def change_values(nick, *, do_not=False, **kwargs):
 
     renaming = 'nickname' in kwargs
     if renaming:
-        note = get(lambda x: x['nickname'] == nick)[0]
+        note = get_by_nick(nick)
         # Make the history follow
-        cursor.prepare("UPDATE transactions SET note=:new_nick WHERE note_id=:id")
-        cursor.bindValue(":new_nick", kwargs['nickname'])
-        cursor.bindValue(":id", note['id'])
-        cursor.exec_()
+        with Cursor() as cursor:
+            cursor.prepare("UPDATE transactions SET note=:new_nick WHERE note_id=:id")
+            cursor.bindValue(":new_nick", kwargs['nickname'])
+            cursor.bindValue(":id", note['id'])
+            cursor.exec_()
 
     if not do_not:
         if renaming:
@@ -154,7 +323,7 @@ def remove(nicks):
     nicks = list(nicks)
     trs = []
     for nick in nicks:
-        note = get(lambda x: x['nickname'] == nick)[0]
+        note = get_by_nick(nick)
         trs.append({
             'note': nick,
             'category': "Note",
@@ -170,8 +339,9 @@ def remove(nicks):
     rapi.notes.remove(nicks)
     api.redis.send_message("enibar-delete", nicks)
 
-    for nick in nicks:
-        del NOTES_CACHE[nick]
+    if NOTES_CACHE.loaded:
+        for nick in nicks:
+            del NOTES_CACHE[nick]
 
 
 def change_photo(nickname, new_photo):
@@ -197,6 +367,36 @@ def change_photo(nickname, new_photo):
     return value
 
 
+def change_photo_paths(photo_paths, *, do_not=False):
+    """ Change the photo_path of several notes with a single UPDATE.
+    The photos must already be in settings.IMG_BASE_DIR.
+
+    :param dict photo_paths: {nickname: photo_path, }
+
+    :return bool: True if success else False
+    """
+    if not photo_paths:
+        return True
+
+    rows = []
+    values = {}
+    for i, (nickname, photo_path) in enumerate(photo_paths.items()):
+        rows.append("(:nickname_{i}, :photo_path_{i})".format(i=i))
+        values[':nickname_{}'.format(i)] = nickname
+        values[':photo_path_{}'.format(i)] = photo_path
+
+    with Cursor() as cursor:
+        cursor.prepare("UPDATE notes SET photo_path=photos.photo_path \
+                        FROM (VALUES {}) AS photos(nickname, photo_path) \
+                        WHERE notes.nickname=photos.nickname".format(", ".join(rows)))
+        cursor.bindValues(values)
+        value = cursor.exec_()
+
+    if value and not do_not:
+        api.redis.send_message("enibar-notes", list(photo_paths))
+    return value
+
+
 def get(filter_function=None):
     """ Get notes with a filter. filter_function should be a function like \
             `lamda x: x["id"] == 1` \
@@ -205,8 +405,45 @@ def get(filter_function=None):
         :param callable filter_function: The filter to apply.
     """
     if filter_function is None:
-        return list(NOTES_CACHE.values())
-    return list(filter(filter_function, NOTES_CACHE.values()))
+        return list(get_cache().values())
+    return list(filter(filter_function, get_cache().values()))
+
+
+def get_by_nick(nick):
+    """ Get the note with the nickname `nick`
+
+        :param str nick: The nickname of the note
+        :return dict: The note or None if there is no such note
+    """
+    return get_cache().get(nick)
+
+
+def get_by_id(id_):
+    """ Get the note with the id `id_`
+
+        :param int id_: The id of the note
+        :return dict: The note or None if there is no such note
+    """
+    return get_cache().by_id.get(id_)
+
+
+def get_by_mail(mail):
+    """ Get all notes using the mail `mail`
+
+        :param str mail: The mail to look for
+        :return list: Matching notes
+    """
+    return list(get_cache().by_mail.get(mail, []))
+
+
+def get_by_name(firstname, lastname):
+    """ Get all notes belonging to `firstname` `lastname`
+
+        :param str firstname: First name
+        :param str lastname: Last name
+        :return list: Matching notes
+    """
+    return list(get_cache().by_name.get((firstname, lastname), []))
 
 
 def change_ecocups(nick, diff, do_not=False):
@@ -215,15 +452,20 @@ def change_ecocups(nick, diff, do_not=False):
         :param str nick: The nickname og the note
         :param int diff: The number of ecocups to add.
     """
-    with Cursor() as cursor:
-        cursor.prepare("UPDATE notes SET ecocups=ecocups+:diff WHERE\
-                        nickname=:nick")
-        cursor.bindValue(":diff", diff)
-        cursor.bindValue(":nick", nick)
-        value = cursor.exec_()
-        note = NOTES_CACHE[nick]
-        note['ecocups'] = note['ecocups'] + diff
-    api.redis.send_message("enibar-notes", [nick, ])
+    # Don't touch the note if there is nothing to change, this would bump its
+    # version for nothing.
+    value = True
+    if diff:
+        with Cursor() as cursor:
+            cursor.prepare("UPDATE notes SET ecocups=ecocups+:diff WHERE\
+                            nickname=:nick")
+            cursor.bindValue(":diff", diff)
+            cursor.bindValue(":nick", nick)
+            value = cursor.exec_()
+            if NOTES_CACHE.loaded:
+                note = NOTES_CACHE[nick]
+                note['ecocups'] = note['ecocups'] + diff
+    api.redis.send_message("enibar-notes", get_payloads([nick]))
     return value
 
 
@@ -243,8 +485,8 @@ def export(notes):
 def export_by_nick(notes_nicks, *args, **kwargs):
     """ Export notes but taking nicknames.
     """
-    notes_nicks = list(notes_nicks)
-    return export([note for note in NOTES_CACHE.values() if note['nickname'] in notes_nicks],
+    notes = (get_by_nick(nick) for nick in dict.fromkeys(notes_nicks))
+    return export([note for note in notes if note is not None],
                   *args,
                   **kwargs)
 
@@ -269,7 +511,3 @@ def import_csv(notes, reason, amount, *, do_not=False):
         )
     if api.transactions.log_transactions(trs):
         return len(trs)
-
-
-rebuild_cache()
-
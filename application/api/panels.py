@@ -116,12 +116,12 @@ def get(**filter_):
     """
     global PANEL_FIELDS_CACHE
 
-    cursor = api.base.filtered_getter("panels", filter_)
-    while cursor.next():
-        if PANEL_FIELDS_CACHE == {}:
-            PANEL_FIELDS_CACHE = {f: cursor.indexOf(f) for f in PANEL_FIELDS}
-        yield {field: cursor.value(PANEL_FIELDS_CACHE[field]) for field in
-               PANEL_FIELDS}
+    with api.base.filtered_getter("panels", filter_) as cursor:
+        while cursor.next():
+            if PANEL_FIELDS_CACHE == {}:
+                PANEL_FIELDS_CACHE = {f: cursor.indexOf(f) for f in PANEL_FIELDS}
+            yield {field: cursor.value(PANEL_FIELDS_CACHE[field]) for field in
+                   PANEL_FIELDS}
 
 
 def get_content(panel_id):
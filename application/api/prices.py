@@ -24,7 +24,7 @@ Prices
 
 """
 
-from database import Cursor, Database
+from database import Cursor, Database, STATEMENTS
 from PyQt5 import QtSql
 import api.base
 import settings
@@ -106,14 +106,10 @@ def get_descriptor(**kwargs):
     :param \*\*kwargs: filters to apply
     """
     global PRICE_DESCRIPTOR_FIELDS_CACHE
-    with Cursor() as cursor:
-        request_filters = []
-        for key in kwargs:
-            request_filters.append("{key}=:{key}".format(key=key))
-        request = "SELECT * FROM price_description WHERE {}".format(
-            " AND ".join(request_filters)
-        )
-        cursor.prepare(request)
+    statement = ("prices.get_descriptor", tuple(kwargs))
+    with STATEMENTS.prepared(statement, lambda: "SELECT * FROM price_description {}".format(
+        api.base._where(kwargs)[0]
+    )) as cursor:
         for key, arg in kwargs.items():
             cursor.bindValue(":{}".format(key), arg)
         cursor.exec_()
@@ -166,12 +162,9 @@ def get(**kwargs):
     """
     global PRICE_FIELDS_CACHE
 
-    with Cursor() as cursor:
-        filters = []
-        for key in kwargs:
-            filters.append("prices.{key}=:{key}".format(key=key))
-
-        cursor.prepare("SELECT prices.id as id,\
+    def build():
+        filters = ["prices.{key}=:{key}".format(key=key) for key in kwargs]
+        return "SELECT prices.id as id,\
             prices.product as product,\
             prices.value as value,\
             price_description.label as label,\
@@ -181,7 +174,9 @@ def get(**kwargs):
             ON prices.price_description=price_description.id \
             JOIN categories \
             ON categories.id=price_description.category \
-            {} {}".format("WHERE" * bool(filters), " AND ".join(filters)))
+            {} {}".format("WHERE" * bool(filters), " AND ".join(filters))
+
+    with STATEMENTS.prepared(("prices.get", tuple(kwargs)), build) as cursor:
         for key, arg in kwargs.items():
             cursor.bindValue(":{}".format(key), arg)
 
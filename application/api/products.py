@@ -116,12 +116,12 @@ def get(**filter_):
     """
     global PRODUCT_FIELDS_CACHE
 
-    cursor = api.base.filtered_getter("products", filter_)
-    while cursor.next():
-        if PRODUCT_FIELDS_CACHE == {}:
-            PRODUCT_FIELDS_CACHE = {f: cursor.indexOf(f) for f in PRODUCT_FIELDS}
-        yield {field: cursor.value(PRODUCT_FIELDS_CACHE[field]) for field in
-               PRODUCT_FIELDS}
+    with api.base.filtered_getter("products", filter_) as cursor:
+        while cursor.next():
+            if PRODUCT_FIELDS_CACHE == {}:
+                PRODUCT_FIELDS_CACHE = {f: cursor.indexOf(f) for f in PRODUCT_FIELDS}
+            yield {field: cursor.value(PRODUCT_FIELDS_CACHE[field]) for field in
+                   PRODUCT_FIELDS}
 
 
 get_unique = api.base.make_get_unique(get)
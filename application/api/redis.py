@@ -4,24 +4,43 @@ import aioredis
 import redis
 import sys
 import rapi
-from PyQt5 import QtWidgets
 
 
 connection = None
-blocking_connection = redis.StrictRedis(host=settings.REDIS_HOST, port=6379, db=0, password=settings.REDIS_PASSWORD)
-
-try:
-    blocking_connection.ping()
-except redis.exceptions.ConnectionError:
-    if rapi.utils.check_x11():
-        # We need this to create an app before opening a window.
-        import gui.utils
-        tmp = QtWidgets.QApplication(sys.argv)
-        gui.utils.error("Error", "Can't join redis")
-    print("Can't join redis")
-    sys.exit(5)
+# Opened on first use so importing this module doesn't need redis.
+blocking_connection = None
+
+
+def get_blocking_connection():
+    """ Get the blocking connection to redis, open it on first use and exit if
+        redis can't be joined.
+
+    :return redis.StrictRedis: The connection
+    """
+    global blocking_connection
+    if blocking_connection is not None:
+        return blocking_connection
+
+    client = redis.StrictRedis(host=settings.REDIS_HOST, port=6379, db=0, password=settings.REDIS_PASSWORD)
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError:
+        if rapi.utils.check_x11():
+            # We need this to create an app before opening a window.
+            import gui.utils
+            from PyQt5 import QtWidgets
+            tmp = QtWidgets.QApplication(sys.argv)
+            gui.utils.error("Error", "Can't join redis")
+        print("Can't join redis")
+        sys.exit(5)
+    blocking_connection = client
+    return blocking_connection
+
 
 PING_TIME = 10
+# Time during which the pub/sub messages are gathered before being handled, in
+# seconds.
+COALESCE_DELAY = 0.1
 
 
 async def connect():
@@ -56,11 +75,11 @@ def set_key(key, value, callback):
 
 
 def get_key_blocking(key, default=None):
-    return blocking_connection.get(key) or str(default).encode()
+    return get_blocking_connection().get(key) or str(default).encode()
 
 
 def set_key_blocking(key, value):
-    blocking_connection.set(key, value)
+    get_blocking_connection().set(key, value)
 
 
 async def ping_redis():
@@ -71,6 +90,70 @@ async def ping_redis():
         await asyncio.sleep(PING_TIME)
 
 
+class EventCoalescer:
+    """ Gather the pub/sub messages received during COALESCE_DELAY and hand
+    them at once to handler, as a {channel: message, } dict, so a burst of
+    messages only refreshes the UI once.
+    The nicknames of the enibar-notes and enibar-delete messages are merged,
+    any other channel only keeps its last message.
+    """
+    def __init__(self, handler, delay=COALESCE_DELAY):
+        """
+        :param coroutine handler: Called with the gathered messages
+        :param float delay: Time to wait for other messages, in seconds
+        """
+        self.handler = handler
+        self.delay = delay
+        self.pending = {}
+        self.task = None
+        self.received = 0
+        self.handled = 0
+
+    def push(self, channel, message):
+        """ Add a message, it is handled at most delay seconds later.
+        """
+        self.received += 1
+        if channel == 'enibar-notes':
+            notes = self.pending.setdefault(channel, {})
+            deleted = self.pending.get('enibar-delete', {})
+            if not isinstance(message, dict):
+                message = dict.fromkeys(message)
+            for nick, payload in message.items():
+                deleted.pop(nick, None)
+                if nick in notes:
+                    current = notes[nick]
+                    # No payload means the note must be fetched again, which
+                    # is always up to date.
+                    if current is None or (payload is not None and payload['version'] < current['version']):
+                        continue
+                notes[nick] = payload
+        elif channel == 'enibar-delete':
+            deleted = self.pending.setdefault(channel, {})
+            notes = self.pending.get('enibar-notes', {})
+            for nick in message:
+                notes.pop(nick, None)
+                deleted[nick] = None
+        else:
+            self.pending[channel] = message
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._handle_later())
+
+    async def _handle_later(self):
+        # The messages received while the handler runs are handled by this
+        # same task afterwards, so two runs of the handler never overlap.
+        try:
+            while self.pending:
+                await asyncio.sleep(self.delay)
+                events, self.pending = self.pending, {}
+                if 'enibar-delete' in events:
+                    events['enibar-delete'] = list(events['enibar-delete'])
+                self.handled += 1
+                await self.handler(events)
+        finally:
+            self.task = None
+
+
 class LockingException(Exception):
     pass
 
@@ -81,10 +164,10 @@ LOCKS = {}
 
 
 def lock(lock_name, ttl):
-    if blocking_connection.exists(lock_name):
+    if get_blocking_connection().exists(lock_name):
         return False
     LOCKS[lock_name] = ttl
-    blocking_connection.set(lock_name, "", ttl)
+    get_blocking_connection().set(lock_name, "", ttl)
     return True
 
 
@@ -93,11 +176,11 @@ def unlock(lock_name):
         raise LockingException
 
     del LOCKS[lock_name]
-    blocking_connection.delete(lock_name)
+    get_blocking_connection().delete(lock_name)
 
 
 def _renew_lock(lock_name, ttl):
-    blocking_connection.expire(lock_name, ttl)
+    get_blocking_connection().expire(lock_name, ttl)
 
 
 def _renew_locks():
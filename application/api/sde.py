@@ -2,82 +2,201 @@ import aiohttp
 import api.notes
 import api.redis
 import asyncio
+import collections
+import itertools
 import settings
 import json
 
 
 QUEUE_NAME = "enibar-queue-sde"
+# Maximum number of items sent to the SDE at once
+QUEUE_BATCH_SIZE = 50
+# Seconds to wait after a batch failed, doubled on each failure in a row
+QUEUE_BACKOFF = 2
+QUEUE_MAX_BACKOFF = 60
+# Items which failed this many times are moved to DEAD_LETTER_NAME so they
+# don't block the items queued behind them.
+QUEUE_MAX_ATTEMPTS = 10
+DEAD_LETTER_NAME = "enibar-queue-sde-dead"
 
 
 class QueueProcessingException(Exception):
     pass
 
 
+async def _push(items):
+    """ Queue items for the SDE with a single RPUSH
+
+    :param list items: The items to queue, as dicts
+    """
+    if not items:
+        return
+    with await api.redis.connection as redis:
+        await redis.rpush(QUEUE_NAME, *(json.dumps(item) for item in items))
+
+
 async def send_notes(notes):
-    for note in api.notes.get(lambda n: n['nickname'] in notes):
-        req = {"token": settings.AUTH_SDE_TOKEN, "type": "note", "id": note["id"], "nickname": note["nickname"],
-            "mail": note["mail"], "note": note["note"]}
-        with await api.redis.connection as redis:
-            await redis.rpush(QUEUE_NAME, json.dumps(req))
+    items = []
+    for nick in dict.fromkeys(notes):
+        note = api.notes.get_by_nick(nick)
+        if note is None:
+            continue
+        items.append({"token": settings.AUTH_SDE_TOKEN, "type": "note", "id": note["id"], "nickname": note["nickname"],
+            "mail": note["mail"], "note": note["note"]})
+    await _push(items)
 
 
 async def send_note_deletion(notes_id):
-    for note_id in notes_id:
-        req = {"token": settings.AUTH_SDE_TOKEN, "type": "note-delete", "id": note_id}
-        with await api.redis.connection as redis:
-            await redis.rpush(QUEUE_NAME, json.dumps(req))
+    await _push([{"token": settings.AUTH_SDE_TOKEN, "type": "note-delete", "id": note_id}
+                 for note_id in notes_id])
 
 
 async def send_history_lines(lines):
-    with await api.redis.connection as redis:
-        for line in lines:
-            try:
-                line.pop("deletable")
-            except KeyError:
-                pass
-            line["type"] = "history"
-            line["token"] = settings.AUTH_SDE_TOKEN
-            await redis.rpush(QUEUE_NAME, json.dumps(line))
+    for line in lines:
+        try:
+            line.pop("deletable")
+        except KeyError:
+            pass
+        line["type"] = "history"
+        line["token"] = settings.AUTH_SDE_TOKEN
+    await _push(lines)
 
 
 async def send_history_deletion(lines_id):
-    for line_id in lines_id:
-        req = {"token": settings.AUTH_SDE_TOKEN, "type": "history-delete", "id": line_id}
-        with await api.redis.connection as redis:
-            await redis.rpush(QUEUE_NAME, json.dumps(req))
+    await _push([{"token": settings.AUTH_SDE_TOKEN, "type": "history-delete", "id": line_id}
+                 for line_id in lines_id])
 
 
 async def process_queue():
-    with await api.redis.connection as redis:
-        while True:
+    """ Send the queued items to the SDE.
+    Up to QUEUE_BATCH_SIZE items are popped at once and sent concurrently on
+    one keep-alive session, items about the same note or history line are
+    still sent in order. Items that failed go back to the head of the queue
+    and the worker only backs off when a whole batch failed. An item which
+    failed QUEUE_MAX_ATTEMPTS times goes to DEAD_LETTER_NAME instead.
+    """
+    backoff = 0
+    async with aiohttp.ClientSession() as session:
+        with await api.redis.connection as redis:
+            while True:
+                items = []
+                try:
+                    items = await _pop_items(redis)
+                    popped = len(items)
+                    # From now on only the failed items are still ours.
+                    failed, dead = await _process_items(session, items)
+                    items = failed + dead
+                    if dead:
+                        print("Giving up on {} sde item(s)".format(len(dead)))
+                        await redis.rpush(DEAD_LETTER_NAME, *dead)
+                    items = failed
+                    sent = popped - len(failed)
+                    if items:
+                        await redis.lpush(QUEUE_NAME, *reversed(items))
+                        items = []
+                    if sent:
+                        backoff = 0
+                    else:
+                        backoff = min(backoff * 2 or QUEUE_BACKOFF, QUEUE_MAX_BACKOFF)
+                        await asyncio.sleep(backoff)
+                except asyncio.CancelledError:
+                    # Don't lose what we popped, sending an item twice is fine.
+                    if items:
+                        await redis.lpush(QUEUE_NAME, *reversed(items))
+                    redis.close()
+                    return
+                except Exception as e:
+                    print(e)
+                    if items:
+                        await redis.lpush(QUEUE_NAME, *reversed(items))
+                    backoff = min(backoff * 2 or QUEUE_BACKOFF, QUEUE_MAX_BACKOFF)
+                    await asyncio.sleep(backoff)
+
+
+async def _pop_items(redis):
+    """ Wait for an item and pop it along with the next QUEUE_BATCH_SIZE - 1
+    ones.
+    """
+    _, first = await redis.blpop(QUEUE_NAME)
+    try:
+        transaction = redis.multi_exec()
+        others = transaction.lrange(QUEUE_NAME, 0, QUEUE_BATCH_SIZE - 2)
+        transaction.ltrim(QUEUE_NAME, QUEUE_BATCH_SIZE - 1, -1)
+        await transaction.execute()
+        others = await others
+    except BaseException:
+        # The first item is only in memory until we return it.
+        await redis.lpush(QUEUE_NAME, first)
+        raise
+    return [first] + others
+
+
+async def _process_items(session, items):
+    """ Send items to the SDE and return the ones that couldn't be sent.
+    Items are grouped by what they are about, the groups are sent concurrently
+    and a group stops at its first failure so its items are never sent out of
+    order. The attempts of the failed item are counted in it, once it reached
+    QUEUE_MAX_ATTEMPTS it is given up and the group goes on.
+
+    :return tuple: ([items to retry, ], [items given up, ])
+    """
+    groups = collections.OrderedDict()
+    for index, item in enumerate(items):
+        try:
+            parsed = json.loads(item.decode())
+            key = (parsed['type'].replace('-delete', ''), parsed.get('id'))
+        except (ValueError, KeyError, AttributeError):
+            print("Dropping invalid sde item", item)
+            continue
+        groups.setdefault(key, []).append(index)
+
+    dead = []
+
+    async def send_group(indexes):
+        for position, index in enumerate(indexes):
             try:
-                item = await redis.blpop(QUEUE_NAME)
-                await _process_queue_item(item[1])
-            except asyncio.CancelledError:
-                redis.close()
-                return
+                await _process_queue_item(items[index], session)
             except Exception as e:
                 print(e)
-                await redis.lpush(QUEUE_NAME, item[1])
-                await asyncio.sleep(60)
+                items[index], attempts = _count_attempt(items[index])
+                if attempts < QUEUE_MAX_ATTEMPTS:
+                    return indexes[position:]
+                dead.append(items[index])
+        return []
+
+    results = await asyncio.gather(*(send_group(group) for group in groups.values()))
+    return [items[index] for index in sorted(itertools.chain(*results))], dead
+
+
+def _count_attempt(item):
+    """ Count a failed attempt to send an item
+
+    :param bytes item: The queued item
+    :return tuple: (the item with its attempts updated, number of attempts)
+    """
+    parsed = json.loads(item.decode())
+    parsed['attempts'] = parsed.get('attempts', 0) + 1
+    return json.dumps(parsed).encode(), parsed['attempts']
 
 
-async def _process_queue_item(item):
+async def _process_queue_item(item, session=None):
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await _process_queue_item(item, session)
+
     parsed_item = json.loads(item.decode())
     parsed_item['token'] = settings.AUTH_SDE_TOKEN
+    parsed_item.pop('attempts', None)
     type_ = parsed_item.pop('type')
     if settings.USE_PROXY:
         proxy = settings.PROXY_AUTH
     else:
         proxy = None
     if type_.endswith('-delete'):
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(settings.WEB_URL + type_[:-7], data=json.dumps(parsed_item), proxy=proxy) as req:
-                if req.status != 200:
-                    raise QueueProcessingException(req.status)
+        async with session.delete(settings.WEB_URL + type_[:-7], data=json.dumps(parsed_item), proxy=proxy) as req:
+            if req.status != 200:
+                raise QueueProcessingException(req.status)
     else:
-        async with aiohttp.ClientSession() as session:
-            async with session.put(settings.WEB_URL + type_, data=json.dumps(parsed_item), proxy=proxy) as req:
-                if req.status != 200:
-                    raise QueueProcessingException(req.status)
-
+        async with session.put(settings.WEB_URL + type_, data=json.dumps(parsed_item), proxy=proxy) as req:
+            if req.status != 200:
+                raise QueueProcessingException(req.status)
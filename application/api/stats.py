@@ -31,25 +31,22 @@ STATS_FIELDS_CACHE = {}
 
 def get_notes_stats():
     """ Yield dicts representing stats.
+    They are read from stats_rollup, which the transactions triggers keep up
+    to date, so the history is never scanned here.
 
         {'nickname', 'product', 'price_name', 'price', 'category', 'quantity'}
     """
     global STATS_FIELDS_CACHE
     with Cursor() as cursor:
         cursor.prepare("SELECT notes.nickname AS nickname,\
-                        transactions.product AS product,\
-                        transactions.price_name AS price_name,\
-                        transactions.price/transactions.quantity AS price,\
-                        transactions.category AS category,\
-                        SUM(transactions.quantity) AS quantity \
-                        FROM transactions JOIN notes ON \
-                        ((notes.lastname = transactions.lastname AND \
-                        notes.firstname = transactions.firstname) OR \
-                        notes.nickname = transactions.note) AND \
-                        notes.stats_inscription = TRUE \
-                        GROUP BY notes.nickname, transactions.product,\
-                        transactions.price_name, transactions.price, \
-                        transactions.quantity, transactions.category")
+                        stats_rollup.product AS product,\
+                        stats_rollup.price_name AS price_name,\
+                        stats_rollup.price AS price,\
+                        stats_rollup.category AS category,\
+                        stats_rollup.quantity AS quantity \
+                        FROM stats_rollup JOIN notes ON \
+                        notes.id = stats_rollup.note_id AND \
+                        notes.stats_inscription = TRUE")
         cursor.exec_()
         while cursor.next():
             if not STATS_FIELDS_CACHE:
@@ -27,66 +27,199 @@ consumption bought.
 from PyQt5 import QtSql
 from database import Database, Cursor
 import asyncio
+import collections
+import time
 import api.base
 import api.notes
 import api.sde
-import datetime
+
+
+# Maximum number of rows sent in a single INSERT by log_transactions. This keeps
+# us far from the 65535 bound parameters PostgreSQL accepts per statement.
+LOG_BATCH_SIZE = 500
+LOG_FIELDS = ['note', 'category', 'product', 'price_name', 'quantity', 'price',
+              'firstname', 'lastname', 'liquid_quantity', 'percentage',
+              'deletable', 'note_id']
+
+
+def _log_batch(cursor, rows):
+    """ Insert rows in transactions with a single multi-row INSERT
+
+    :param QSqlQuery cursor: The cursor to use
+    :param list rows: List of dicts with the LOG_FIELDS keys
+    :return bool: True if the rows were inserted
+    """
+    values = ", ".join(
+        "(NOW(), {})".format(", ".join(
+            ":{}_{}".format(field, i) for field in LOG_FIELDS
+        )) for i in range(len(rows))
+    )
+    cursor.prepare("""INSERT INTO transactions(
+            date, {}
+        )
+        VALUES {}
+        RETURNING id, date""".format(", ".join(LOG_FIELDS), values))
+    for i, row in enumerate(rows):
+        for field in LOG_FIELDS:
+            cursor.bindValue(":{}_{}".format(field, i), row[field])
+    return cursor.exec_()
 
 
 def log_transactions(transactions, do_not=False):
     """ Log multiple transactions
+    All the transactions are inserted in a single database transaction, in
+    batches of LOG_BATCH_SIZE rows. Their id, date and note_id are written
+    back in the given dicts.
 
     :param list transactions:
     """
+    transactions = list(transactions)
+    rows = []
+    for trans in transactions:
+        note = api.notes.get_by_nick(trans['note'])
+        if not note:
+            return False
+
+        rows.append({
+            'note': trans['note'],
+            'category': trans['category'],
+            'product': trans['product'],
+            'price_name': trans['price_name'],
+            'quantity': trans['quantity'],
+            'price': trans['price'],
+            'firstname': note['firstname'],
+            'lastname': note['lastname'],
+            'liquid_quantity': trans.get('liquid_quantity', 0),
+            'percentage': trans.get('percentage', 0),
+            'deletable': trans.get('deletable', True),
+            'note_id': note['id'],
+        })
+
     with Database() as database:
         database.transaction()
         cursor = QtSql.QSqlQuery(database)
-        cursor.prepare("""INSERT INTO transactions(
-                date, note, category, product, price_name,
-                quantity, price, firstname, lastname, liquid_quantity,
-                percentage, deletable, note_id
-            )
-            VALUES(
-                NOW(), :note, :category, :product, :price_name,
-                :quantity, :price, :firstname, :lastname, :liquid_quantity,
-                :percentage, :deletable, :note_id
-            )""")
-        now = datetime.datetime.now().isoformat()
-        for trans in transactions:
-            notes = api.notes.get(lambda x: x['nickname'] == trans['note'])
-            if notes:
-                note = notes[0]
-                lastname = note['lastname']
-                firstname = note['firstname']
-                note_id = note['id']
-            else:
+        lines = []
+        for start in range(0, len(rows), LOG_BATCH_SIZE):
+            batch = rows[start:start + LOG_BATCH_SIZE]
+            if not _log_batch(cursor, batch):
+                database.rollback()
                 return False
-
-            cursor.bindValue(':date', now)
-            cursor.bindValue(':note', trans['note'])
-            cursor.bindValue(':category', trans['category'])
-            cursor.bindValue(':product', trans['product'])
-            cursor.bindValue(':price_name', trans['price_name'])
-            cursor.bindValue(':quantity', trans['quantity'])
-            cursor.bindValue(':price', trans['price'])
-            cursor.bindValue(':firstname', firstname)
-            cursor.bindValue(':lastname', lastname)
-            cursor.bindValue(':liquid_quantity', trans.get('liquid_quantity', 0))
-            cursor.bindValue(':percentage', trans.get('percentage', 0))
-            cursor.bindValue(':deletable', trans.get('deletable', True))
-            cursor.bindValue(':note_id', note_id)
-            cursor.exec_()
-            trans["id"] = cursor.lastInsertId()
-            trans["date"] = now
-            trans["note_id"] = note_id
+            for trans, row in zip(transactions[start:], batch):
+                cursor.next()
+                trans["id"] = cursor.value(0)
+                trans["date"] = cursor.value(1).toPyDateTime().isoformat()
+                trans["note_id"] = row['note_id']
+                lines.append((row['note_id'], dict(
+                    {field: row[field] for field in TRANSACT_FIELDS if field in row},
+                    id=cursor.value(0), date=cursor.value(1),
+                    price=float(row['price']), percentage=float(row['percentage'])
+                )))
 
         database.commit()
+        FACETS_CACHE.clear()
         asyncio.ensure_future(api.sde.send_history_lines(transactions))
+        payloads = api.notes.get_payloads(x['note'] for x in transactions)
+        _add_to_history_cache(lines, payloads)
         if not do_not:
-            api.redis.send_message("enibar-notes", list(set(x['note'] for x in transactions)))
+            api.redis.send_message("enibar-notes", payloads)
         return True
 
 
+# Notes charged by apply_agios: in the red for more than :threshold days, not
+# charged for :every days, and without any hidden category.
+AGIO_WHERE = """
+    NOT EXISTS(
+        SELECT note, category FROM note_categories_assoc JOIN note_categories
+        ON note_categories.hidden=TRUE AND note_categories.id=category WHERE note=notes.id
+    )
+    AND overdraft_date < DATE(NOW()) - CAST(:threshold AS INTEGER)
+    AND agios_inscription=TRUE
+    AND (last_agio < DATE(NOW()) - CAST(:every AS INTEGER) OR last_agio IS NULL)
+"""
+
+
+def apply_agios(percent, threshold, every, *, dry_run=False, do_not=False):
+    """ Charge the agios of every eligible note in a single statement. The
+    AGIO lines are inserted from the notes themselves, so the balances are
+    updated by the transactions triggers, and last_agio is set along.
+
+    :param float percent: Agio, in percent of the balance
+    :param int threshold: Days a note must be in the red before being charged
+    :param int every: Days between two agios of a note
+    :param bool dry_run: Only compute what would be charged
+    :return dict: {'lines': [{note, balance, price, ...}, ], 'count', 'total'}
+    """
+    if dry_run:
+        request = """
+            SELECT nickname AS note, note AS balance, ROUND(note * :percent / 100, 2) AS price
+            FROM notes WHERE {}
+            ORDER BY nickname""".format(AGIO_WHERE)
+    else:
+        request = """
+            WITH eligible AS (
+                SELECT id, nickname, firstname, lastname, note FROM notes
+                WHERE {}
+                FOR UPDATE
+            ), stamped AS (
+                UPDATE notes SET last_agio=DATE(NOW())
+                FROM eligible WHERE notes.id=eligible.id
+            ), lines AS (
+                INSERT INTO transactions(
+                    date, note, category, product, price_name, quantity, price,
+                    firstname, lastname, liquid_quantity, percentage, deletable, note_id
+                )
+                SELECT NOW(), nickname, 'AGIO', '', '', 1, ROUND(note * :percent / 100, 2),
+                    firstname, lastname, 0, 0, TRUE, id
+                FROM eligible
+                RETURNING id, date, note, note_id, price
+            )
+            SELECT lines.*, eligible.note AS balance
+            FROM lines JOIN eligible ON eligible.id=lines.note_id
+            ORDER BY lines.note""".format(AGIO_WHERE)
+
+    lines = []
+    with Cursor() as cursor:
+        cursor.prepare(request)
+        cursor.bindValue(":percent", percent)
+        cursor.bindValue(":threshold", threshold)
+        cursor.bindValue(":every", every)
+        if not cursor.exec_():
+            return None
+        while cursor.next():
+            line = {
+                'note': cursor.value('note'),
+                'balance': float(cursor.value('balance')),
+                'price': float(cursor.value('price')),
+            }
+            if not dry_run:
+                line.update({
+                    'id': cursor.value('id'),
+                    'date': cursor.value('date').toPyDateTime().isoformat(),
+                    'note_id': cursor.value('note_id'),
+                    'category': 'AGIO',
+                    'product': '',
+                    'price_name': '',
+                    'quantity': 1,
+                })
+            lines.append(line)
+
+    summary = {
+        'lines': lines,
+        'count': len(lines),
+        'total': round(sum(line['price'] for line in lines), 2),
+    }
+    if dry_run or not lines:
+        return summary
+
+    FACETS_CACHE.clear()
+    asyncio.ensure_future(api.sde.send_history_lines(
+        [{key: value for key, value in line.items() if key != 'balance'} for line in lines]
+    ))
+    if not do_not:
+        api.redis.send_message("enibar-notes", [line['note'] for line in lines])
+    return summary
+
+
 def rollback_transaction(id_, full=False):
     """ Rollback transaction
     And refill note with money
@@ -99,14 +232,12 @@ def rollback_transaction(id_, full=False):
         return False
 
     try:
-        def filter_(x):
-            return x['firstname'] == trans['firstname'] and \
-                x['lastname'] == trans['lastname']
-        note = api.notes.get(filter_)[0]
+        note = api.notes.get_by_name(trans['firstname'], trans['lastname'])[0]
     except IndexError:
         return False
 
     quantity = int(trans['quantity'])
+    HISTORY_CACHE.pop(note['id'], None)
 
     with Cursor() as cursor:
         if quantity > 1 and not full:
@@ -126,7 +257,8 @@ def rollback_transaction(id_, full=False):
         cursor.exec_()
         if not cursor.lastError().isValid() and cursor.numRowsAffected() > 0:
             asyncio.ensure_future(task)
-            api.redis.send_message("enibar-notes", [note['nickname']])
+            FACETS_CACHE.clear()
+            api.redis.send_message("enibar-notes", api.notes.get_payloads([note['nickname']]))
             return True
         task.close()
     return False
@@ -169,6 +301,82 @@ def get_possible_filter_values(col, filters):
             yield cursor.value(FILTER_FIELDS_CACHE[col])
 
 
+# Columns the history can be filtered on.
+HISTORY_FILTERS = ['note', 'lastname', 'firstname', 'category', 'product']
+# Facets are kept this many seconds, keyed by the active filters, oldest
+# first.
+FACETS_CACHE_TTL = 5
+FACETS_CACHE = collections.OrderedDict()
+FACETS_CACHE_SIZE = 64
+
+
+def get_filter_facets(filters):
+    """ Get all the possible values of every history filter given the applied
+    filters. This is the same as calling get_possible_filter_values for each
+    column in HISTORY_FILTERS but only scans the transactions once, and the
+    result is cached for FACETS_CACHE_TTL seconds.
+
+    :param dict filters: A dict giving corresponding value to filters
+    :return dict: {column: [values, ], }
+    """
+    key = frozenset(filters.items())
+    cached = FACETS_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < FACETS_CACHE_TTL:
+        return cached[1]
+
+    aggregates = []
+    conditions = []
+    values = {}
+    for col in HISTORY_FILTERS:
+        # Like get_possible_filter_values, a column isn't filtered by itself.
+        sqlfilters = []
+        for filter_col, value in filters.items():
+            if filter_col != col:
+                sqlfilters.append("{c}=:{col}_{c}".format(c=filter_col, col=col))
+                values[":{}_{}".format(col, filter_col)] = value
+        if col == 'product' and filters.get('category', '') != "Note":
+            sqlfilters.append("category != 'Note'")
+
+        condition = ' AND '.join(sqlfilters) or "TRUE"
+        conditions.append("({})".format(condition))
+        aggregates.append(
+            "array_agg(DISTINCT {c}) FILTER (WHERE {cond}) AS {c}".format(
+                c=col, cond=condition)
+        )
+
+    unnest = ' UNION ALL '.join(
+        "SELECT '{c}' AS col, unnest({c}) AS value FROM facets".format(c=col)
+        for col in HISTORY_FILTERS
+    )
+    with Cursor() as cursor:
+        cursor.prepare("""
+            WITH facets AS (
+                SELECT {aggregates} FROM transactions WHERE {where}
+            )
+            SELECT col, value FROM ({unnest}) AS facet
+            ORDER BY value
+            """.format(aggregates=', '.join(aggregates),
+                       where=' OR '.join(conditions), unnest=unnest)
+        )
+        cursor.bindValues(values)
+        cursor.exec_()
+
+        facets = {col: [] for col in HISTORY_FILTERS}
+        while cursor.next():
+            facets[cursor.value(0)].append(cursor.value(1))
+
+    now = time.monotonic()
+    FACETS_CACHE.pop(key, None)
+    FACETS_CACHE[key] = (now, facets)
+    # Drop the expired facets so the cache doesn't grow while nothing is sold.
+    while FACETS_CACHE:
+        oldest, (cached_at, _) = next(iter(FACETS_CACHE.items()))
+        if now - cached_at < FACETS_CACHE_TTL and len(FACETS_CACHE) <= FACETS_CACHE_SIZE:
+            break
+        del FACETS_CACHE[oldest]
+    return facets
+
+
 TRANSACTS_FIELDS_CACHE = {}
 TRANSACT_FIELDS = ['id', 'date', 'note', 'lastname', 'firstname', 'category',
                    'product', 'price_name', 'quantity', 'price', 'liquid_quantity', 'percentage']
@@ -176,19 +384,203 @@ TRANSACT_FIELDS = ['id', 'date', 'note', 'lastname', 'firstname', 'category',
 
 def get(max_=None, reverse=False, **filter_):
     """ Get transactions matching filter.
+    Prefer filtering a note history on note_id, it is indexed with id so the
+    latest transactions of a note are read straight from the index.
 
     :param dict filter_: filter to apply
     """
     global TRANSACTS_FIELDS_CACHE
-    cursor = api.base.filtered_getter("transactions", filter_, max_=max_, reverse=reverse)
-
-    if TRANSACTS_FIELDS_CACHE == {}:
-        TRANSACTS_FIELDS_CACHE = {field: cursor.indexOf(field) for field
-                                  in TRANSACT_FIELDS}
+    with api.base.filtered_getter("transactions", filter_, max_=max_, reverse=reverse) as cursor:
+        if TRANSACTS_FIELDS_CACHE == {}:
+            TRANSACTS_FIELDS_CACHE = {field: cursor.indexOf(field) for field
+                                      in TRANSACT_FIELDS}
 
-    while cursor.next():
-        yield {field: cursor.value(TRANSACTS_FIELDS_CACHE[field]) for field
-               in TRANSACT_FIELDS}
+        while cursor.next():
+            yield {field: cursor.value(TRANSACTS_FIELDS_CACHE[field]) for field
+                   in TRANSACT_FIELDS}
 
 
 get_unique = api.base.make_get_unique(get)
+
+
+# Latest transactions of the notes recently shown, least recently used first:
+# {note_id: {'lines': [newest first, ], 'max': int, 'version': int}, }
+# 'version' is the version of the note the lines are up to date with.
+HISTORY_CACHE = collections.OrderedDict()
+HISTORY_CACHE_SIZE = 64
+
+
+def get_note_history(note_id, max_):
+    """ Get the latest transactions of a note, newest first. They are served
+    from HISTORY_CACHE when possible.
+
+    :param int note_id: The id of the note
+    :param int max_: Maximum number of transactions to return
+    """
+    entry = HISTORY_CACHE.get(note_id)
+    if entry is None or entry['max'] != max_:
+        note = api.notes.get_by_id(note_id)
+        entry = {
+            'lines': list(get(note_id=note_id, reverse=True, max_=max_)),
+            'max': max_,
+            'version': note['version'] if note else None,
+        }
+        HISTORY_CACHE[note_id] = entry
+        while len(HISTORY_CACHE) > HISTORY_CACHE_SIZE:
+            HISTORY_CACHE.popitem(last=False)
+    HISTORY_CACHE.move_to_end(note_id)
+    return list(entry['lines'])
+
+
+def _add_to_history_cache(lines, payloads):
+    """ Add freshly logged transactions to the cached histories
+
+    :param list lines: (note_id, transaction) tuples, oldest first
+    :param dict payloads: The notes payloads once the transactions are logged
+    """
+    for note_id, line in lines:
+        entry = HISTORY_CACHE.get(note_id)
+        if entry is not None:
+            entry['lines'].insert(0, line)
+            del entry['lines'][entry['max']:]
+
+    for nick, payload in payloads.items():
+        note = api.notes.get_by_nick(nick)
+        if note and note['id'] in HISTORY_CACHE:
+            HISTORY_CACHE[note['id']]['version'] = payload['version'] if payload else None
+
+
+def invalidate_history_cache(message):
+    """ Drop the cached history of the notes of an enibar-notes message,
+    unless the message is about the version the cache is already up to date
+    with.
+
+    :param message: {nickname: payload, } or [nickname, ]
+    """
+    for nick in message:
+        note = api.notes.get_by_nick(nick)
+        if note is None or note['id'] not in HISTORY_CACHE:
+            continue
+        payload = message[nick] if isinstance(message, dict) else None
+        if payload is None or payload['version'] != HISTORY_CACHE[note['id']]['version']:
+            del HISTORY_CACHE[note['id']]
+
+
+# Number of transactions fetched at once by get_batches.
+STREAM_BATCH_SIZE = 1000
+
+
+def get_batches(batch_size=STREAM_BATCH_SIZE, **filter_):
+    """ Get transactions matching filter, by lists of at most batch_size
+    transactions. Unlike get, the rows are read through a server side cursor
+    so memory doesn't grow with the size of the history.
+
+    :param int batch_size: Number of transactions per list
+    :param dict filter_: filter to apply
+    """
+    for cursor in api.base.streamed_getter("transactions", filter_, batch_size):
+        indexes = {field: cursor.indexOf(field) for field in TRANSACT_FIELDS}
+        # The cursor is already on the first row of the batch.
+        batch = [{field: cursor.value(indexes[field]) for field in TRANSACT_FIELDS}]
+        while cursor.next():
+            batch.append({field: cursor.value(indexes[field]) for field
+                          in TRANSACT_FIELDS})
+        yield batch
+
+
+def _history_where(filters, start, end):
+    """ Build the WHERE clause and the values to bind for a history query
+
+    :param dict filters: {column: value, } only HISTORY_FILTERS are used
+    :param QDateTime start: Only keep transactions after this date
+    :param QDateTime end: Only keep transactions before this date
+    :return tuple: (clause, {placeholder: value, })
+    """
+    conditions = ["date >= :start", "date <= :end"]
+    values = {':start': start, ':end': end}
+    for key in HISTORY_FILTERS:
+        if filters.get(key):
+            conditions.append("{key}=:{key}".format(key=key))
+            values[':{}'.format(key)] = filters[key]
+    return " AND ".join(conditions), values
+
+
+# Columns the history can be sorted by, with their SQL type.
+SORT_COLUMNS = {
+    'date': "TIMESTAMP WITH TIME ZONE",
+    'note': "VARCHAR",
+    'category': "VARCHAR",
+    'product': "VARCHAR",
+    'price_name': "VARCHAR",
+    'quantity': "INTEGER",
+    'price': "DECIMAL",
+    'id': "INTEGER",
+}
+
+
+def get_page(filters, start, end, after=None, max_=100, order_by="date", descending=True):
+    """ Get a page of the history, newest transactions first by default.
+    Pages are chained with keyset pagination on (order_by, id): pass the
+    'sort_key' and 'id' of the last transaction of a page as `after` to get
+    the next one.
+
+    :param dict filters: {column: value, } only HISTORY_FILTERS are used
+    :param QDateTime start: Only keep transactions after this date
+    :param QDateTime end: Only keep transactions before this date
+    :param tuple after: (sort_key, id) of the last transaction already fetched
+    :param int max_: Maximum number of transactions to return
+    :param str order_by: Column to sort by, one of SORT_COLUMNS
+    :param bool descending: Sort in descending order
+    """
+    sql_type = SORT_COLUMNS[order_by]
+    where, values = _history_where(filters, start, end)
+    if after is not None:
+        where += " AND ({col}, id) {op} (CAST(:after_key AS {type}), :after_id)".format(
+            col=order_by, op="<" if descending else ">", type=sql_type
+        )
+        values[':after_key'], values[':after_id'] = after
+
+    order = "DESC" if descending else "ASC"
+    with Cursor() as cursor:
+        cursor.prepare("""
+            SELECT *, {col}::text AS sort_key FROM transactions
+            WHERE {where}
+            ORDER BY {col} {order}, id {order}
+            LIMIT {max_}
+            """.format(col=order_by, where=where, order=order, max_=int(max_))
+        )
+        cursor.bindValues(values)
+        cursor.exec_()
+        while cursor.next():
+            line = {field: cursor.value(field) for field in TRANSACT_FIELDS}
+            line['sort_key'] = cursor.value('sort_key')
+            yield line
+
+
+def get_summary(filters, start, end):
+    """ Get the total quantity, credit and debit of the history
+
+    :param dict filters: {column: value, } only HISTORY_FILTERS are used
+    :param QDateTime start: Only keep transactions after this date
+    :param QDateTime end: Only keep transactions before this date
+    :return dict: {'quantity', 'credited', 'debited'}
+    """
+    where, values = _history_where(filters, start, end)
+    with Cursor() as cursor:
+        cursor.prepare("""
+            SELECT COALESCE(SUM(quantity), 0) AS quantity,
+                COALESCE(SUM(CASE WHEN price >= 0 THEN price ELSE 0 END), 0) AS credited,
+                COALESCE(SUM(CASE WHEN price < 0 THEN price ELSE 0 END), 0) AS debited
+            FROM transactions
+            WHERE {}
+            """.format(where)
+        )
+        cursor.bindValues(values)
+        cursor.exec_()
+        if cursor.next():
+            return {
+                'quantity': cursor.value('quantity'),
+                'credited': cursor.value('credited'),
+                'debited': cursor.value('debited'),
+            }
+        return {'quantity': 0, 'credited': 0, 'debited': 0}
@@ -58,9 +58,9 @@ def get_list(**filter_):
     if any(right not in RIGHTS for right in filter_):
         return
 
-    cursor = api.base.filtered_getter("admins", filter_, order_by="login")
-    while cursor.next():
-        yield cursor.value('login')
+    with api.base.filtered_getter("admins", filter_, order_by="login") as cursor:
+        while cursor.next():
+            yield cursor.value('login')
 
 
 def get_rights(username):
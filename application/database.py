@@ -31,20 +31,62 @@ You can use the DB class like that:
     with Cursor() as cursor:
         # Use your cursor here
         cursor.prepare(...)
+
+Queries can also run on a worker thread, each worker using its own
+connection, and their result is delivered through an asyncio future:
+
+.. code-block:: python
+
+    from database import run_in_thread
+
+
+    lines = await run_in_thread(lambda: list(api.stats.get_notes_stats()))
+
+Statements run often can be prepared once and reused from the statement
+cache. The query is only valid inside the with block:
+
+.. code-block:: python
+
+    from database import STATEMENTS
+
+
+    with STATEMENTS.prepared(key, lambda: "SELECT ...") as cursor:
+        cursor.bindValues(...)
+        cursor.exec_()
 """
 
 
-from PyQt5 import QtSql, QtWidgets
+from PyQt5 import QtCore, QtSql
 import asyncio
+import collections
+import contextlib
+import itertools
 import rapi
 import os
 import settings
 import sys
+import threading
+
+
+# Number of threads running queries in the background, each one holds its own
+# connection to the database.
+DB_WORKERS = 4
+# Number of prepared statements kept on the main connection.
+STATEMENT_CACHE_SIZE = 128
+# SQLSTATE of "cached plan must not change result type", raised for statements
+# prepared before a table they select * from was altered.
+STALE_PLAN_ERROR = "0A000"
 
 
 class Database:
-    """ Context manager to use the database """
+    """ Context manager to use the database
+    The main thread shares the class level connection, every other thread
+    gets its own named connection as a QSqlDatabase can only be used from the
+    thread which opened it.
+    """
     database = None
+    _local = threading.local()
+    _worker_ids = itertools.count()
 
     def __init__(self):
         self.connect()
@@ -55,40 +97,67 @@ class Database:
     def __exit__(self, type_, value, traceback):
         pass
 
+    @staticmethod
+    def _open(database):
+        """ Set the connection parameters of a QSqlDatabase and open it
+
+        :param QSqlDatabase database: The connection to open
+        :return bool: True if the connection is open
+        """
+        database.setHostName(os.environ.get(
+            "DATABASE_HOST",
+            settings.DB_HOST
+        ))
+        database.setPort(int(os.environ.get(
+            "DATABASE_PORT",
+            settings.DB_PORT,
+        )))
+        database.setUserName(os.environ.get(
+            "DATABASE_USER",
+            settings.USERNAME
+        ))
+        database.setPassword(os.environ.get(
+            "DATABASE_PASSWORD",
+            settings.PASSWORD
+        ))
+        database.setDatabaseName(os.environ.get(
+            "DATABASE_NAME",
+            settings.DBNAME
+        ))
+        return database.open()
+
     def connect(self):
         """ Connect to the database and set some parameters.
         """
+        if threading.current_thread() is not threading.main_thread():
+            self.database = self._worker_connection()
+            return
+
         if Database.database is None:
             Database.database = QtSql.QSqlDatabase("QPSQL")
-            Database.database.setHostName(os.environ.get(
-                "DATABASE_HOST",
-                settings.DB_HOST
-            ))
-            Database.database.setPort(int(os.environ.get(
-                "DATABASE_PORT",
-                settings.DB_PORT,
-            )))
-            Database.database.setUserName(os.environ.get(
-                "DATABASE_USER",
-                settings.USERNAME
-            ))
-            Database.database.setPassword(os.environ.get(
-                "DATABASE_PASSWORD",
-                settings.PASSWORD
-            ))
-            Database.database.setDatabaseName(os.environ.get(
-                "DATABASE_NAME",
-                settings.DBNAME
-            ))
-            if not Database.database.open():
+            if not self._open(Database.database):
                 if rapi.utils.check_x11():
                     # We need this to create an app before opening a window.
                     import gui.utils
+                    from PyQt5 import QtWidgets
                     self.tmp = QtWidgets.QApplication(sys.argv)
                     gui.utils.error("Error", "Can't join database")
                 print("Can't join database")
                 sys.exit(1)
 
+    def _worker_connection(self):
+        """ Get the connection of the current worker thread, open it if needed.
+        """
+        database = getattr(self._local, 'database', None)
+        if database is None:
+            database = QtSql.QSqlDatabase.addDatabase(
+                "QPSQL", "enibar-worker-{}".format(next(self._worker_ids))
+            )
+            if not self._open(database):
+                raise ConnectionError(database.lastError().text())
+            self._local.database = database
+        return database
+
 
 class Cursor(Database):
     """ Context manager to use the cursor """
@@ -157,6 +226,137 @@ class SqlQuery(QtSql.QSqlQuery):
             return ret
 
 
+class StatementCache:
+    """ Prepared queries of the main connection, indexed by a key describing
+    the statement. PostgreSQL then parses and plans a statement the first time
+    it is used instead of on every call.
+    A query is lent to one user at a time: if its statement is already in use,
+    by a generator which hasn't been exhausted for example, a new query is
+    prepared and thrown away after use.
+    Once a query failed because its plan is stale, after a migration for
+    example, every statement is prepared again.
+    """
+    def __init__(self, size=STATEMENT_CACHE_SIZE):
+        self.size = size
+        self.statements = collections.OrderedDict()
+        self.busy = set()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """ Forget every prepared query and reset the counters """
+        self.statements.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @contextlib.contextmanager
+    def prepared(self, key, build):
+        """ Get a prepared query, only valid in the with block.
+
+        :param key: Hashable describing the statement, every statement built
+            for the same key must be the same.
+        :param callable build: Returns the SQL of the statement, only called
+            if it isn't already prepared.
+        """
+        # Worker threads have their own connection and no cache.
+        if threading.current_thread() is not threading.main_thread():
+            with Cursor() as cursor:
+                cursor.prepare(build())
+                yield cursor
+            return
+
+        cached = key not in self.busy
+        query = self.statements.get(key) if cached else None
+        if query is None:
+            self.misses += 1
+            with Cursor() as query:
+                if query.prepare(build()) and cached:
+                    self.statements[key] = query
+                    while len(self.statements) > self.size:
+                        self.statements.popitem(last=False)
+        else:
+            self.hits += 1
+            self.statements.move_to_end(key)
+
+        if not cached:
+            try:
+                yield query
+            finally:
+                self._check_stale(query)
+            return
+
+        self.busy.add(key)
+        try:
+            yield query
+        finally:
+            self.busy.discard(key)
+            self._check_stale(query)
+            # Release the result set, the query stays prepared.
+            query.finish()
+
+    def _check_stale(self, query):
+        """ Forget every prepared query if query failed on a stale plan, the
+        tables were probably altered so the others are stale too.
+        """
+        if query.lastError().nativeErrorCode() == STALE_PLAN_ERROR:
+            self.statements.clear()
+
+
+STATEMENTS = StatementCache()
+
+
+class _Job(QtCore.QRunnable):
+    """ Run a function on the worker pool and resolve a future with its result
+    """
+    def __init__(self, loop, future, func, args, kwargs):
+        super().__init__()
+        self.loop = loop
+        self.future = future
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            self.loop.call_soon_threadsafe(self._resolve, self.future.set_exception, e)
+        else:
+            self.loop.call_soon_threadsafe(self._resolve, self.future.set_result, result)
+
+    def _resolve(self, setter, value):
+        # The caller may have given up on the result.
+        if not self.future.cancelled():
+            setter(value)
+
+
+WORKERS = None
+
+
+def run_in_thread(func, *args, **kwargs):
+    """ Call func on one of the DB_WORKERS worker threads so slow queries don't
+    block the GUI. Every Cursor or Database used by func uses the connection of
+    its worker, so func must be done with its cursors when it returns: return
+    list(api.transactions.get()) rather than the generator itself.
+
+    :param callable func: The function to call
+    :param *args: Its positional arguments
+    :param **kwargs: Its keyword arguments
+    :return asyncio.Future: Resolved with the result of func
+    """
+    global WORKERS
+    if WORKERS is None:
+        WORKERS = QtCore.QThreadPool()
+        WORKERS.setMaxThreadCount(DB_WORKERS)
+        # Threads are kept alive forever so their connection is reused.
+        WORKERS.setExpiryTimeout(-1)
+
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    WORKERS.start(_Job(loop, future, func, args, kwargs))
+    return future
+
+
 async def ping_sql(app):
     while True:
         await asyncio.sleep(10)
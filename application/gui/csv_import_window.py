@@ -65,7 +65,7 @@ class CsvImportWindow(QtWidgets.QDialog):
                 mail = line.get('Mail')
                 if mail:
                     mail = mail.lower()
-                note = api.notes.get(lambda x: x['mail'] == mail)
+                note = api.notes.get_by_mail(mail)
                 if note and not note[0]['hidden']:
                     note = note[0]['nickname']
                     self.notes.append(note)
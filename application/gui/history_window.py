@@ -23,14 +23,135 @@ Transaction hisotry window.
 from PyQt5 import QtWidgets, uic, QtCore
 from .auth_prompt_window import ask_auth
 import api.transactions
-from gui.tree_item_widget import TreeWidget
-import copy
 import datetime
 import time
 import gui.utils
 import collections
 
 
+class TransactionsModel(QtCore.QAbstractTableModel):
+    """ Model backing the history view.
+    Transactions are fetched page by page, newest first unless sorted
+    otherwise, as the view scrolls so opening the history never loads the
+    whole table.
+    """
+    HEADERS = ["Date", "Note", "Categorie", "Consomation", "Type", "Quantité",
+               "Credit", "Debit", "Id"]
+    # Column of the transactions each header sorts by
+    SORT_KEYS = ['date', 'note', 'category', 'product', 'price_name',
+                 'quantity', 'price', 'price', 'id']
+    PAGE_SIZE = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.transactions = []
+        self.filters = {}
+        self.start = None
+        self.end = None
+        self.order_by = 'date'
+        self.descending = True
+        self.exhausted = True
+
+    def set_filters(self, filters, start, end):
+        """ Drop every fetched transaction and fetch the first page matching
+        the new filters.
+
+        :param dict filters: {column: value, }
+        :param QDateTime start: Only show transactions after this date
+        :param QDateTime end: Only show transactions before this date
+        """
+        self.filters = filters
+        self.start = start
+        self.end = end
+        self._refetch()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """ Sort the transactions, PostgreSQL sorts them so the pages still
+        only have to be fetched when the view needs them.
+        """
+        self.order_by = self.SORT_KEYS[column]
+        # The debit column shows -price.
+        self.descending = (order == QtCore.Qt.DescendingOrder) != (column == 7)
+        # Nothing is fetched before the first filters are set.
+        if self.start is not None:
+            self._refetch()
+
+    def _refetch(self):
+        """ Drop every fetched transaction and fetch the first page again
+        """
+        self.beginResetModel()
+        self.transactions = []
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore(QtCore.QModelIndex())
+
+    def transaction(self, row):
+        """ Get the transaction displayed on a row
+        """
+        return self.transactions[row]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.transactions)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        trans = self.transactions[index.row()]
+        column = index.column()
+        if column == 0:
+            return trans['date'].toString("yyyy/MM/dd HH:mm:ss")
+        elif column == 6:
+            return str(round(trans['price'], 2)) if trans['price'] >= 0 else "-"
+        elif column == 7:
+            return str(round(-trans['price'], 2)) if trans['price'] < 0 else "-"
+        key = [None, 'note', 'category', 'product', 'price_name', 'quantity',
+               None, None, 'id'][column]
+        return str(trans[key])
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent):
+        """ Fetch the next page of transactions
+        """
+        if not self.canFetchMore(parent):
+            return
+        after = None
+        if self.transactions:
+            last = self.transactions[-1]
+            after = (last['sort_key'], last['id'])
+        page = list(api.transactions.get_page(
+            self.filters, self.start, self.end, after=after,
+            max_=self.PAGE_SIZE, order_by=self.order_by,
+            descending=self.descending
+        ))
+        self.exhausted = len(page) < self.PAGE_SIZE
+        if not page:
+            return
+        first = len(self.transactions)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(page) - 1)
+        self.transactions.extend(page)
+        self.endInsertRows()
+
+    def fetch_all(self):
+        """ Fetch every remaining page of transactions
+        """
+        while self.canFetchMore(QtCore.QModelIndex()):
+            self.fetchMore(QtCore.QModelIndex())
+
+
 class HistoryWindow(QtWidgets.QDialog):
     """ Base class for transaction history
     This class act like a singleton to avoid rebuilding history each time you
@@ -60,20 +181,21 @@ class HistoryWindow(QtWidgets.QDialog):
             self.updatetimer.timeout.connect(self.update_list)
             self.updatetimer.setInterval(175)
 
+            self.model = TransactionsModel(self)
+            self.transaction_list.setModel(self.model)
+            self.transaction_list.sortByColumn(0, QtCore.Qt.DescendingOrder)
+            self.transaction_list.selectionModel().selectionChanged.connect(
+                self.update_summary_selected
+            )
+
             column_widths = [120, 120, 120, 120, 120, 75, 50, 50, 50]
             for i, width in enumerate(column_widths):
                 self.transaction_list.setColumnWidth(i, width)
 
-            # Hide column with id's. This column is needed to avoid huge
-            # operation when we have to find transaction in the transaction
-            # list from a selected row. Without this column (and so the id) we
-            # have to loop through all transactions and compare their widget to
-            # the selected one while here we can simply access transactions
-            # this way: transactions[widget.text(8)] if we have the widget.
+            # The id is only needed to find the transaction behind a row.
             self.transaction_list.hideColumn(8)
 
             self.filter.hide()
-            self.transactions = {}
             self.cbs = collections.OrderedDict(
                 [('note', self.cb_nickname),
                 ('lastname', self.cb_lastname),
@@ -81,7 +203,6 @@ class HistoryWindow(QtWidgets.QDialog):
                 ('category', self.cb_category),
                 ('product', self.cb_product), ]
             )
-            self.last_id = 0
 
         self.show()
 
@@ -119,32 +240,27 @@ class HistoryWindow(QtWidgets.QDialog):
         """ Update filters
         """
         # Get filters current values.
-        transactions_left = copy.copy(self.transactions)
         filters = {}
-
         for row, combobox in self.cbs.items():
             if combobox.currentText():
                 filters[row] = combobox.currentText()
-                transactions_left = {key: value for key, value in transactions_left.items() if value[row].startswith(filters[row])}
 
-        current_cat = self.cb_category.currentText()
-        values = {}
+        facets = api.transactions.get_filter_facets(filters)
         for row, combobox in self.cbs.items():
             combobox.clear()
             combobox.addItem("")
-            values = api.transactions.get_possible_filter_values(row, filters)
-            combobox.addItems(list(values))
+            combobox.addItems(facets[row])
 
             if row in filters:
                 index = combobox.findText(filters[row])
                 if index:
                     combobox.setCurrentIndex(index)
+        return filters
 
     def prepare(self):
-        """ Prepare window by fetching all transactions, required filter fields
-        and displaying history.
+        """ Prepare window by fetching required filter fields and displaying
+        history.
         """
-        self.fetch_transactions()
         self.call_update()
 
     def call_update(self):
@@ -172,85 +288,39 @@ class HistoryWindow(QtWidgets.QDialog):
             self.sender().setCurrentIndex(0)
             self.call_update()
 
-    def fetch_transactions(self):
-        """ Fetch all transactions and build all QtWidgets needed to display
-        them. A huge dictionary containing all transactions information is
-        created to allow fast advanced filtering.
-        """
-        transactions = list(api.transactions.get(id__gt=self.last_id))
-        length = len(transactions)
-        self.progressbar.setFormat("Chargement de l'historique %p%")
-        self.progressbar.reset()
-        self.progressbar.setRange(0, 20)
-        for count, trans in enumerate(transactions):
-            if count % 1000:
-                self.progressbar.setValue(int(count / length * 20))
-
-            if trans['price'] >= 0:
-                credit = round(trans['price'], 2)
-                debit = "-"
-            else:
-                credit = "-"
-                debit = round(-trans['price'], 2)
-
-            self.transactions[trans['id']] = {
-                'note': trans['note'],
-                'lastname': trans['lastname'],
-                'firstname': trans['firstname'],
-                'price': trans['price'],
-                'price_name': trans['price_name'],
-                'date': trans['date'],
-                'product': trans['product'],
-                'category': trans['category'],
-                'quantity': trans['quantity'],
-                'credit': credit,
-                'debit': debit,
-                'widget': None,
-                'id': trans['id'],
-                'show': False,
-            }
-            self.last_id = trans['id']
-        self.progressbar.setFormat("Terminé")
-        self.progressbar.setValue(20)
-
-    def update_summary(self):
+    def update_summary(self, summary):
         """ Update debit, credit and Total on the window
-        """
-        quantity = 0
-        credited = 0
-        debited = 0
-
-        for transaction in self.transactions.values():
-            if transaction['show']:
-                price = transaction['price']
-                if price >= 0:
-                    credited += price
-                else:
-                    debited += price
-                quantity += transaction['quantity']
 
-        self.quantity.setText(str(quantity))
+        :param dict summary: As returned by api.transactions.get_summary
+        """
+        credited = summary['credited']
+        debited = summary['debited']
+        self.quantity.setText(str(summary['quantity']))
         self.credited.setText("{} €".format(round(credited, 2)))
         self.debited.setText("{} €".format(round(debited, 2)))
         self.total.setText("{} €".format(round(credited + debited, 2)))
 
-    def update_summary_selected(self):
+    def selected_transactions(self):
+        """ Get the transactions of the selected rows
+        """
+        rows = sorted(index.row() for index in
+                      self.transaction_list.selectionModel().selectedRows())
+        return [self.model.transaction(row) for row in rows]
+
+    def update_summary_selected(self, *_):
         """ update debit credit and Total on selected items.
         """
         quantity = 0
         credited = 0
         debited = 0
 
-        for i, index in enumerate(self.transaction_list.selectedIndexes()):
-            # i % (columnCount - 1) because the column with the id is hidden
-            if i % (self.transaction_list.columnCount() - 1) == 0:
-                widget = self.transaction_list.topLevelItem(index.row())
-                price = self.transactions[int(widget.text(8))]['price']
-                if price >= 0:
-                    credited += price
-                else:
-                    debited += price
-                quantity += self.transactions[int(widget.text(8))]['quantity']
+        for transaction in self.selected_transactions():
+            price = transaction['price']
+            if price >= 0:
+                credited += price
+            else:
+                debited += price
+            quantity += transaction['quantity']
 
         self.selected_quantity.setText(str(quantity))
         self.selected_credited.setText("{} €".format(round(credited, 2)))
@@ -262,142 +332,63 @@ class HistoryWindow(QtWidgets.QDialog):
         """
         if not self.allow_refresh:
             return
-        self.update_filters()
+        filters = self.update_filters()
 
         if self.updatetimer.isActive():
             self.updatetimer.stop()
-        filter_ = {
-            'note': self.cb_nickname.currentText(),
-            'lastname': self.cb_lastname.currentText(),
-            'firstname': self.cb_firstname.currentText(),
-            'category': self.cb_category.currentText(),
-            'product': self.cb_product.currentText(),
-        }
-        self.progressbar.setFormat("Application des filtres %p%")
-        length = len(self.transactions)
-        self.progressbar.setRange(0, 20)
-        self.transaction_list.clear()
+        self.progressbar.setFormat("Application des filtres")
         start_date = self.datetime_from.dateTime()
         end_date = self.datetime_to.dateTime()
 
-        for count, (id_, transaction) in enumerate(self.transactions.items()):
-            self.progressbar.setValue(int(count / length * 20))
-            if not start_date <= self.transactions[id_]['date'] <= end_date:
-                transaction['show'] = False
-                continue
-
-            for filter_name, filter_value in filter_.items():
-                if filter_value and filter_value.lower() != transaction[filter_name].lower():
-                    transaction['show'] = False
-                    break
-            else:
-                widget = TreeWidget(self.transaction_list, (
-                    transaction['date'].toString("yyyy/MM/dd HH:mm:ss"),
-                    transaction['note'],
-                    transaction['category'],
-                    transaction['product'],
-                    transaction['price_name'],
-                    str(transaction['quantity']),
-                    str(transaction['credit']),
-                    str(transaction['debit']),
-                    str(transaction['id'])
-                ))
-                transaction['widget'] = widget
-                transaction['show'] = True
+        self.model.set_filters(filters, start_date, end_date)
+        self.update_summary(api.transactions.get_summary(filters, start_date, end_date))
+        self.update_summary_selected()
 
+        self.progressbar.setRange(0, 20)
         self.progressbar.setFormat("Terminé")
         self.progressbar.setValue(20)
-        self.update_summary()
 
-    @ask_auth("manage_notes")
-    def delete(self, _):
-        """ Delete a product from a line in the history
-        """
-        indexes = self.transaction_list.selectedIndexes()
-        for i, index in reversed(list(enumerate(indexes))):
-            # i % (columnCount - 1) because the column with the id is hidden
-            if i % (self.transaction_list.columnCount() - 1) != 0:
-                continue
-
-            widget = self.transaction_list.topLevelItem(index.row())
+    def _rollback_selected(self, full):
+        """ Rollback every selected transaction and refresh the history
 
-            if not api.transactions.rollback_transaction(widget.text(8)):
+        :param bool full: Rollback the whole line instead of one item
+        """
+        for transaction in self.selected_transactions():
+            if not api.transactions.rollback_transaction(transaction['id'], full):
                 gui.utils.error(
                     "Impossible de supprimer la transation n°{}".format(
-                        widget.text(8)
+                        transaction['id']
                     ),
                     "La transaction du {date} sur la note {note} "
                     "n'a pas été supprimée.".format(
-                        date=widget.text(0),
-                        note=widget.text(1)
+                        date=transaction['date'].toString("yyyy/MM/dd HH:mm:ss"),
+                        note=transaction['note']
                     )
                 )
-                continue
-
-            try:
-                quantity = int(widget.text(5))
-            except ValueError:
-                quantity = 1
-
-            if quantity > 1:
-                if widget.text(6) != "-":
-                    credit = float(widget.text(6))
-                    credit -= credit / quantity
-                    credit = round(credit, 2)
-                    self.transactions[int(widget.text(8))]['price'] = credit
-                    self.transactions[int(widget.text(8))]['credit'] = credit
-                elif widget.text(7) != "-":
-                    debit = float(widget.text(7))
-                    debit -= debit / quantity
-                    debit = round(debit, 2)
-                    self.transactions[int(widget.text(8))]['price'] = -debit
-                    self.transactions[int(widget.text(8))]['debit'] = debit
-                self.transactions[int(widget.text(8))]['quantity'] = quantity - 1
-            else:
-                self.transaction_list.takeTopLevelItem(index.row())
-                del self.transactions[int(widget.text(8))]
         self.call_update()
 
+    @ask_auth("manage_notes")
+    def delete(self, _):
+        """ Delete a product from a line in the history
+        """
+        self._rollback_selected(False)
+
     @ask_auth("manage_notes")
     def delete_line(self, _):
         """ Delete a complete line
         """
-        indexes = self.transaction_list.selectedIndexes()
-        for i, index in reversed(list(enumerate(indexes))):
-            # i % (columnCount - 1) because the column with the id is hidden
-            if i % (self.transaction_list.columnCount() - 1) != 0:
-                continue
-
-            widget = self.transaction_list.topLevelItem(index.row())
-            if not api.transactions.rollback_transaction(widget.text(8), True):
-                gui.utils.error(
-                    "Impossible de supprimer la transation n°{}".format(
-                        widget.text(8)
-                    ),
-                    "La transaction du {date} sur la note {note} "
-                    "n'a pas été supprimée.".format(
-                        date=widget.text(0),
-                        note=widget.text(1)
-                    )
-                )
-                continue
-            index = self.transaction_list.indexOfTopLevelItem(widget)
-            self.transaction_list.takeTopLevelItem(index)
-            del self.transactions[int(widget.text(8))]
-        self.call_update()
+        self._rollback_selected(True)
 
     def export_csv(self):
         """ Export the selected lines in a csv file
+        If every fetched line is selected, the whole filtered history is
+        exported, not only the pages already displayed.
         """
-        export_trans = []
-        for num, index in enumerate(self.transaction_list.selectedIndexes()):
-            # i % (columnCount - 1) because the column with the id is hidden
-            if num % (self.transaction_list.columnCount() - 1) != 0:
-                continue
-            widget = self.transaction_list.topLevelItem(index.row())
-            export_trans.append(self.transactions[int(widget.text(8))])
-
-        dialog = ExportWindow(export_trans)
+        selected = self.transaction_list.selectionModel().selectedRows()
+        if selected and len(selected) == self.model.rowCount():
+            self.model.fetch_all()
+            self.transaction_list.selectAll()
+        dialog = ExportWindow(self.selected_transactions())
         dialog.exec_()
 
 
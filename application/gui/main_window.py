@@ -26,7 +26,6 @@ The MainWindow class is the main class of the program.
 """
 
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
-from functools import partial
 
 from .admin_stats_window import AdminStatsWindow
 from .auth_prompt_window import ask_auth
@@ -49,13 +48,14 @@ from .mail_scheduler_window import MailSchedulerWindow
 from .help_window import HelpWindow
 from .settings_window import SettingsWindow
 from .note_categories_management_window import NoteCategoriesManagementWindow
-import api.categories
+import api.catalog
 import api.notes
 import api.soundsystem
 import api.transactions
 import api.redis
 import csv
 import datetime
+import gui.thumbnails
 import gui.utils
 import settings
 import time
@@ -90,6 +90,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # Hack to count ecocups to add/delete.
         self.eco_diff = 0
 
+        # Gathers the pub/sub messages so a burst of them is handled at once.
+        self.redis_events = api.redis.EventCoalescer(self.redis_handle)
+
         # Build the notes_list
         self.rebuild_notes_list()
 
@@ -100,6 +103,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Set the headers of the history in the note details.
         self.note_history.header().setStretchLastSection(False)
+        self.note_history.keyPressEvent = self.note_history_key_press
         self.note_history.header().setSectionResizeMode(
             2,
             QtWidgets.QHeaderView.Stretch
@@ -112,35 +116,51 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.hide_alcohol.setChecked(False)
             else:
                 self.hide_alcohol.setChecked(True)
-            self.panels.rebuild()
+            if self.panels.panels:
+                self.panels.show_alcohol(not self.hide_alcohol.isChecked())
+            else:
+                self.panels.rebuild()
         api.redis.get_key("alcohol", callback)
 
-    async def redis_handle(self, channel, message):
-        if channel == 'enibar-notes':
-            for note in message:
-                api.notes.rebuild_note_cache(note)
-            await api.sde.send_notes(message)
-            self.rebuild_notes_list()
-        elif channel == 'enibar-delete':
-            for note in message:
+    async def redis_handle(self, events):
+        """ Handle the pub/sub messages gathered by self.redis_events. Each
+            cache is patched once and the UI refreshed once for all of them.
+
+        :param dict events: {channel: message, }
+        """
+        refresh_notes = False
+        if events.get('enibar-delete'):
+            notes_id = []
+            for note in events['enibar-delete']:
                 try:
-                    note_id = api.notes.NOTES_CACHE[note]['id']
-                    await api.sde.send_note_deletion([note_id, ])
+                    notes_id.append(api.notes.NOTES_CACHE[note]['id'])
                     del api.notes.NOTES_CACHE[note]
                 except KeyError:  # Osef
                     pass
+            await api.sde.send_note_deletion(notes_id)
+            refresh_notes = True
+        if events.get('enibar-notes'):
+            message = events['enibar-notes']
+            api.transactions.invalidate_history_cache(message)
+            api.notes.apply_notes_message(message)
+            await api.sde.send_notes(message)
+            refresh_notes = True
+        if refresh_notes:
             self.rebuild_notes_list()
-        elif channel == "enibar-alcohol":
+
+        if "enibar-alcohol" in events:
             self.check_alcohol()
-        elif channel == "enibar-settings":
+        if "enibar-settings" in events:
             settings.refresh_cache()
+        if "enibar-settings" in events or "enibar-panels" in events:
+            api.catalog.invalidate()
             self.panels.rebuild()
-        elif channel == "enibar-panels":
-            self.panels.rebuild()
-        try:
-            self.menu_bar.cur_window.redis_handle(channel, message)
-        except AttributeError:
-            pass
+
+        for channel, message in events.items():
+            try:
+                self.menu_bar.cur_window.redis_handle(channel, message)
+            except AttributeError:
+                pass
 
     def on_note_selection(self, index):
         """ Called when a note is selected
@@ -208,12 +228,8 @@ class MainWindow(QtWidgets.QMainWindow):
             self.reset_note_box()
             return
 
-        infos = api.notes.get(
-            lambda x: self.selected.text() == x["nickname"]
-        )
-        if infos:
-            infos = infos[0]
-        note_hist = api.transactions.get(note=self.selected.text(), reverse=True, max_=settings.MAX_HISTORY)
+        infos = api.notes.get_by_nick(self.selected.text())
+        note_hist = api.transactions.get_note_history(infos['id'], settings.MAX_HISTORY)
 
         # Construct the note history
         for product in note_hist:
@@ -233,29 +249,6 @@ class MainWindow(QtWidgets.QMainWindow):
             if product['id'] in selected_history:
                 widget.setSelected(True)
 
-        def keyPressEvent(obj, event):
-            if event.key() == QtCore.Qt.Key_Delete:
-
-                @ask_auth("manage_notes")
-                def del_line(obj):
-                    items = obj.selectedItems()
-                    selected_index = self.notes_list.currentRow()
-                    for item in items:
-                        if not api.transactions.rollback_transaction(item.text(4), full=True):
-                            gui.utils.error(
-                                "Impossible de supprimer la transation n°{}".format(
-                                    item.text(4)
-                                ),
-                                "La transaction du {date} sur cette note"
-                                "n'a pas été supprimée.".format(
-                                    date=item.text(0),
-                                )
-                            )
-                    self._note_refresh(selected_index)
-                del_line(obj)
-            obj.__class__.keyPressEvent(obj, event)
-
-        self.note_history.keyPressEvent = partial(keyPressEvent, self.note_history)
         self.note_history.resizeColumnToContents(0)
         self.note_history.resizeColumnToContents(1)
 
@@ -268,15 +261,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.note_promo.setText(infos['promo'])
         self.note_phone.setText(infos['tel'])
 
-        if infos['photo_path']:
-            path = settings.IMG_BASE_DIR + '/' + infos['photo_path']
-            image = QtGui.QPixmap(path)
-        else:
-            image = QtGui.QPixmap("")
-        if not image.isNull():
-            self.note_photo.setPixmap(image.scaled(QtCore.QSize(120, 160), 1))
-        else:
-            self.note_photo.setPixmap(image)
+        self.note_photo.setPixmap(gui.thumbnails.get_thumbnail(infos['photo_path']))
+        self.prefetch_thumbnails(index)
 
         self.red_since_label.setHidden(True)
         self.red_since.setHidden(True)
@@ -296,11 +282,50 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.note_box.setStyleSheet("background-color: none;")
 
+    def note_history_key_press(self, event):
+        """ Delete the selected lines of the note history with the Delete key
+        """
+        if event.key() == QtCore.Qt.Key_Delete:
+            self.delete_history_lines()
+        QtWidgets.QTreeWidget.keyPressEvent(self.note_history, event)
+
+    @ask_auth("manage_notes")
+    def delete_history_lines(self):
+        """ Rollback the transactions selected in the note history
+        """
+        items = self.note_history.selectedItems()
+        selected_index = self.notes_list.currentRow()
+        for item in items:
+            if not api.transactions.rollback_transaction(item.text(4), full=True):
+                gui.utils.error(
+                    "Impossible de supprimer la transation n°{}".format(
+                        item.text(4)
+                    ),
+                    "La transaction du {date} sur cette note"
+                    "n'a pas été supprimée.".format(
+                        date=item.text(0),
+                    )
+                )
+        self._note_refresh(selected_index)
+
+    def prefetch_thumbnails(self, index):
+        """ Prepare the thumbnails of the notes around index in the notes list
+        so moving through the list with the arrows doesn't stutter.
+        """
+        photo_paths = []
+        for row in (index - 1, index + 1):
+            item = self.notes_list.item(row)
+            if item is None:
+                continue
+            note = api.notes.get_by_nick(item.text())
+            if note:
+                photo_paths.append(note['photo_path'])
+        gui.thumbnails.prefetch(photo_paths)
+
     def refresh_ecocup_button(self):
         """ Set the state of the repay_ecocup button depending on self.eco_diff
         """
-        note = api.notes.get(lambda x: x["nickname"] == self.selected_nickname)
-        note = list(note)[0]
+        note = api.notes.get_by_nick(self.selected_nickname)
         if note["ecocups"] + self.eco_diff > 0:
             self.repay_ecocup_btn.setText('Rendre ({})'.format(note["ecocups"] + self.eco_diff))
             self.repay_ecocup_btn.setEnabled(True)
@@ -350,8 +375,7 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         if self.selected and self.product_list.products:
 
-            note = api.notes.get(lambda x: x["nickname"] ==
-                self.selected_nickname)[0]
+            note = api.notes.get_by_nick(self.selected_nickname)
             if note['ecocups'] < -self.eco_diff:
                 gui.utils.error("Erreur", "Verifiez le nombre d'écocups.")
                 return
@@ -366,9 +390,9 @@ class MainWindow(QtWidgets.QMainWindow):
             transactions = []
             for product in self.product_list.products:
                 if product['deletable']:
-                    cat = api.categories.get_unique(name=product['category'])
-                    desc = api.prices.get_unique_descriptor(category=cat['id'], label=product['price_name'])
-                    p = api.products.get_unique(name=product['product'], category=cat['id'])
+                    cat = api.catalog.get_category(product['category'])
+                    desc = api.catalog.get_descriptor(cat['id'], product['price_name'])
+                    p = api.catalog.get_product(cat['id'], product['product'])
 
                     transaction = {
                         'note': self.selected.text(),
@@ -399,9 +423,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 api.notes.change_ecocups(self.selected_nickname, self.eco_diff)
                 self.reset_product_list()
 
-                infos = api.notes.get(
-                    lambda x: self.selected_nickname == x["nickname"]
-                )[0]
+                infos = api.notes.get_by_nick(self.selected_nickname)
 
                 api.soundsystem.play(
                     'new_transaction',
@@ -443,6 +465,8 @@ class MenuBar(QtWidgets.QMenuBar):
             self.cur_window.close()
 
     def _trigger_panel_rebuild(self):
+        # Don't wait for our own message to forget the old catalog.
+        api.catalog.invalidate()
         api.redis.send_message('enibar-panels', {})
 
     def try_locking(self, key):
@@ -39,6 +39,39 @@ class NotesList(QtWidgets.QListWidget):
         self.minors_overdraft = QtGui.QColor(0xFF, 0xA5, 0)
         self.search_text = ""
         self.nb_shown = 0
+        # The items of the list by nickname, as of the last update
+        self.items = {}
+
+    def _update_item(self, item, note, current_time):
+        """ Color an item depending on its note. The background is only
+            changed if the color of the note changed.
+        """
+        if current_time - note["birthdate"] < 18 * 365 * 24 * 3600:
+            if note['note'] < 0:
+                color = 'minors_overdraft'
+            else:
+                color = 'minors_color'
+        elif note['note'] < 0:
+            color = 'overdraft_color'
+        else:
+            color = None
+
+        if item.data(QtCore.Qt.UserRole) != color:
+            item.setData(QtCore.Qt.UserRole, color)
+            if color is None:
+                item.setBackground(QtGui.QBrush())
+            else:
+                item.setBackground(getattr(self, color))
+
+    def _add_item(self, note, current_time):
+        """ Add an item for note to the list """
+        widget = QtWidgets.QListWidgetItem(note["nickname"], self)
+        self.items[note["nickname"]] = widget
+        self._update_item(widget, note, current_time)
+        if not note['nickname'].lower().startswith(self.search_text):
+            widget.setHidden(True)
+        else:
+            self.nb_shown += 1
 
     def build(self, notes_list):
         """ Fill the list with notes from notes_list, coloring negatives one
@@ -46,19 +79,7 @@ class NotesList(QtWidgets.QListWidget):
         self.nb_shown = 0
         current_time = time.time()
         for note in notes_list:
-            widget = QtWidgets.QListWidgetItem(note["nickname"], self)
-            if current_time - note["birthdate"] < 18 * 365 * 24 * 3600:
-                if note['note'] < 0:
-                    widget.setBackground(self.minors_overdraft)
-                else:
-                    widget.setBackground(self.minors_color)
-            elif note['note'] < 0:
-                widget.setBackground(self.overdraft_color)
-
-            if not note['nickname'].lower().startswith(self.search_text):
-                widget.setHidden(True)
-                return
-            self.nb_shown += 1
+            self._add_item(note, current_time)
 
     def hide_unmatched_items(self, search_text):
         self.nb_shown = 0
@@ -71,17 +92,42 @@ class NotesList(QtWidgets.QListWidget):
             else:
                 widget.setHidden(True)
 
+    def update_items(self, notes_list):
+        """ Make the list match notes_list by only adding the new notes,
+            removing the ones that are not there anymore and recoloring the
+            others. The scroll position is kept.
+        """
+        scroll = self.verticalScrollBar().value()
+        notes = {note['nickname']: note for note in notes_list}
+        self.items = {}
+        for row in reversed(range(self.count())):
+            nick = self.item(row).text()
+            if nick not in notes or nick in self.items:
+                self.takeItem(row)
+            else:
+                self.items[nick] = self.item(row)
+
+        current_time = time.time()
+        self.nb_shown = 0
+        for nick, note in notes.items():
+            item = self.items.get(nick)
+            if item is None:
+                self._add_item(note, current_time)
+            else:
+                self._update_item(item, note, current_time)
+                if not item.isHidden():
+                    self.nb_shown += 1
+        self.verticalScrollBar().setValue(scroll)
+
     def refresh(self, notes_list):
         """ Refresh the note list
         """
         selected = self.currentItem()
         if selected:
             selected = selected.text()
-        self.clear()
-        self.build(notes_list)
-        try:
-            new_selection = self.findItems(selected, QtCore.Qt.MatchExactly)[0]
-            self.setCurrentItem(new_selection)
-        except IndexError:
+        self.update_items(notes_list)
+        if selected in self.items:
+            if self.currentItem() is not self.items[selected]:
+                self.setCurrentItem(self.items[selected])
+        else:
             self.setCurrentRow(0)
-
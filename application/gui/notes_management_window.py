@@ -34,6 +34,7 @@ import api.note_categories
 import datetime
 import gui.auth_prompt_window
 import gui.notes_list_widget
+import gui.thumbnails
 import settings
 
 
@@ -171,12 +172,7 @@ class NotesManagementWindow(QtWidgets.QDialog):
         self.birthdate_input.setText(datetime.datetime.fromtimestamp(
             note["birthdate"]).strftime("%d/%m/%Y"))
         self.promo_input.setCurrentText(note["promo"])
-        path = settings.IMG_BASE_DIR + '/' + note['photo_path']
-        image = QtGui.QPixmap(path)
-
-        if not image.isNull():
-            image = image.scaled(QtCore.QSize(120, 160), 1)
-        self.photo.setPixmap(image)
+        self.photo.setPixmap(gui.thumbnails.get_thumbnail(note['photo_path']))
         self.notes_infos.setText('Note: ' + str(round(note['note'], 2)) + ' €')
         if note['note'] < 0:
             self.notes_infos.setStyleSheet("color: red;")
@@ -211,8 +207,7 @@ class NotesManagementWindow(QtWidgets.QDialog):
         if note_selected != self.current_shown:
             self.current_shown = note_selected
 
-        note = api.notes.get(lambda x: x["nickname"] ==
-                             self.note_list.item(note_selected).text())[0]
+        note = api.notes.get_by_nick(self.note_list.item(note_selected).text())
         self.disable_inputs_for_editing()
         self.add_button.setEnabled(True)
         self.fill_inputs(note)
@@ -47,18 +47,64 @@ class Panels(QtWidgets.QTabWidget):
         super().__init__(parent)
         Panels._parent = self.parent()
         self.main_window = parent.parent()
-        self.panels = []
+        self.panels = {}
 
     def build(self):
-        """ Build panels from panels found in database
+        """ Build panels from panels found in database. Panels already built
+            are updated in place so only the products which changed get new
+            widgets.
         """
-        for name, panel in sorted(rapi.panels.get_all().items()):
+        content = rapi.panels.get_all()
+        for name in list(self.panels):
+            if name not in content or (settings.SHOWN_PANELS and name not in settings.SHOWN_PANELS):
+                self.remove_panel(name)
+
+        for name, panel in content.items():
             if settings.SHOWN_PANELS and name not in settings.SHOWN_PANELS:
                 continue
-            widget = PanelTab(panel, self.main_window)
-            if not widget.empty:
-                self.panels.append(widget)
-                self.addTab(widget, name)
+            if name in self.panels:
+                self.panels[name].update_content(panel)
+            else:
+                self.panels[name] = PanelTab(panel, self.main_window)
+        self.show_tabs()
+
+    def remove_panel(self, name):
+        """ Remove a panel and its tab
+
+        :param str name: Panel name
+        """
+        widget = self.panels.pop(name)
+        index = self.indexOf(widget)
+        if index != -1:
+            self.removeTab(index)
+        widget.deleteLater()
+
+    def show_tabs(self):
+        """ Show a tab for every non empty panel, sorted by name. Tabs are only
+            moved around if the list changed.
+        """
+        tabs = [(name, widget) for name, widget in sorted(self.panels.items())
+                if not widget.empty]
+        if [self.widget(i) for i in range(self.count())] == [widget for _, widget in tabs]:
+            return
+
+        current = self.currentWidget()
+        while self.count():
+            # The widget isn't deleted, only its tab
+            self.removeTab(0)
+        for name, widget in tabs:
+            self.addTab(widget, name)
+        if current is not None and self.indexOf(current) != -1:
+            self.setCurrentWidget(current)
+
+    def show_alcohol(self, show):
+        """ Show or hide the alcoholic categories of every panel
+
+        :param bool show: True to show them
+        """
+        for widget in self.panels.values():
+            widget.scroll_area_content.show_alcohol(show)
+        self.show_tabs()
 
     @ask_auth("manage_products", fail_callback=fail_callback_dummy)
     def change_alcohol(self, _):
@@ -70,12 +116,9 @@ class Panels(QtWidgets.QTabWidget):
         api.redis.set_key("alcohol", str(int(not self.parent().parent().hide_alcohol.isChecked())), callback)
 
     def rebuild(self):
-        """ Clear panels and build them back
+        """ Update the panels to match the database
         """
-        selected = self.currentIndex()
-        self.clear()
         self.build()
-        self.setCurrentIndex(selected)
 
     @classmethod
     def fail_callback(cls):
@@ -92,21 +135,27 @@ class PanelTab(QtWidgets.QWidget):
         super().__init__()
         self.main_window = main_window
         uic.loadUi('ui/panel_widget.ui', self)
-        self.scroll_area_content.build(panel)
-        self.connect_signals()
+        self.connect_signals(self.scroll_area_content.build(panel))
 
     @property
     def empty(self):
         return self.scroll_area_content.empty
 
-    def connect_signals(self):
+    def update_content(self, panel):
+        """ Update the panel content
+
+        :param dict panel: Panel content, as given by rapi.panels.get_all
+        """
+        self.connect_signals(self.scroll_area_content.update_content(panel))
+
+    def connect_signals(self, widgets):
         """ Connect signals of products widgets with product_clicked
+
+        :param list widgets: The new product widgets
         """
-        products = self.scroll_area_content.products
-        for cat in products.values():
-            for product in cat['products'].values():
-                product['widget'].get_signal().connect(self.product_clicked)
-                product['widget'].connect_mouse_wheel(self.product_wheeled)
+        for widget in widgets:
+            widget.get_signal().connect(self.product_clicked)
+            widget.connect_mouse_wheel(self.product_wheeled)
 
     def product_clicked(self, index=None):
         """ Product clicked
@@ -297,6 +346,7 @@ class ProductsContainer(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.products = {}
+        self.show_alcohols = True
         self.columns = [Column(), Column(), Column()]
 
         self.layout = QtWidgets.QHBoxLayout()
@@ -311,55 +361,148 @@ class ProductsContainer(QtWidgets.QWidget):
         panel. All products of the panel are fetched from database and are
         sorted in their respective categories. Widgets used to insert
         categories and products are built on the fly.  Then all categories are
-        sorted into columns in an optimised manner.
+        sorted into columns in an optimised manner. Alcoholic categories are
+        built too, hidden if alcohol isn't shown.
+
+        :return list: The product widgets
         """
-        show_alcohols = not self.parent().parent().parent().main_window.hide_alcohol.isChecked()
+        self.show_alcohols = not self.parent().parent().parent().main_window.hide_alcohol.isChecked()
+        return self.update_content(content)
 
-        self.products = {}
-        for category_name, category in sorted(content.items()):
-            if not show_alcohols and category['alcoholic']:
+    def update_content(self, content):
+        """ Update the categories and products to match content. Only the
+        widgets of the products which changed are built again, the others are
+        left untouched.
+
+        :param dict content: Panel content, as given by rapi.panels.get_all
+        :return list: The new product widgets
+        """
+        categories = {category['category_id']: (name, category)
+                      for name, category in content.items() if category['products']}
+        for cid in list(self.products):
+            if cid not in categories or self.products[cid]['name'] != categories[cid][0]:
+                self.remove_category(cid)
+
+        widgets = []
+        for cid, (category_name, category) in categories.items():
+            if cid in self.products:
+                widgets += self.update_category(cid, category)
+
+        # Biggest categories first so the columns are balanced
+        new = sorted(
+            (cid for cid in categories if cid not in self.products),
+            key=lambda cid: len(categories[cid][1]['products']),
+            reverse=True
+        )
+        for cid in new:
+            widgets += self.add_category(cid, *categories[cid])
+        return widgets
+
+    def add_category(self, cid, category_name, category):
+        """ Add a category in the least filled column
+
+        :return list: The product widgets of the category
+        """
+        widget = CategoryContainer(category_name, category['color'])
+        self.products[cid] = {
+            'name': category_name,
+            'color': category['color'],
+            'alcoholic': category['alcoholic'],
+            'widget': widget,
+            'column': self.get_least_filled(),
+            'products': {}
+        }
+        widgets = self.update_category(cid, category)
+        self.products[cid]['column'].layout.addWidget(widget)
+        widget.finalise()
+        if category['alcoholic'] and not self.show_alcohols:
+            widget.hide()
+        return widgets
+
+    def remove_category(self, cid):
+        """ Remove a category and its products """
+        category = self.products.pop(cid)
+        category['column'].count -= len(category['products'])
+        category['column'].layout.removeWidget(category['widget'])
+        category['widget'].hide()
+        category['widget'].deleteLater()
+
+    def update_category(self, cid, content):
+        """ Update the products of a category
+
+        :return list: The new product widgets
+        """
+        category = self.products[cid]
+        if content['color'] != category['color']:
+            category['color'] = content['color']
+            category['widget'].set_color(content['color'])
+        if content['alcoholic'] != category['alcoholic']:
+            category['alcoholic'] = content['alcoholic']
+            category['widget'].setVisible(self.show_alcohols or not content['alcoholic'])
+
+        products = category['products']
+        layout = category['widget'].layout
+        new = {product['product_id']: (product_name, product)
+               for product_name, product in content['products'].items()}
+        for pid in list(products):
+            if pid not in new or products[pid]['name'] != new[pid][0]:
+                self.remove_product(cid, pid)
+
+        widgets = []
+        for pid, (product_name, product) in new.items():
+            old = products.get(pid)
+            if old is not None and (old['prices'], old['percentage']) == (product['prices'], product['percentage']):
                 continue
-            cid = category['category_id']
 
-            self.products[cid] = {
-                'name': category_name,
-                'widget': CategoryContainer(category_name, category['color']),
-                'products': {}
+            widget = get_product_widget(
+                cid,
+                pid,
+                product_name,
+                category['name'],
+                product['prices'],
+                product['percentage']
+            )
+            widgets.append(widget)
+            if old is not None:
+                layout.replaceWidget(old['widget'], widget)
+                old['widget'].hide()
+                old['widget'].deleteLater()
+            else:
+                key = product_name.replace('&', '')
+                index = sum(p['name'].replace('&', '') < key for p in products.values())
+                layout.insertWidget(index, widget)
+                category['column'].count += 1
+            products[pid] = {
+                'widget': widget,
+                'name': product_name,
+                'prices': product['prices'],
+                'percentage': product['percentage'],
             }
+        return widgets
 
-            for product_name, product in sorted(category['products'].items(), key=lambda x: x[0].replace('&', '')):
-                pid = product['product_id']
+    def remove_product(self, cid, pid):
+        """ Remove the widget of a product """
+        category = self.products[cid]
+        product = category['products'].pop(pid)
+        category['column'].count -= 1
+        category['widget'].layout.removeWidget(product['widget'])
+        product['widget'].hide()
+        product['widget'].deleteLater()
 
-                widget = get_product_widget(
-                    cid,
-                    pid,
-                    product_name,
-                    category_name,
-                    product['prices'],
-                    product['percentage']
-                )
-                self.products[cid]['products'][pid] = {
-                    'widget': widget,
-                    'name': product_name,
-                    'prices': product['prices'],
-                }
-                self.products[cid]['widget'].layout.addWidget(widget)
-
-        indexes = reversed(sorted(
-            self.products,
-            key=lambda x: len(self.products[x]['products'])
-        ))
-        for cat in indexes:
-            col = self.get_least_filled()
-            if not self.products[cat]['products']:
-                continue
-            col.count += len(self.products[cat]['products'])
-            col.layout.addWidget(self.products[cat]['widget'])
-            self.products[cat]['widget'].finalise()
+    def show_alcohol(self, show):
+        """ Show or hide the alcoholic categories
+
+        :param bool show: True to show them
+        """
+        self.show_alcohols = show
+        for category in self.products.values():
+            if category['alcoholic']:
+                category['widget'].setVisible(show)
 
     @property
     def empty(self):
-        return not bool(self.products)
+        return not any(self.show_alcohols or not category['alcoholic']
+                       for category in self.products.values())
 
     def get_least_filled(self):
         """ Get least filled
@@ -401,7 +544,10 @@ class CategoryContainer(QtWidgets.QGroupBox):
         self.layout = QtWidgets.QVBoxLayout()
         self.setLayout(self.layout)
         self.spacer = None
+        self.set_color(category_color)
 
+    def set_color(self, category_color):
+        """ Set the background color of the category """
         self.setStyleSheet(
             "QGroupBox{{background-color: {}}}".format(category_color)
         )
@@ -23,6 +23,7 @@ Send mail window
 
 from PyQt5 import QtWidgets, uic
 import api.mail
+import asyncio
 import gui.utils
 from .save_mail_model_window import SaveMailModelWindow
 from .load_mail_model_window import LoadMailModelWindow
@@ -47,7 +48,6 @@ class SendMailWindow(QtWidgets.QMainWindow):
     def send(self):
         """ Send mail
         """
-        mails = []
         prompt = ValidationWindow("Etes vous sûr de vouloir envoyer ce mail ?")
         if not prompt.is_ok:
             return
@@ -55,23 +55,33 @@ class SendMailWindow(QtWidgets.QMainWindow):
             self.filter_selector.currentIndex(),
             self.filter_input.text()
         )
-        for recipient in recipients:
-            if recipient['hidden']:
-                continue
-            sent = api.mail.send_mail(
-                recipient['mail'],
-                api.mail.format_message(self.subject_input.text(), recipient),
-                api.mail.format_message(self.message_input.toPlainText(), recipient),
-                self.destinateur_input.text(),
-            )
+        subject = api.mail.compile_message(self.subject_input.text())
+        message = api.mail.compile_message(self.message_input.toPlainText())
+        sender = self.destinateur_input.text()
+        mails = [(recipient['mail'], subject(recipient), message(recipient), sender)
+                 for recipient in recipients]
 
-            mails.append({
-                'nickname': recipient['nickname'],
-                'mail': recipient['mail'],
-                'status': "Envoyé" if sent else "Echec de l'envoi"
-            })
+        # Sending can take a while, don't freeze the window meanwhile. The
+        # SMTP connections are not database work, keep the DB workers free.
+        self.send_button.setEnabled(False)
+        future = asyncio.get_event_loop().run_in_executor(None, api.mail.send_mails, mails)
+        future.add_done_callback(lambda future: self._sent(recipients, future))
 
-        popup = SendMailRecapWindow(self, mails)
+    def _sent(self, recipients, future):
+        """ Show the result of the sending
+        """
+        self.send_button.setEnabled(True)
+        try:
+            results = future.result()
+        except Exception as err:
+            gui.utils.error("Impossible d'envoyer les mails", str(err))
+            return
+        mails = [{
+            'nickname': recipient['nickname'],
+            'mail': recipient['mail'],
+            'status': "Envoyé" if sent else "Echec de l'envoi"
+        } for recipient, sent in zip(recipients, results)]
+        SendMailRecapWindow(self, mails)
 
     def new_model(self):
         """ New mail model
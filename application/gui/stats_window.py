@@ -27,6 +27,8 @@ Provide neat stats
 from PyQt5 import QtWidgets, uic, QtCore
 from collections import defaultdict
 import api.stats
+import database
+import gui.utils
 from gui.tree_item_widget import TreeWidget
 
 
@@ -69,20 +71,39 @@ class StatsWindow(QtWidgets.QDialog):
 
     def _update(self):
         """ Callback for the timer to update the tree
+        The stats are fetched on a worker thread so the main window keeps
+        working meanwhile.
         """
+        self.progressbar.setFormat("Chargement des statistiques")
+        future = database.run_in_thread(lambda: list(api.stats.get_notes_stats()))
+        future.add_done_callback(self._build)
+
+    def _build(self, future):
+        """ Build the tree once the stats are fetched
+        """
+        # The window may have been closed while the stats were fetched.
+        if not self.isVisible():
+            return
+        try:
+            lines = future.result()
+        except Exception as err:
+            self.progressbar.setFormat("Erreur")
+            gui.utils.error("Impossible de charger les statistiques", str(err))
+            return
+
         if self.note_mode:
-            self.build_stats_notes(self.note_filter)
+            self.build_stats_notes(lines, self.note_filter)
             self.build_widgets_notes()
         else:
-            self.build_stats_categories(self.cat_filter)
+            self.build_stats_categories(lines, self.cat_filter)
             self.build_widgets_categories()
 
-    def build_stats_categories(self, category_filter):
+    def build_stats_categories(self, lines, category_filter):
         """ Build stats when we want them by category
         """
         self.progressbar.setFormat("Construction du cache")
         self.progressbar.setValue(20)
-        for line in api.stats.get_notes_stats():
+        for line in lines:
             if category_filter and line['category'] != category_filter:
                 continue
             pid = "%s - (%s) [%s €]" % (line['product'], line['price_name'],
@@ -157,12 +178,12 @@ class StatsWindow(QtWidgets.QDialog):
         self._resize_columns()
 
     # Notes
-    def build_stats_notes(self, note_filter):
+    def build_stats_notes(self, lines, note_filter):
         """ Refresh the stats of the window
         """
         self.progressbar.setFormat("Construction du cache")
         self.progressbar.setValue(20)
-        for line in api.stats.get_notes_stats():
+        for line in lines:
             if note_filter and line['nickname'] != note_filter:
                 continue
             pid = "%s - (%s) [%s €]" % (line['product'], line['price_name'],
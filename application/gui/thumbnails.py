@@ -0,0 +1,127 @@
+# Copyright (C) 2014-2018 Bastien Orivel <b2orivel@enib.fr>
+# Copyright (C) 2014-2018 Arnaud Levaufre <a2levauf@enib.fr>
+#
+# This file is part of Enibar.
+#
+# Enibar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Enibar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Enibar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Thumbnails
+==========
+
+Note photos scaled to the size they are displayed at. Thumbnails are
+generated once on disk, next to the photos, and the ones recently shown are
+also kept in memory.
+"""
+
+from PyQt5 import QtCore, QtGui
+import hashlib
+import os
+import settings
+import threading
+
+
+THUMBNAIL_SIZE = QtCore.QSize(120, 160)
+THUMBNAILS_DIR = ".thumbnails"
+# Size of the in memory cache, in KiB
+PIXMAP_CACHE_LIMIT = 10 * 1024
+
+
+def _photo_key(photo_path):
+    """ Get a key identifying the current version of a photo
+
+    :param str photo_path: The photo_path of a note
+    :return str: The key or None if there is no such photo
+    """
+    if not photo_path:
+        return None
+    try:
+        mtime = os.stat(os.path.join(settings.IMG_BASE_DIR, photo_path)).st_mtime_ns
+    except OSError:
+        return None
+    return "{}:{}".format(photo_path, mtime)
+
+
+def thumbnail_path(photo_path):
+    """ Get the path of the thumbnail of a photo, generate it if needed.
+    This only uses QImage so it can be called from any thread.
+
+    :param str photo_path: The photo_path of a note
+    :return str: The path of the thumbnail or None if there is no photo
+    """
+    key = _photo_key(photo_path)
+    if key is None:
+        return None
+
+    directory = os.path.join(settings.IMG_BASE_DIR, THUMBNAILS_DIR)
+    path = os.path.join(directory, hashlib.sha1(key.encode()).hexdigest() + ".png")
+    if os.path.exists(path):
+        return path
+
+    image = QtGui.QImage(os.path.join(settings.IMG_BASE_DIR, photo_path))
+    if image.isNull():
+        return None
+    image = image.scaled(THUMBNAIL_SIZE, QtCore.Qt.KeepAspectRatio,
+                         QtCore.Qt.SmoothTransformation)
+    os.makedirs(directory, exist_ok=True)
+    # Write then rename so nobody can read a partial thumbnail.
+    tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+    if not image.save(tmp_path, "PNG"):
+        return None
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_thumbnail(photo_path):
+    """ Get the thumbnail of a photo. Must be called from the GUI thread.
+
+    :param str photo_path: The photo_path of a note
+    :return QPixmap: The thumbnail, a null pixmap if there is no photo
+    """
+    key = _photo_key(photo_path)
+    if key is None:
+        return QtGui.QPixmap()
+
+    QtGui.QPixmapCache.setCacheLimit(max(QtGui.QPixmapCache.cacheLimit(), PIXMAP_CACHE_LIMIT))
+    pixmap = QtGui.QPixmapCache.find(key)
+    if pixmap is not None and not pixmap.isNull():
+        return pixmap
+
+    path = thumbnail_path(photo_path)
+    if path is None:
+        return QtGui.QPixmap()
+    pixmap = QtGui.QPixmap(path)
+    QtGui.QPixmapCache.insert(key, pixmap)
+    return pixmap
+
+
+class _Prefetch(QtCore.QRunnable):
+    def __init__(self, photo_paths):
+        super().__init__()
+        self.photo_paths = photo_paths
+
+    def run(self):
+        for photo_path in self.photo_paths:
+            thumbnail_path(photo_path)
+
+
+def prefetch(photo_paths):
+    """ Generate the missing thumbnails of some photos in the background so
+    showing them later only has to read a small file.
+
+    :param list photo_paths: photo_path of the notes to prefetch
+    """
+    photo_paths = [photo_path for photo_path in photo_paths if photo_path]
+    if photo_paths:
+        QtCore.QThreadPool.globalInstance().start(_Prefetch(photo_paths))
@@ -72,23 +72,12 @@ def send_scheduled_mails():
                 cursor.value('filter'),
                 cursor.value('filter_value'),
             )
-            for recipient in recipients:
-                if recipient['hidden']:
-                    continue
-                subject = api.mail.format_message(
-                    cursor.value('subject'),
-                    recipient
-                )
-                message = api.mail.format_message(
-                    cursor.value('message'),
-                    recipient
-                )
-                api.mail.send_mail(
-                    recipient['mail'],
-                    subject,
-                    message,
-                    cursor.value('sender')
-                )
+            subject = api.mail.compile_message(cursor.value('subject'))
+            message = api.mail.compile_message(cursor.value('message'))
+            sender = cursor.value('sender')
+            mails = [(recipient['mail'], subject(recipient), message(recipient), sender)
+                     for recipient in recipients]
+            api.mail.send_mails(mails)
 
             # Update database.
             with Cursor() as update_cursor:
@@ -91,7 +91,7 @@ async def install_redis_handle(app):
 
         while await subscriber.wait_message():
             reply = await subscriber.get_json()
-            await app.redis_handle(reply[0].decode(), reply[1])
+            app.redis_events.push(reply[0].decode(), reply[1])
         await asyncio.sleep(1)
 
 
@@ -1,41 +1,139 @@
-import settings
-import requests
+"""
+Photo synchronisation
+=====================
+
+Download the profile pictures of the notes from the website. Only the photos
+changed since the last run are listed by the website, and each of them is
+downloaded with a conditional request so an unchanged image is never
+transferred nor written again.
+"""
+
+import aiohttp
 import api.notes
-from urllib.parse import urljoin
-import os.path
 import api.redis
+import asyncio
 import datetime
+import hashlib
+import json
+import os.path
+import settings
+from urllib.parse import urljoin
+
+
+# Maximum number of photos downloaded at the same time
+PHOTO_DOWNLOADS = 8
+PHOTOS_URL = "/static/medias/profile_pictures/"
+# Redis key holding {photo: {'etag', 'last_modified', 'sha256'}, }
+VALIDATORS_KEY = "photos_validators"
+
+
+def _proxy():
+    if settings.USE_PROXY:
+        return settings.PROXY_AUTH
+    return None
+
+
+async def get_photos(session, last_updated=None):
+    """ Get the photos changed since last_updated
+
+    :param aiohttp.ClientSession session: The session to use
+    :param str last_updated: Date of the last synchronisation
+    :return dict: {mail: photo, }
+    """
+    params = {'last_updated': last_updated} if last_updated else {}
+    async with session.get(settings.WEB_URL + "photos", params=params, proxy=_proxy()) as resp:
+        return await resp.json()
 
-if settings.USE_PROXY:
-    proxies = {
-        'http': settings.PROXY_AUTH,
-        'https': settings.PROXY_AUTH,
-    }
-else:
-    proxies = None
-
-last_updated = api.redis.get_key_blocking('photos_last_update')
-
-if last_updated != b'None':
-    photos = requests.get(settings.WEB_URL + "photos", params={'last_updated': last_updated}, proxies=proxies).json()
-else:
-    photos = requests.get(settings.WEB_URL + "photos", proxies=proxies).json()
-
-notes = api.notes.get()
-
-for mail, photo in photos.items():
-    for note in notes:
-        if note['mail'] == mail:
-            print(mail, photo)
-            url = urljoin(settings.WEB_URL, "/static/medias/profile_pictures/" + photo)
-            data = requests.get(url, proxies=proxies).content
-            _, ext = os.path.splitext(photo)
-            img_path = os.path.join(settings.IMG_BASE_DIR, note['mail'] + ext)
+
+async def download_photo(session, semaphore, photo, validators):
+    """ Download a photo unless it didn't change since we last got it.
+
+    :param aiohttp.ClientSession session: The session to use
+    :param asyncio.Semaphore semaphore: Bounds the concurrent downloads
+    :param str photo: The name of the photo on the website
+    :param dict validators: The validators of the photos, updated in place
+    :return bytes: The photo or None if it didn't change
+    """
+    cached = validators.get(photo, {})
+    headers = {}
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    url = urljoin(settings.WEB_URL, PHOTOS_URL + photo)
+    async with semaphore:
+        async with session.get(url, headers=headers, proxy=_proxy()) as resp:
+            if resp.status == 304:
+                return None
+            if resp.status != 200:
+                print("Can't download", photo, resp.status)
+                return None
+            data = await resp.read()
+            validators[photo] = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'sha256': cached.get('sha256'),
+            }
+    return data
+
+
+async def sync_photo(session, semaphore, note, photo, validators):
+    """ Download the photo of a note and write it in IMG_BASE_DIR if it changed
+
+    :return str: The new photo_path of the note, None if it didn't change
+    """
+    data = await download_photo(session, semaphore, photo, validators)
+    _, ext = os.path.splitext(photo)
+    photo_path = note['mail'] + ext
+    img_path = os.path.join(settings.IMG_BASE_DIR, photo_path)
+
+    if data is not None:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != validators[photo]['sha256'] or not os.path.exists(img_path):
+            print(note['mail'], photo)
             with open(img_path, 'wb') as fd:
                 fd.write(data)
-            api.notes.change_values(note['nickname'], do_not=True, photo_path=note['mail'] + ext)
-            break
+            validators[photo]['sha256'] = digest
+
+    if note['photo_path'] != photo_path and os.path.exists(img_path):
+        return photo_path
+    return None
+
+
+async def sync_photos(last_updated, validators):
+    """ Synchronise the photos of all the notes
+
+    :param str last_updated: Date of the last synchronisation, None for all
+    :param dict validators: The validators of the photos, updated in place
+    :return dict: {nickname: photo_path, } for the notes whose photo changed
+    """
+    semaphore = asyncio.Semaphore(PHOTO_DOWNLOADS)
+    async with aiohttp.ClientSession() as session:
+        photos = await get_photos(session, last_updated)
+        jobs = {}
+        for mail, photo in photos.items():
+            notes = api.notes.get_by_mail(mail)
+            if notes:
+                jobs[notes[0]['nickname']] = sync_photo(session, semaphore, notes[0], photo, validators)
+        results = await asyncio.gather(*jobs.values())
+    return {nick: photo_path for nick, photo_path in zip(jobs, results) if photo_path}
+
+
+def main():
+    last_updated = api.redis.get_key_blocking('photos_last_update')
+    last_updated = None if last_updated == b'None' else last_updated.decode()
+    validators = json.loads(api.redis.get_key_blocking(VALIDATORS_KEY, '{}').decode())
+    # Photos changed while we run are fetched next time.
+    now = datetime.datetime.strftime(datetime.datetime.now(), "%Y-%m-%dT%H:%M:%S")
+
+    loop = asyncio.get_event_loop()
+    photo_paths = loop.run_until_complete(sync_photos(last_updated, validators))
+    api.notes.change_photo_paths(photo_paths, do_not=True)
+
+    api.redis.set_key_blocking(VALIDATORS_KEY, json.dumps(validators))
+    api.redis.set_key_blocking('photos_last_update', now)
 
-last_updated = datetime.datetime.strftime(datetime.datetime.now(), "%Y-%m-%dT%H:%M:%S")
-api.redis.set_key_blocking('photos_last_update', last_updated)
 
+if __name__ == "__main__":
+    main()
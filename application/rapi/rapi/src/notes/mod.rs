@@ -40,6 +40,7 @@ fn get_cache(conn: &PgConnection) -> Result<Vec<NoteCacheEntry>> {
                 agios_inscription,
                 tot_cons,
                 tot_refill,
+                version,
             ),
             categories,
             hidden,
@@ -71,6 +72,7 @@ fn get_note_cache(conn: &PgConnection, note_nick: &str) -> Result<NoteCacheEntry
                 agios_inscription,
                 tot_cons,
                 tot_refill,
+                version,
             ),
             categories,
             hidden,
@@ -25,6 +25,7 @@ pub struct Note {
     pub agios_inscription: bool,
     pub tot_cons: BigDecimal,
     pub tot_refill: BigDecimal,
+    pub version: i64,
 }
 
 #[derive(Queryable, Debug)]
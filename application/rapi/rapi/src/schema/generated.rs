@@ -64,6 +64,7 @@ table! {
         agios_inscription -> Bool,
         tot_cons -> Numeric,
         tot_refill -> Numeric,
+        version -> Int8,
     }
 }
 
@@ -20,6 +20,7 @@ table! {
         agios_inscription -> Bool,
         tot_cons -> Numeric,
         tot_refill -> Numeric,
+        version -> Int8,
         categories -> Array<NoteCategorySql>,
         hidden -> Bool,
     }
@@ -32,4 +32,4 @@ else
 fi
 cd ../application
 
-exec $PYTHON "-OO" "agio.py"
+exec $PYTHON "-OO" "agio.py" "$@"
@@ -0,0 +1,101 @@
+DROP TRIGGER on_transaction_trigger ON transactions;
+DROP FUNCTION on_transaction;
+DROP TRIGGER on_transaction_deletion_trigger ON transactions;
+DROP FUNCTION on_transaction_deletion;
+DROP TRIGGER on_transaction_update_trigger ON transactions;
+DROP FUNCTION on_transaction_update;
+
+-- Old lines may not have a note_id yet, fill it from the name pairs before
+-- the triggers start to rely on it.
+UPDATE transactions SET note_id=notes.id
+FROM notes
+WHERE transactions.note_id IS NULL
+AND notes.firstname=transactions.firstname
+AND notes.lastname=transactions.lastname;
+
+CREATE FUNCTION on_transactions_insert()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    UPDATE notes SET
+        note=note+s.diff,
+        tot_cons=tot_cons+s.cons,
+        tot_refill=tot_refill+s.refill
+    FROM (
+        SELECT note_id,
+            SUM(price) AS diff,
+            SUM(CASE WHEN price < 0 THEN price ELSE 0 END) AS cons,
+            SUM(CASE WHEN price > 0 THEN price ELSE 0 END) AS refill
+        FROM new_transactions
+        GROUP BY note_id
+    ) s
+    WHERE notes.id=s.note_id;
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE FUNCTION on_transactions_deletion()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    UPDATE notes SET
+        note=note-s.diff,
+        tot_cons=tot_cons-s.cons,
+        tot_refill=tot_refill-s.refill
+    FROM (
+        SELECT note_id,
+            SUM(price) AS diff,
+            SUM(CASE WHEN price < 0 THEN price ELSE 0 END) AS cons,
+            SUM(CASE WHEN price > 0 THEN price ELSE 0 END) AS refill
+        FROM old_transactions
+        GROUP BY note_id
+    ) s
+    WHERE notes.id=s.note_id;
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE FUNCTION on_transactions_update()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    UPDATE notes SET
+        note=note+s.diff,
+        tot_cons=tot_cons+s.cons,
+        tot_refill=tot_refill+s.refill
+    FROM (
+        SELECT note_id,
+            SUM(diff) AS diff,
+            SUM(CASE WHEN diff > 0 THEN diff ELSE 0 END) AS cons,
+            SUM(CASE WHEN diff < 0 THEN diff ELSE 0 END) AS refill
+        FROM (
+            SELECT new_transactions.note_id,
+                new_transactions.price - old_transactions.price AS diff
+            FROM new_transactions JOIN old_transactions
+            ON new_transactions.id=old_transactions.id
+        ) d
+        WHERE diff != 0
+        GROUP BY note_id
+    ) s
+    WHERE notes.id=s.note_id;
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE TRIGGER on_transactions_insert_trigger
+AFTER INSERT ON transactions
+REFERENCING NEW TABLE AS new_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE on_transactions_insert();
+
+CREATE TRIGGER on_transactions_deletion_trigger
+AFTER DELETE ON transactions
+REFERENCING OLD TABLE AS old_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE on_transactions_deletion();
+
+CREATE TRIGGER on_transactions_update_trigger
+AFTER UPDATE ON transactions
+REFERENCING OLD TABLE AS old_transactions NEW TABLE AS new_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE on_transactions_update();
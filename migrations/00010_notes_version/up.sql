@@ -0,0 +1,23 @@
+ALTER TABLE notes ADD COLUMN version BIGINT DEFAULT 0 NOT NULL;
+
+CREATE FUNCTION bump_note_version()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    NEW.version = OLD.version + 1;
+    RETURN NEW;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bump_note_version_trigger
+BEFORE UPDATE ON notes
+FOR EACH ROW EXECUTE PROCEDURE bump_note_version();
+
+DROP VIEW notes_cache;
+CREATE VIEW notes_cache AS
+    SELECT notes.*, array_remove(array_agg(note_categories.*), NULL) AS categories, bool_or(note_categories.hidden) AS hidden FROM notes
+    LEFT JOIN note_categories_assoc
+    ON notes.id = note_categories_assoc.note
+    LEFT JOIN note_categories
+    ON note_categories.id = note_categories_assoc.category
+    GROUP BY notes.id;
@@ -0,0 +1,4 @@
+DROP INDEX i_transactions_category_product_price_name;
+DROP INDEX i_transactions_date_brin;
+DROP INDEX i_transactions_date_id;
+DROP INDEX i_transactions_note_id_id;
@@ -0,0 +1,9 @@
+-- Note history in the main window: WHERE note_id=? ORDER BY id DESC LIMIT ?
+CREATE INDEX i_transactions_note_id_id ON transactions(note_id, id DESC);
+-- History window: date range filtered and paged on (date, id)
+CREATE INDEX i_transactions_date_id ON transactions(date, id);
+-- Transactions are appended in date order, a BRIN index stays tiny and
+-- serves wide date range scans (stats, exports).
+CREATE INDEX i_transactions_date_brin ON transactions USING BRIN (date);
+-- Stats grouped by product
+CREATE INDEX i_transactions_category_product_price_name ON transactions(category, product, price_name);
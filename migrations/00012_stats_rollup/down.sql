@@ -0,0 +1,7 @@
+DROP TRIGGER stats_rollup_update_trigger ON transactions;
+DROP FUNCTION stats_rollup_update;
+DROP TRIGGER stats_rollup_deletion_trigger ON transactions;
+DROP FUNCTION stats_rollup_deletion;
+DROP TRIGGER stats_rollup_insert_trigger ON transactions;
+DROP FUNCTION stats_rollup_insert;
+DROP TABLE stats_rollup;
@@ -0,0 +1,92 @@
+-- Quantities sold per note and per product at a given unit price, kept up to
+-- date by the transactions triggers so the stats never scan the history.
+CREATE TABLE stats_rollup(
+    note_id INTEGER NOT NULL,
+    category VARCHAR NOT NULL,
+    product VARCHAR NOT NULL,
+    price_name VARCHAR NOT NULL,
+    price NUMERIC NOT NULL,
+    quantity BIGINT NOT NULL,
+    PRIMARY KEY (note_id, category, product, price_name, price)
+);
+
+INSERT INTO stats_rollup (note_id, category, product, price_name, price, quantity)
+SELECT note_id, category, product, price_name, CASE WHEN quantity = 0 THEN price ELSE price / quantity END AS unit_price, SUM(quantity)
+FROM transactions
+WHERE note_id IS NOT NULL
+GROUP BY note_id, category, product, price_name, unit_price;
+
+CREATE FUNCTION stats_rollup_insert()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    INSERT INTO stats_rollup (note_id, category, product, price_name, price, quantity)
+    SELECT note_id, category, product, price_name, price, SUM(quantity) FROM (
+        SELECT note_id, category, product, price_name, CASE WHEN quantity = 0 THEN price ELSE price / quantity END AS price, quantity FROM new_transactions
+    ) d
+    WHERE note_id IS NOT NULL
+    GROUP BY note_id, category, product, price_name, price
+    ON CONFLICT (note_id, category, product, price_name, price)
+    DO UPDATE SET quantity=stats_rollup.quantity + EXCLUDED.quantity;
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE FUNCTION stats_rollup_deletion()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    INSERT INTO stats_rollup (note_id, category, product, price_name, price, quantity)
+    SELECT note_id, category, product, price_name, price, SUM(quantity) FROM (
+        SELECT note_id, category, product, price_name, CASE WHEN quantity = 0 THEN price ELSE price / quantity END AS price, -quantity AS quantity FROM old_transactions
+    ) d
+    WHERE note_id IS NOT NULL
+    GROUP BY note_id, category, product, price_name, price
+    ON CONFLICT (note_id, category, product, price_name, price)
+    DO UPDATE SET quantity=stats_rollup.quantity + EXCLUDED.quantity;
+
+    DELETE FROM stats_rollup WHERE quantity=0
+    AND note_id IN (SELECT note_id FROM old_transactions);
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE FUNCTION stats_rollup_update()
+RETURNS trigger AS
+$BODY$
+BEGIN
+    INSERT INTO stats_rollup (note_id, category, product, price_name, price, quantity)
+    SELECT note_id, category, product, price_name, price, SUM(quantity) FROM (
+        SELECT note_id, category, product, price_name, CASE WHEN quantity = 0 THEN price ELSE price / quantity END AS price, quantity FROM new_transactions
+        UNION ALL
+        SELECT note_id, category, product, price_name, CASE WHEN quantity = 0 THEN price ELSE price / quantity END AS price, -quantity AS quantity FROM old_transactions
+    ) d
+    WHERE note_id IS NOT NULL
+    GROUP BY note_id, category, product, price_name, price
+    HAVING SUM(quantity) != 0
+    ON CONFLICT (note_id, category, product, price_name, price)
+    DO UPDATE SET quantity=stats_rollup.quantity + EXCLUDED.quantity;
+
+    DELETE FROM stats_rollup WHERE quantity=0
+    AND note_id IN (SELECT note_id FROM old_transactions);
+
+    RETURN NULL;
+END;
+$BODY$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stats_rollup_insert_trigger
+AFTER INSERT ON transactions
+REFERENCING NEW TABLE AS new_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_rollup_insert();
+
+CREATE TRIGGER stats_rollup_deletion_trigger
+AFTER DELETE ON transactions
+REFERENCING OLD TABLE AS old_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_rollup_deletion();
+
+CREATE TRIGGER stats_rollup_update_trigger
+AFTER UPDATE ON transactions
+REFERENCING OLD TABLE AS old_transactions NEW TABLE AS new_transactions
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_rollup_update();
@@ -19,6 +19,7 @@
 
 from PyQt5 import QtCore, QtWidgets
 from database import Cursor
+import api.catalog
 import api.users
 import api.notes
 import api.redis
@@ -121,8 +122,9 @@ class BaseTest(unittest.TestCase):
     def _reset_db(self):
         tables = ["admins", "note_categories_assoc", "prices", "products",
         "products", "price_description", "notes", "transactions", "panels",
-        "panel_content", "scheduled_mails", "mail_models", "note_categories", "categories"]
-        name_table = ["admins", "scheduled_mails", "mail_models", "panel_content"]
+        "panel_content", "scheduled_mails", "mail_models", "note_categories", "categories",
+        "stats_rollup"]
+        name_table = ["admins", "scheduled_mails", "mail_models", "panel_content", "stats_rollup"]
 
         with Cursor() as cursor:
             assert(cursor.exec_("ALTER TABLE admins DISABLE TRIGGER at_least_one_manage_users"))
@@ -132,6 +134,9 @@ class BaseTest(unittest.TestCase):
                     cursor.exec_("ALTER SEQUENCE {}_id_seq RESTART WITH 1".format(table))
             cursor.exec_("ALTER TABLE admins ENABLE TRIGGER at_least_one_manage_users")
         api.notes.rebuild_cache()
+        api.transactions.FACETS_CACHE.clear()
+        api.transactions.HISTORY_CACHE.clear()
+        api.catalog.invalidate()
 
     def assertMyDictEqual(self, d1, d2, ignore=None):
         """ ignore is a list of keys to ignore but that should be there in d1
@@ -0,0 +1,75 @@
+# Copyright (C) 2014-2018 Bastien Orivel <b2orivel@enib.fr>
+# Copyright (C) 2014-2018 Arnaud Levaufre <a2levauf@enib.fr>
+#
+# This file is part of Enibar.
+#
+# Enibar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Enibar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Enibar.  If not, see <http://www.gnu.org/licenses/>.
+
+import basetest
+import api.catalog
+import api.categories
+import api.prices
+import api.products
+
+from database import STATEMENTS
+
+
+class CatalogTest(basetest.BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.cat = api.categories.add("Boire")
+        self.desc = api.prices.add_descriptor("Pinte", self.cat, 500)
+        self.product = api.products.add("Kro", category_id=self.cat, percentage=5)
+
+    def test_lookups(self):
+        """ Testing the catalog lookups """
+        self.assertEqual(api.catalog.get_category("Boire")['id'], self.cat)
+        self.assertEqual(api.catalog.get_category(id_=self.cat)['name'], "Boire")
+        self.assertEqual(api.catalog.get_descriptor(self.cat, "Pinte")['quantity'], 500)
+        product = api.catalog.get_product(self.cat, "Kro")
+        self.assertEqual(product['id'], self.product)
+        self.assertEqual(product['percentage'], 5)
+        self.assertEqual(api.catalog.get_price(self.product, "Pinte")['value'], 0)
+
+        # Everything is in memory now
+        queries = STATEMENTS.hits + STATEMENTS.misses
+        api.catalog.get_category("Boire")
+        api.catalog.get_descriptor(self.cat, "Pinte")
+        api.catalog.get_product(self.cat, "Kro")
+        self.assertEqual(STATEMENTS.hits + STATEMENTS.misses, queries)
+
+    def test_missing(self):
+        """ Testing the catalog is reloaded when something is missing """
+        self.assertEqual(api.catalog.get_product(self.cat, "Kro")['id'], self.product)
+        leffe = api.products.add("Leffe", category_id=self.cat, percentage=6)
+        self.assertEqual(api.catalog.get_product(self.cat, "Leffe")['id'], leffe)
+
+    def test_missing_remembered(self):
+        """ Testing an item still missing after a reload doesn't reload again """
+        self.assertIsNone(api.catalog.get_product(self.cat, "Chouffe"))
+        queries = STATEMENTS.hits + STATEMENTS.misses
+        self.assertIsNone(api.catalog.get_product(self.cat, "Chouffe"))
+        self.assertEqual(STATEMENTS.hits + STATEMENTS.misses, queries)
+
+        chouffe = api.products.add("Chouffe", category_id=self.cat, percentage=8)
+        api.catalog.invalidate()
+        self.assertEqual(api.catalog.get_product(self.cat, "Chouffe")['id'], chouffe)
+
+    def test_invalidate(self):
+        """ Testing invalidating the catalog """
+        self.assertEqual(api.catalog.get_product(self.cat, "Kro")['percentage'], 5)
+        api.products.set_percentage(self.product, 7)
+        self.assertEqual(api.catalog.get_product(self.cat, "Kro")['percentage'], 5)
+        api.catalog.invalidate()
+        self.assertEqual(api.catalog.get_product(self.cat, "Kro")['percentage'], 7)
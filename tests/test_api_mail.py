@@ -19,16 +19,61 @@
 
 import basetest
 import freezegun
+import settings
+import socketserver
+import threading
 import time
 import os
 import os.path
 import PyQt5
 import api.mail
+import api.note_categories
 import api.notes
 import api.redis
 import mock
 
 
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """ Speak just enough SMTP for smtplib """
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply("220 localhost")
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "RCPT":
+                with self.server.lock:
+                    self.server.mails.append(command.split(":", 1)[1].strip("<> "))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """ Local SMTP server keeping the recipients of the mails it receives """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port):
+        super().__init__(('127.0.0.1', port), SMTPHandler)
+        self.mails = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
 class MailTest(basetest.BaseTest):
     def setUp(self):
         super().setUp()
@@ -112,12 +157,24 @@ class MailTest(basetest.BaseTest):
     def test_get_recipients(self):
         """ Testing get recipients
         """
-        self.assertEqual(api.notes.get(lambda x: x['mails_inscription']), api.mail.get_recipients(0, ""))
-        self.assertEqual(api.notes.get(lambda x: x['mail'] in ('note1', 'note2')), api.mail.get_recipients(1, "note1,note2"))
-        self.assertEqual(api.notes.get(lambda x: x['note'] >= 0 and x['mails_inscription']), api.mail.get_recipients(2, "0"))
-        self.assertEqual(api.notes.get(lambda x: x['note'] < 0 and x['mails_inscription']), api.mail.get_recipients(3, "0"))
-        self.assertEqual([], api.mail.get_recipients(2, ""))
-        self.assertEqual([], api.mail.get_recipients(520, ""))
+        def nicks(filter_, filter_arg):
+            return [note['nickname'] for note in api.mail.get_recipients(filter_, filter_arg)]
+
+        notes = ["note{}".format(i) for i in range(10)]
+        self.assertEqual(nicks(0, ""), notes)
+        self.assertEqual(nicks(1, "note1,note2,note1,cocou"), ["note1", "note2"])
+        self.assertEqual(nicks(2, "0"), notes[5:])
+        self.assertEqual(nicks(3, "0"), notes[:5])
+        self.assertEqual(nicks(2, ""), [])
+        self.assertEqual(nicks(520, ""), [])
+
+        recipient = api.mail.get_recipients(1, "note1")[0]
+        self.assertEqual(set(recipient), set(api.mail.COMPLETION_FIELD.values()))
+        self.assertEqual(recipient['note'], -5)
+
+        self.add_hidden_notes_category("hidden")
+        api.note_categories.add_notes(["note1"], "hidden")
+        self.assertEqual(nicks(1, "note1,note2"), ["note2"])
 
     def test_format_message(self):
         """ Testing mail message format
@@ -165,6 +222,23 @@ class MailTest(basetest.BaseTest):
                 "m2blabla@enib.fr +33605040302 " + "24/12/2014" + " 1A -25 Jamais 5"
         )
 
+    def test_compile_message(self):
+        """ Testing compiled messages
+        """
+        api.mail.compile_message.cache_clear()
+        render = api.mail.compile_message("{surnom} {nom} {note:.2f} {date_note_negative}")
+        self.assertIs(api.mail.compile_message("{surnom} {nom} {note:.2f} {date_note_negative}"), render)
+        note = {
+            'nickname': "Nickname",
+            'lastname': "Lastname",
+            'overdraft_date': PyQt5.QtCore.QDate(2014, 5, 1),
+            'note': -25,
+        }
+        self.assertEqual(render(note), "Nickname Lastname -25.00 01/05/2014")
+        note['overdraft_date'] = PyQt5.QtCore.QDate()
+        self.assertEqual(render(note), "Nickname Lastname -25.00 Jamais")
+        self.assertEqual(note['overdraft_date'], PyQt5.QtCore.QDate())
+
     def test_get_models(self):
         """ Testing get mail models
         """
@@ -391,3 +465,25 @@ class MailTest(basetest.BaseTest):
                 "---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------\n"
             )
 
+    def test_send_mails(self):
+        """ Testing sending many mails on a few connections
+        """
+        sink = SMTPSink(52525)
+        thread = threading.Thread(target=sink.serve_forever, kwargs={'poll_interval': 0.1})
+        thread.start()
+        addr, port = settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT
+        settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT = '127.0.0.1', 52525
+        try:
+            mails = [("{}@enib.fr".format(i), "Subject", "Message", "cafeteria@enib.fr")
+                     for i in range(20)]
+            self.assertEqual(api.mail.send_mails(mails, connections=2), [True] * 20)
+        finally:
+            settings.SMTP_SERVER_ADDR, settings.SMTP_SERVER_PORT = addr, port
+            sink.shutdown()
+            sink.server_close()
+            thread.join()
+
+        self.assertEqual(sorted(sink.mails), sorted(mail[0] for mail in mails))
+        self.assertEqual(sink.connections, 2)
+        with open("mail.log") as logfile:
+            self.assertEqual(logfile.read().count("Mail sent on"), 20)
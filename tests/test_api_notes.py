@@ -18,6 +18,7 @@
 
 import basetest
 import freezegun
+import mock
 import time
 import os.path
 import PyQt5
@@ -113,6 +114,7 @@ class NotesTest(basetest.BaseTest):
                                  'mails_inscription': False,
                                  'stats_inscription': True,
                                  'agios_inscription': True,
+                                 'version': 0,
                                  'hidden': False,
                                  'categories': []})
         self.assertTrue(os.path.isfile("img/coucou.jpg"))
@@ -172,6 +174,7 @@ class NotesTest(basetest.BaseTest):
                            'mails_inscription': True,
                            'stats_inscription': True,
                            'agios_inscription': True,
+                           'version': 0,
                            'hidden': False,
                            'categories': []}, res)
 
@@ -218,6 +221,7 @@ class NotesTest(basetest.BaseTest):
                                  'mails_inscription': True,
                                  'stats_inscription': True,
                                  'agios_inscription': True,
+                                 'version': 0,
                                  'hidden': False,
                                  'categories': []}])
 
@@ -264,6 +268,7 @@ class NotesTest(basetest.BaseTest):
                                  'mails_inscription': True,
                                  'stats_inscription': True,
                                  'agios_inscription': True,
+                                 'version': 0,
                                  'hidden': False,
                                  'categories': []}])
 
@@ -507,5 +512,112 @@ class NotesTest(basetest.BaseTest):
                                  'mails_inscription': True,
                                  'stats_inscription': True,
                                  'agios_inscription': True,
+                                 'version': 2,
                                  'hidden': False,
                                  'categories': []}])
+
+    def test_keyed_lookups(self):
+        """ Testing get_by_nick, get_by_id, get_by_mail and get_by_name
+        """
+        id0 = self.add_note("test0", mail="test0@pouette.fr")
+        id1 = self.add_note("test1", name="test", first_name="test")
+        id2 = self.add_note("test2", name="test", first_name="test")
+
+        self.assertEqual(notes.get_by_nick("test0")['id'], id0)
+        self.assertIsNone(notes.get_by_nick("nope"))
+        self.assertEqual(notes.get_by_id(id1)['nickname'], "test1")
+        self.assertIsNone(notes.get_by_id(42))
+        self.assertEqual([n['id'] for n in notes.get_by_mail("test0@pouette.fr")], [id0])
+        self.assertEqual(sorted(n['id'] for n in notes.get_by_name("test", "test")), [id1, id2])
+        self.assertEqual(notes.get_by_name("nope", "nope"), [])
+
+    def test_keyed_lookups_follow_cache_updates(self):
+        """ Testing that indexes follow notes changes and removal
+        """
+        id0 = self.add_note("test0")
+        notes.change_values("test0", mail="new@pouette.fr", firstname="new")
+        self.assertEqual(notes.get_by_mail("test@pouette.fr"), [])
+        self.assertEqual([n['id'] for n in notes.get_by_mail("new@pouette.fr")], [id0])
+        self.assertEqual(notes.get_by_name("test0", "test0"), [])
+        self.assertEqual([n['id'] for n in notes.get_by_name("new", "test0")], [id0])
+
+        notes.remove(["test0"])
+        self.assertIsNone(notes.get_by_nick("test0"))
+        self.assertIsNone(notes.get_by_id(id0))
+        self.assertEqual(notes.get_by_mail("new@pouette.fr"), [])
+
+    def test_notes_stats_batch(self):
+        """ Testing notes stats when several notes are hit by one statement
+        """
+        self.add_note("test0")
+        self.add_note("test1")
+        self.add_transaction(['test0', 'test1', 'test0'], 10)
+        self.add_transaction(['test0', 'test1', 'test0'], -3)
+        api.notes.rebuild_cache()
+        note0 = notes.get_by_nick("test0")
+        note1 = notes.get_by_nick("test1")
+        self.assertEqual((note0['note'], note0['tot_cons'], note0['tot_refill']), (14.0, -6.0, 20.0))
+        self.assertEqual((note1['note'], note1['tot_cons'], note1['tot_refill']), (7.0, -3.0, 10.0))
+
+        transactions.rollback_transaction(4, full=True)
+        api.notes.rebuild_cache()
+        note0 = notes.get_by_nick("test0")
+        self.assertEqual((note0['note'], note0['tot_cons'], note0['tot_refill']), (17.0, -3.0, 20.0))
+
+    def test_patch_note_cache(self):
+        """ Testing patching the cache with enibar-notes payloads
+        """
+        self.add_note("test0")
+        api.redis.send_message = lambda x, y: None
+        self.add_transaction(["test0"], -5)
+        payloads = notes.get_payloads(["test0", "nope"])
+        self.assertEqual(payloads["nope"], None)
+        self.assertEqual(payloads["test0"]['version'], 1)
+        self.assertEqual(payloads["test0"]['note'], -5.0)
+
+        with mock.patch('api.notes.rebuild_note_cache') as rebuild:
+            notes.apply_notes_message({"test0": payloads["test0"]})
+            self.assertFalse(rebuild.called)
+        note = notes.get_by_nick("test0")
+        self.assertEqual(note['note'], -5.0)
+        self.assertEqual(note['tot_cons'], -5.0)
+        self.assertEqual(note['version'], 1)
+        self.assertEqual(note['overdraft_date'], PyQt5.QtCore.QDate.currentDate())
+
+        # Replaying the same message is a no-op
+        with mock.patch('api.notes.rebuild_note_cache') as rebuild:
+            notes.apply_notes_message({"test0": payloads["test0"]})
+            self.assertFalse(rebuild.called)
+
+    def test_patch_note_cache_version_gap(self):
+        """ Testing that a version gap falls back to the database
+        """
+        self.add_note("test0")
+        api.redis.send_message = lambda x, y: None
+        self.add_transaction(["test0"], -5)
+        self.add_transaction(["test0"], 2)
+        payloads = notes.get_payloads(["test0"])
+        self.assertEqual(payloads["test0"]['version'], 2)
+
+        notes.apply_notes_message(payloads)
+        note = notes.get_by_nick("test0")
+        self.assertEqual(note['note'], -3.0)
+        self.assertEqual(note['tot_refill'], 2.0)
+        self.assertEqual(note['version'], 2)
+
+    def test_lazy_cache(self):
+        """ Testing that the cache is only built when the notes are read
+        """
+        self.add_note("test0")
+        notes.NOTES_CACHE.load({})
+        notes.NOTES_CACHE.loaded = False
+
+        # Patching an unbuilt cache doesn't load the notes
+        notes.apply_notes_message(["test0"])
+        notes.apply_notes_message({"test0": None})
+        self.assertFalse(notes.NOTES_CACHE.loaded)
+        self.assertEqual(len(notes.NOTES_CACHE), 0)
+
+        self.assertEqual(notes.get_by_nick("test0")['nickname'], "test0")
+        self.assertTrue(notes.NOTES_CACHE.loaded)
+        self.assertIs(notes.get_cache(), notes.NOTES_CACHE)
@@ -86,11 +86,11 @@ class RedisTest(basetest.BaseTest):
 
     @give_random_key
     def test_locking(self, key):
-        self.assertFalse(api.redis.blocking_connection.exists(key))
+        self.assertFalse(api.redis.get_blocking_connection().exists(key))
         self.assertEqual(api.redis.LOCKS, {})
         self.assertTrue(api.redis.lock(key, 10))
         self.assertEqual(api.redis.LOCKS, {key: 10})
-        self.assertTrue(api.redis.blocking_connection.exists(key))
+        self.assertTrue(api.redis.get_blocking_connection().exists(key))
         self.assertFalse(api.redis.lock(key, 10))
 
     @give_random_key
@@ -139,3 +139,52 @@ class RedisTest(basetest.BaseTest):
         loop.run_until_complete(asyncio.ensure_future(wait_2s()))
 
         self.assertFalse(api.redis.lock(key, 1))
+
+    def test_event_coalescer(self):
+        handled = []
+
+        async def handler(events):
+            handled.append(events)
+
+        coalescer = api.redis.EventCoalescer(handler, delay=0.05)
+        coalescer.push('enibar-notes', ['a', 'b'])
+        coalescer.push('enibar-notes', {'c': {'version': 2}})
+        coalescer.push('enibar-notes', {'c': {'version': 1}, 'a': {'version': 3}})
+        coalescer.push('enibar-delete', ['b', 'd'])
+        coalescer.push('enibar-panels', {})
+        coalescer.push('enibar-panels', {})
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+        self.assertEqual(handled, [{
+            'enibar-notes': {'a': None, 'c': {'version': 2}},
+            'enibar-delete': ['b', 'd'],
+            'enibar-panels': {},
+        }])
+        self.assertEqual((coalescer.received, coalescer.handled), (6, 1))
+
+        # A note created again after its deletion isn't deleted
+        coalescer.push('enibar-delete', ['a'])
+        coalescer.push('enibar-notes', ['a'])
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(handled[1], {'enibar-notes': {'a': None}, 'enibar-delete': []})
+        self.assertEqual((coalescer.received, coalescer.handled), (8, 2))
+
+    def test_event_coalescer_serialized(self):
+        running = []
+        handled = []
+
+        async def handler(events):
+            running.append(events)
+            self.assertEqual(len(running), 1)
+            await asyncio.sleep(0.1)
+            handled.append(running.pop())
+
+        coalescer = api.redis.EventCoalescer(handler, delay=0.05)
+        coalescer.push('enibar-notes', ['a'])
+        self.loop.run_until_complete(asyncio.sleep(0.07))
+        # Received while the handler runs, handled once it returned
+        coalescer.push('enibar-notes', ['b'])
+        self.loop.run_until_complete(asyncio.sleep(0.3))
+
+        self.assertEqual(handled, [{'enibar-notes': {'a': None}}, {'enibar-notes': {'b': None}}])
+        self.assertIsNone(coalescer.task)
@@ -127,6 +127,29 @@ class StatsTests(basetest.BaseTest):
             ]
         )
 
+    def test_stats_rollup(self):
+        """ Testing the stats follow the history """
+        transactions.log_transactions([{
+            'note': "test2",
+            'category': "a",
+            'product': "b",
+            'price_name': "c",
+            'quantity': 3,
+            'price': -3,
+        }])
+        lines = [line for line in stats.get_notes_stats() if line['nickname'] == 'test2' and line['category'] == 'a']
+        self.assertEqual(lines, [{'price_name': 'c', 'category': 'a', 'nickname': 'test2', 'price': -1.0, 'quantity': 4, 'product': 'b'}])
+
+        id_ = transactions.get_unique(note="test2", quantity=3)['id']
+        transactions.rollback_transaction(id_)
+        lines = [line for line in stats.get_notes_stats() if line['nickname'] == 'test2' and line['category'] == 'a']
+        self.assertEqual(lines, [{'price_name': 'c', 'category': 'a', 'nickname': 'test2', 'price': -1.0, 'quantity': 3, 'product': 'b'}])
+
+        transactions.rollback_transaction(id_, True)
+        transactions.rollback_transaction(transactions.get_unique(note="test2", category="a")['id'])
+        lines = [line for line in stats.get_notes_stats() if line['nickname'] == 'test2' and line['category'] == 'a']
+        self.assertEqual(lines, [])
+
     def test_red_sum(self):
         red = api.stats.get_red_sum()
         self.assertEqual((2, -20), red)
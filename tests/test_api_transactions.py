@@ -20,6 +20,7 @@ import basetest
 
 import api.transactions as transactions
 import api.notes as notes
+from database import Cursor
 
 
 class TransactionsTest(basetest.BaseTest):
@@ -206,6 +207,94 @@ class TransactionsTest(basetest.BaseTest):
         self.assertEqual(list(transactions.get_possible_filter_values("note", {'lastname': "test2"})), ['test2'])
         self.assertEqual(list(transactions.get_possible_filter_values("note", {})), ['test1', 'test2'])
 
+    def test_get_filter_facets(self):
+        """ Testing all filter values are fetched at once """
+        transactions.log_transactions([
+            {'note': "test1", 'category': "b", 'product': "d", 'price_name': "c", 'quantity': 1, 'price': -5},
+            {'note': "test2", 'category': "e", 'product': "f", 'price_name': "g", 'quantity': 2, 'price': 5},
+            {'note': "test2", 'category': "Note", 'product': "Refill", 'price_name': "-", 'quantity': 1, 'price': 5},
+        ])
+        for filters in [{}, {'lastname': "test2"}, {'category': "Note"}, {'note': "test1", 'product': "f"}]:
+            facets = transactions.get_filter_facets(filters)
+            for col in transactions.HISTORY_FILTERS:
+                self.assertEqual(facets[col], list(transactions.get_possible_filter_values(col, filters)))
+        self.assertCountEqual(transactions.get_filter_facets({'lastname': "test2"})['category'], ['e', 'Note'])
+
+        # Logging a transaction drops the cached facets
+        transactions.log_transactions([{'note': "test1", 'category': "z", 'product': "d", 'price_name': "c", 'quantity': 1, 'price': -5}])
+        self.assertIn('z', transactions.get_filter_facets({})['category'])
+
+        # Expired facets are dropped and the cache is bounded
+        size = transactions.FACETS_CACHE_SIZE
+        transactions.FACETS_CACHE_SIZE = 2
+        try:
+            for note in ["test1", "test2", "test3"]:
+                transactions.get_filter_facets({'note': note})
+            self.assertEqual(list(transactions.FACETS_CACHE),
+                             [frozenset({'note': note}.items()) for note in ["test2", "test3"]])
+            for key, (cached_at, facets) in transactions.FACETS_CACHE.items():
+                transactions.FACETS_CACHE[key] = (cached_at - transactions.FACETS_CACHE_TTL, facets)
+            transactions.get_filter_facets({})
+            self.assertEqual(list(transactions.FACETS_CACHE), [frozenset()])
+        finally:
+            transactions.FACETS_CACHE_SIZE = size
+
+    def test_get_note_id(self):
+        """ Testing getting a note history by note_id """
+        transactions.log_transactions([
+            {'note': "test1", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 1, 'price': -1},
+            {'note': "test2", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 1, 'price': -1},
+            {'note': "test1", 'category': "b", 'product': "d", 'price_name': "c", 'quantity': 1, 'price': -2},
+        ])
+        note_id = notes.get_by_nick("test1")['id']
+        self.assertEqual([t['id'] for t in transactions.get(note_id=note_id, reverse=True)], [3, 1])
+        self.assertEqual([t['id'] for t in transactions.get(note_id=note_id, reverse=True, max_=1)], [3])
+
+    def test_get_batches(self):
+        """ Testing streaming transactions by batches """
+        transactions.log_transactions([
+            {'note': "test1", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 1, 'price': -i}
+            for i in range(5)
+        ])
+        batches = list(transactions.get_batches(batch_size=2))
+        self.assertEqual([[t['id'] for t in batch] for batch in batches], [[1, 2], [3, 4], [5]])
+        self.assertEqual(batches[0][0], next(transactions.get(id=1)))
+        self.assertEqual([[t['id'] for t in batch] for batch in transactions.get_batches(batch_size=2, id__gt=3)], [[4, 5]])
+        self.assertEqual([len(batch) for batch in transactions.get_batches(batch_size=2, note="test1")], [2, 2, 1])
+        self.assertEqual(list(transactions.get_batches(note="it's nobody")), [])
+
+        # Other queries can run between two batches
+        for batch in transactions.get_batches(batch_size=2):
+            transactions.get_unique(id=batch[0]['id'])
+
+    def test_note_history_cache(self):
+        """ Testing the note history cache """
+        note_id = notes.get_by_nick("test1")['id']
+        transactions.log_transactions([
+            {'note': "test1", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 1, 'price': -1},
+        ])
+        self.assertEqual([t['id'] for t in transactions.get_note_history(note_id, 2)], [1])
+        self.assertIn(note_id, transactions.HISTORY_CACHE)
+
+        # Logged transactions are added to the cache, which matches the database
+        transactions.log_transactions([
+            {'note': "test1", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 2, 'price': -2},
+            {'note': "test2", 'category': "a", 'product': "b", 'price_name': "c", 'quantity': 1, 'price': -1},
+            {'note': "test1", 'category': "d", 'product': "e", 'price_name': "f", 'quantity': 1, 'price': -3},
+        ])
+        cached = transactions.get_note_history(note_id, 2)
+        self.assertEqual(cached, list(transactions.get(note_id=note_id, reverse=True, max_=2)))
+
+        # A message about the version we already have keeps the cache
+        transactions.invalidate_history_cache(notes.get_payloads(["test1"]))
+        self.assertIn(note_id, transactions.HISTORY_CACHE)
+        transactions.invalidate_history_cache(["test1"])
+        self.assertNotIn(note_id, transactions.HISTORY_CACHE)
+
+        transactions.get_note_history(note_id, 2)
+        transactions.rollback_transaction(4, full=True)
+        self.assertEqual([t['id'] for t in transactions.get_note_history(note_id, 2)], [2, 1])
+
     def test_get_gt(self):
         """ Testing __gt """
         transactions.log_transactions([{
@@ -233,3 +322,66 @@ class TransactionsTest(basetest.BaseTest):
             'price': 5
         }])
         self.assertEqual(len(list(transactions.get(id__gt=1))), 2)
+
+    def test_log_transactions_batches(self):
+        """ Testing log_transactions over several batches
+        """
+        old_batch_size = transactions.LOG_BATCH_SIZE
+        transactions.LOG_BATCH_SIZE = 2
+        try:
+            trs = [{'note': "test1" if i % 2 else "test2",
+                    'category': "a",
+                    'product': "b",
+                    'price_name': "c",
+                    'quantity': 1,
+                    'price': -i} for i in range(5)]
+            self.assertTrue(transactions.log_transactions(trs))
+        finally:
+            transactions.LOG_BATCH_SIZE = old_batch_size
+
+        self.assertEqual(self.count_transactions(), 5)
+        self.assertEqual([tr['id'] for tr in trs], [1, 2, 3, 4, 5])
+        self.assertEqual([tr['note_id'] for tr in trs], [2, 1, 2, 1, 2])
+        for tr in trs:
+            self.assertIsInstance(tr['date'], str)
+        self.assertEqual([tr['price'] for tr in transactions.get()], [0, -1, -2, -3, -4])
+
+    def test_log_transactions_unknown_note(self):
+        """ Testing log_transactions with an unknown note logs nothing
+        """
+        self.assertFalse(transactions.log_transactions([
+            {'note': "test1", 'category': "a", 'product': "b",
+             'price_name': "c", 'quantity': 1, 'price': -1},
+            {'note': "nope", 'category': "a", 'product': "b",
+             'price_name': "c", 'quantity': 1, 'price': -1},
+        ]))
+        self.assertEqual(self.count_transactions(), 0)
+
+    def test_apply_agios(self):
+        """ Testing charging the agios """
+        with Cursor() as cursor:
+            cursor.exec_("UPDATE notes SET note=-10, agios_inscription=TRUE, overdraft_date=DATE(NOW()) - 20 WHERE nickname='test1'")
+            cursor.exec_("UPDATE notes SET note=-10, agios_inscription=TRUE, overdraft_date=DATE(NOW()) - 2 WHERE nickname='test2'")
+        notes.rebuild_cache()
+
+        summary = transactions.apply_agios(5, 14, 7, dry_run=True)
+        self.assertEqual(summary['count'], 1)
+        self.assertEqual(summary['total'], -0.5)
+        self.assertEqual(summary['lines'], [{'note': 'test1', 'balance': -10, 'price': -0.5}])
+        self.assertEqual(list(transactions.get(category="AGIO")), [])
+
+        summary = transactions.apply_agios(5, 14, 7)
+        self.assertEqual((summary['count'], summary['total']), (1, -0.5))
+        line = transactions.get_unique(category="AGIO")
+        self.assertEqual(line['note'], "test1")
+        self.assertEqual(float(line['price']), -0.5)
+        # The balance is only charged once, by the transactions triggers
+        self.assertEqual(notes.get_by_nick("test1")['note'], -10.5)
+        self.assertEqual(notes.get_by_nick("test2")['note'], -10)
+        with Cursor() as cursor:
+            cursor.exec_("SELECT last_agio=DATE(NOW()) FROM notes WHERE nickname='test1'")
+            cursor.next()
+            self.assertTrue(cursor.value(0))
+
+        # Already charged
+        self.assertEqual(transactions.apply_agios(5, 14, 7)['count'], 0)
@@ -18,7 +18,9 @@
 
 import basetest
 
-from database import Cursor
+from database import Cursor, Database, STATEMENTS, run_in_thread
+import api.categories
+import threading
 
 
 class UtilsTest(basetest.BaseTest):
@@ -27,3 +29,73 @@ class UtilsTest(basetest.BaseTest):
         with Cursor() as cursor:
             self.assertNotIn("not open", cursor.__repr__())
 
+    def test_run_in_thread(self):
+        """ Test running queries on a worker thread """
+        def query(value):
+            with Cursor() as cursor:
+                cursor.prepare("SELECT :value")
+                cursor.bindValue(":value", value)
+                cursor.exec_()
+                cursor.next()
+                with Database() as database:
+                    name = database.connectionName()
+                return cursor.value(0), name, threading.current_thread() is threading.main_thread()
+
+        value, name, main_thread = self.loop.run_until_complete(run_in_thread(query, 42))
+        self.assertEqual(value, 42)
+        self.assertTrue(name.startswith("enibar-worker-"))
+        self.assertFalse(main_thread)
+
+    def test_run_in_thread_error(self):
+        """ Test errors are raised to the caller """
+        def fail():
+            raise ValueError("pouette")
+
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(run_in_thread(fail))
+
+    def test_statement_cache(self):
+        """ Test prepared statements are reused """
+        cat_id = api.categories.add("Test")
+        STATEMENTS.clear()
+        self.assertEqual(api.categories.get_unique(name="Test")['name'], "Test")
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (0, 1))
+        self.assertEqual(api.categories.get_unique(name="Test")['name'], "Test")
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (1, 1))
+        self.assertIsNone(api.categories.get_unique(name="Nope"))
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (2, 1))
+
+        # Another filter is another statement
+        self.assertEqual(len(list(api.categories.get(id=cat_id))), 1)
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (2, 2))
+
+        # A statement in use isn't lent twice
+        first = api.categories.get(name="Test")
+        next(first)
+        self.assertEqual(api.categories.get_unique(name="Test")['name'], "Test")
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (3, 3))
+        self.assertEqual(list(first), [])
+        self.assertEqual(api.categories.get_unique(name="Test")['name'], "Test")
+        self.assertEqual((STATEMENTS.hits, STATEMENTS.misses), (4, 3))
+
+    def test_statement_cache_stale_plan(self):
+        """ Test prepared statements are dropped once the table changed """
+        STATEMENTS.clear()
+        with Cursor() as cursor:
+            cursor.exec_("CREATE TABLE stale_plan (id INTEGER)")
+            cursor.exec_("INSERT INTO stale_plan VALUES (1)")
+
+        def select():
+            with STATEMENTS.prepared("stale_plan", lambda: "SELECT * FROM stale_plan") as query:
+                return query.exec_() and query.next()
+
+        try:
+            self.assertTrue(select())
+            with Cursor() as cursor:
+                cursor.exec_("ALTER TABLE stale_plan ADD COLUMN value INTEGER")
+            self.assertFalse(select())
+            self.assertEqual(STATEMENTS.statements, {})
+            self.assertTrue(select())
+        finally:
+            with Cursor() as cursor:
+                cursor.exec_("DROP TABLE stale_plan")
@@ -25,6 +25,7 @@ import api.transactions
 import api.notes
 import api.redis
 import json
+import mock
 from database import Cursor
 import datetime
 
@@ -85,19 +86,91 @@ class HistoryWindowTest(basetest.BaseGuiTest):
         self.loop.run_until_complete(wait())
         self.loop.run_until_complete(self.reset_redis())
 
+    def get_rows(self):
+        model = self.win.transaction_list.model()
+        return [tuple(model.index(row, col).data() for col in range(model.columnCount()))
+                for row in range(model.rowCount())]
+
+    def select_row(self, row):
+        view = self.win.transaction_list
+        view.selectionModel().select(
+            view.model().index(row, 0),
+            QtCore.QItemSelectionModel.ClearAndSelect | QtCore.QItemSelectionModel.Rows
+        )
+
     def test_show_lines(self):
         """ Testing showing history
         """
         def test_func():
             d = self.now.strftime("%Y/%m/%d %H:%M:%S")
-            self.assertCountEqual(self.get_tree(self.win.transaction_list),
-                [{(d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1'): []}, {(d, 'test1', 'b', 'd', 'c', '2', '-', '5.0', '2'): []}, {(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'): []}]
+            self.assertEqual(self.get_rows(),
+                [(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'), (d, 'test1', 'b', 'd', 'c', '2', '-', '5.0', '2'), (d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1')]
             )
             self.app.exit()
 
         QtCore.QTimer.singleShot(2000, test_func)
         self.app.exec_()
 
+    def test_fetch_by_page(self):
+        """ Testing the history is fetched page by page
+        """
+        model = self.win.model
+        model.PAGE_SIZE = 2
+        start = QtCore.QDateTime.fromSecsSinceEpoch(0)
+        end = QtCore.QDateTime.currentDateTime().addSecs(60)
+        model.set_filters({}, start, end)
+        self.assertEqual([model.transaction(row)['id'] for row in range(model.rowCount())], [3, 2])
+        self.assertTrue(model.canFetchMore(QtCore.QModelIndex()))
+        model.fetchMore(QtCore.QModelIndex())
+        self.assertEqual([model.transaction(row)['id'] for row in range(model.rowCount())], [3, 2, 1])
+        self.assertFalse(model.canFetchMore(QtCore.QModelIndex()))
+
+        model.set_filters({'note': 'test1'}, start, end)
+        model.fetchMore(QtCore.QModelIndex())
+        self.assertEqual([model.transaction(row)['id'] for row in range(model.rowCount())], [2, 1])
+        self.assertEqual(api.transactions.get_summary({'note': 'test1'}, start, end),
+                         {'quantity': 3, 'credited': 0, 'debited': -6})
+
+    def test_sort(self):
+        """ Testing sorting the history by a column
+        """
+        model = self.win.model
+        model.PAGE_SIZE = 2
+        start = QtCore.QDateTime.fromSecsSinceEpoch(0)
+        end = QtCore.QDateTime.currentDateTime().addSecs(60)
+        model.set_filters({}, start, end)
+
+        def ids():
+            while model.canFetchMore(QtCore.QModelIndex()):
+                model.fetchMore(QtCore.QModelIndex())
+            return [model.transaction(row)['id'] for row in range(model.rowCount())]
+
+        self.win.transaction_list.sortByColumn(2, QtCore.Qt.AscendingOrder)
+        self.assertEqual(ids(), [1, 2, 3])
+        self.win.transaction_list.sortByColumn(6, QtCore.Qt.DescendingOrder)
+        self.assertEqual(ids(), [3, 1, 2])
+        # The debit column shows -price
+        self.win.transaction_list.sortByColumn(7, QtCore.Qt.DescendingOrder)
+        self.assertEqual(ids(), [2, 1, 3])
+
+    def test_export_all(self):
+        """ Testing exporting every line exports the whole filtered history
+        """
+        model = self.win.model
+        model.PAGE_SIZE = 2
+        start = QtCore.QDateTime.fromSecsSinceEpoch(0)
+        end = QtCore.QDateTime.currentDateTime().addSecs(60)
+        model.set_filters({}, start, end)
+
+        with mock.patch('gui.history_window.ExportWindow') as export:
+            self.select_row(0)
+            self.win.export_csv()
+            self.assertEqual([trans['id'] for trans in export.call_args[0][0]], [3])
+
+            self.win.transaction_list.selectAll()
+            self.win.export_csv()
+            self.assertEqual([trans['id'] for trans in export.call_args[0][0]], [3, 2, 1])
+
     def test_delete_one(self):
         """ Testing deleting one item of history
         """
@@ -105,8 +178,7 @@ class HistoryWindowTest(basetest.BaseGuiTest):
             with await api.redis.connection as redis:
                 redis.delete(api.sde.QUEUE_NAME)
 
-                item = self.win.transaction_list.topLevelItem(1)
-                self.win.transaction_list.setCurrentItem(item)
+                self.select_row(1)
                 QtCore.QTimer.singleShot(100, self.connect)
                 self.win.delete_button.click()
 
@@ -117,12 +189,11 @@ class HistoryWindowTest(basetest.BaseGuiTest):
                         redis.delete(api.sde.QUEUE_NAME)
 
                         d = self.now.strftime("%Y/%m/%d %H:%M:%S")
-                        self.assertEqual(self.get_tree(self.win.transaction_list),
-                            [{(d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1'): []}, {(d, 'test1', 'b', 'd', 'c', '1', '-', '2.5', '2'): []}, {(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'): []}]
+                        self.assertEqual(self.get_rows(),
+                            [(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'), (d, 'test1', 'b', 'd', 'c', '1', '-', '2.5', '2'), (d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1')]
                         )
                         QtCore.QTimer.singleShot(100, self.connect)
-                        item = self.win.transaction_list.topLevelItem(1)
-                        self.win.transaction_list.setCurrentItem(item)
+                        self.select_row(1)
                         self.win.delete_button.click()
 
                     async def final_func():
@@ -130,8 +201,7 @@ class HistoryWindowTest(basetest.BaseGuiTest):
                         with await api.redis.connection as redis:
                             res = await redis.blpop(api.sde.QUEUE_NAME)
                             self.assertEqual(json.loads(res[1].decode()), {'token': 'changeme', 'type': 'history-delete', 'id': 2})
-                            self.assertEqual(self.get_tree(self.win.transaction_list),
-                                [{(d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1'): []}, {(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'): []}]
+                            self.assertEqual(self.get_rows(), [(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'), (d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1')]
                             )
                         self.app.exit()
                     task = asyncio.ensure_future(final_func())
@@ -151,13 +221,11 @@ class HistoryWindowTest(basetest.BaseGuiTest):
                 with await api.redis.connection as redis:
                     res = await redis.blpop(api.sde.QUEUE_NAME)
                     self.assertEqual(json.loads(res[1].decode()), {'token': 'changeme', 'type': 'history-delete', 'id': 2})
-                    self.assertEqual(self.get_tree(self.win.transaction_list),
-                        [{(d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1'): []}, {(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'): []}]
+                    self.assertEqual(self.get_rows(), [(d, 'test2', 'e', 'f', 'g', '2', '5.0', '-', '3'), (d, 'test1', 'a', 'b', 'c', '1', '-', '1.0', '1')]
                     )
                 self.app.exit()
             with await api.redis.connection as redis:
-                item = self.win.transaction_list.topLevelItem(1)
-                self.win.transaction_list.setCurrentItem(item)
+                self.select_row(1)
                 QtCore.QTimer.singleShot(100, self.connect)
                 self.win.delete_line_button.click()
 
@@ -0,0 +1,101 @@
+# Copyright (C) 2014-2018 Bastien Orivel <b2orivel@enib.fr>
+# Copyright (C) 2014-2018 Arnaud Levaufre <a2levauf@enib.fr>
+#
+# This file is part of Enibar.
+#
+# Enibar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Enibar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Enibar.  If not, see <http://www.gnu.org/licenses/>.
+
+import basetest
+from gui.main_window import MainWindow
+import api.categories as categories
+import api.panels as panels
+import api.prices as prices
+import api.products as products
+
+
+class TestPanels(basetest.BaseGuiTest):
+    def setUp(self):
+        super().setUp()
+        self.soft = categories.add("Soft")
+        self.beer = categories.add("Bière")
+        categories.set_alcoholic(self.beer, True)
+        prices.add_descriptor("Unité", self.soft, 330)
+        prices.add_descriptor("Pinte", self.beer, 500)
+        self.coca = products.add("Coca", category_id=self.soft)
+        self.ice_tea = products.add("Ice tea", category_id=self.soft)
+        self.kro = products.add("Kro", category_id=self.beer)
+        for product in (self.coca, self.ice_tea, self.kro):
+            price = prices.get_unique(product=product)
+            prices.set_value(price['id'], 1)
+        self.panel = panels.add("Boissons")
+        panels.add_products(self.panel, [self.coca, self.ice_tea, self.kro])
+
+        self.win = MainWindow()
+        self.win.hide_alcohol.setChecked(False)
+        self.win.panels.rebuild()
+        self.content = self.win.panels.panels["Boissons"].scroll_area_content
+
+    def test_build(self):
+        """ Testing building the panels """
+        self.assertEqual(self.win.panels.count(), 1)
+        self.assertEqual(self.win.panels.tabText(0), "Boissons")
+        soft = self.content.products[self.soft]
+        self.assertEqual(list(soft['products']), [self.coca, self.ice_tea])
+        layout = soft['widget'].layout
+        self.assertEqual(
+            [layout.itemAt(i).widget().name for i in range(2)],
+            ["Coca", "Ice tea"]
+        )
+
+    def test_rebuild_price(self):
+        """ Testing only the changed products are rebuilt """
+        soft = self.content.products[self.soft]
+        coca = soft['products'][self.coca]['widget']
+        ice_tea = soft['products'][self.ice_tea]['widget']
+
+        prices.set_value(prices.get_unique(product=self.coca)['id'], 2)
+        self.win.panels.rebuild()
+        self.assertIs(self.content, self.win.panels.panels["Boissons"].scroll_area_content)
+        self.assertIs(soft['products'][self.ice_tea]['widget'], ice_tea)
+        self.assertIsNot(soft['products'][self.coca]['widget'], coca)
+        self.assertEqual(soft['products'][self.coca]['widget'].prices, {"Unité": 2})
+
+    def test_rebuild_products(self):
+        """ Testing adding and removing products of a shown panel """
+        fanta = products.add("Fanta", category_id=self.soft)
+        prices.set_value(prices.get_unique(product=fanta)['id'], 1)
+        panels.add_product(self.panel, fanta)
+        panels.delete_product(self.panel, self.coca)
+        self.win.panels.rebuild()
+
+        soft = self.content.products[self.soft]
+        self.assertEqual(set(soft['products']), {fanta, self.ice_tea})
+        layout = soft['widget'].layout
+        self.assertEqual(
+            [layout.itemAt(i).widget().name for i in range(2)],
+            ["Fanta", "Ice tea"]
+        )
+
+        panels.delete_products(self.panel, [fanta, self.ice_tea, self.kro])
+        self.win.panels.rebuild()
+        self.assertEqual(self.win.panels.count(), 0)
+
+    def test_hide_alcohol(self):
+        """ Testing hiding alcohol doesn't rebuild anything """
+        beer = self.content.products[self.beer]['widget']
+        self.win.panels.show_alcohol(False)
+        self.assertTrue(beer.isHidden())
+        self.assertIs(self.content.products[self.beer]['widget'], beer)
+        self.win.panels.show_alcohol(True)
+        self.assertFalse(beer.isHidden())
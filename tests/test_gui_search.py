@@ -71,3 +71,15 @@ class SearchTest(basetest.BaseGuiTest):
         QtTest.QTest.qWait(500)
         self.assertTrue(self.main_win.take_ecocup_btn.isEnabled())
 
+    def test_refresh_only_updates_changed_items(self):
+        """ Testing that refreshing the notes list keeps unchanged items
+        """
+        notes_list = self.main_win.notes_list
+        notes_list.refresh(api.notes.get(lambda x: not x['hidden']))
+        self.assertEqual(self.get_items(notes_list), ['test', 'test1', 'test2'])
+        item = notes_list.items['test']
+
+        self.add_note("test3")
+        notes_list.refresh(api.notes.get(lambda x: x['nickname'] != "test1"))
+        self.assertEqual(self.get_items(notes_list), ['test', 'test2', 'test3'])
+        self.assertIs(notes_list.items['test'], item)
@@ -0,0 +1,59 @@
+# Copyright (C) 2014-2018 Bastien Orivel <b2orivel@enib.fr>
+# Copyright (C) 2014-2018 Arnaud Levaufre <a2levauf@enib.fr>
+#
+# This file is part of Enibar.
+#
+# Enibar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Enibar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Enibar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import basetest
+import gui.thumbnails
+import os
+import settings
+import shutil
+import tempfile
+
+
+class ThumbnailsTest(basetest.BaseGuiTest):
+    def setUp(self):
+        super().setUp()
+        self.img_base_dir = settings.IMG_BASE_DIR
+        settings.IMG_BASE_DIR = tempfile.mkdtemp() + '/'
+        shutil.copyfile("../tests/resources/coucou.jpg", settings.IMG_BASE_DIR + "coucou.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(settings.IMG_BASE_DIR)
+        settings.IMG_BASE_DIR = self.img_base_dir
+        super().tearDown()
+
+    def test_get_thumbnail(self):
+        """ Testing thumbnails are scaled and cached on disk """
+        pixmap = gui.thumbnails.get_thumbnail("coucou.jpg")
+        self.assertFalse(pixmap.isNull())
+        self.assertLessEqual(pixmap.width(), 120)
+        self.assertLessEqual(pixmap.height(), 160)
+
+        path = gui.thumbnails.thumbnail_path("coucou.jpg")
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(gui.thumbnails.get_thumbnail("coucou.jpg").cacheKey(), pixmap.cacheKey())
+
+        # The photo changed, so does the thumbnail
+        os.utime(settings.IMG_BASE_DIR + "coucou.jpg", (0, 0))
+        self.assertNotEqual(gui.thumbnails.thumbnail_path("coucou.jpg"), path)
+
+    def test_no_photo(self):
+        """ Testing notes without photos """
+        self.assertTrue(gui.thumbnails.get_thumbnail("").isNull())
+        self.assertTrue(gui.thumbnails.get_thumbnail("pouette.jpg").isNull())
+        self.assertIsNone(gui.thumbnails.thumbnail_path("pouette.jpg"))
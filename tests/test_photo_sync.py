@@ -0,0 +1,98 @@
+import basetest
+import api.notes
+import asyncio
+import os
+import photo_sync
+import settings
+import shutil
+import tempfile
+from aiohttp import web
+
+
+class MockPhotoServer:
+    def __init__(self):
+        self.photo = b"coucou"
+        self.etag = '"1"'
+        self.downloads = 0
+        self.app = web.Application()
+        self.app.router.add_get('/photos', self.photos)
+        self.app.router.add_get('/static/medias/profile_pictures/{name}', self.picture)
+
+    async def photos(self, request):
+        return web.json_response({"test1@pouette.com": "abc.jpg", "nobody@pouette.com": "def.jpg"})
+
+    async def picture(self, request):
+        if request.headers.get('If-None-Match') == self.etag:
+            return web.Response(status=304)
+        self.downloads += 1
+        return web.Response(body=self.photo, headers={'ETag': self.etag})
+
+
+class PhotoSyncTests(basetest.BaseTest):
+    def setUp(self):
+        super().setUp()
+        api.notes.add("test1",
+            "test1",
+            "test1",
+            "test1@pouette.com",
+            "0600000000",
+            '12/12/2001',
+            '1A',
+            '',
+            True,
+            True
+        )
+        api.notes.rebuild_cache()
+        self.web_url = settings.WEB_URL
+        self.img_base_dir = settings.IMG_BASE_DIR
+        settings.WEB_URL = 'http://127.0.0.1:52413/'
+        settings.IMG_BASE_DIR = tempfile.mkdtemp() + '/'
+
+        self.server = MockPhotoServer()
+        self.handler = self.server.app.make_handler()
+        self.http = self.loop.run_until_complete(
+            self.loop.create_server(self.handler, '127.0.0.1', 52413)
+        )
+
+    def tearDown(self):
+        self.http.close()
+        self.loop.run_until_complete(self.http.wait_closed())
+        self.loop.run_until_complete(self.handler.shutdown())
+        shutil.rmtree(settings.IMG_BASE_DIR)
+        settings.WEB_URL = self.web_url
+        settings.IMG_BASE_DIR = self.img_base_dir
+        super().tearDown()
+
+    def test_sync_photos(self):
+        """ Testing downloading the photos """
+        validators = {}
+        photo_paths = self.loop.run_until_complete(photo_sync.sync_photos(None, validators))
+        self.assertEqual(photo_paths, {'test1': 'test1@pouette.com.jpg'})
+        img_path = settings.IMG_BASE_DIR + 'test1@pouette.com.jpg'
+        with open(img_path, 'rb') as fd:
+            self.assertEqual(fd.read(), b"coucou")
+        self.assertEqual(validators['abc.jpg']['etag'], '"1"')
+
+        self.assertTrue(api.notes.change_photo_paths(photo_paths, do_not=True))
+        api.notes.rebuild_cache()
+        self.assertEqual(api.notes.get_by_nick('test1')['photo_path'], 'test1@pouette.com.jpg')
+
+        # Nothing changed, the photo isn't downloaded again
+        photo_paths = self.loop.run_until_complete(photo_sync.sync_photos(None, validators))
+        self.assertEqual(photo_paths, {})
+        self.assertEqual(self.server.downloads, 1)
+
+        # Same image with a new ETag, the file isn't written again
+        os.utime(img_path, (0, 0))
+        self.server.etag = '"2"'
+        photo_paths = self.loop.run_until_complete(photo_sync.sync_photos(None, validators))
+        self.assertEqual(photo_paths, {})
+        self.assertEqual(self.server.downloads, 2)
+        self.assertEqual(os.path.getmtime(img_path), 0)
+
+        # New image
+        self.server.etag = '"3"'
+        self.server.photo = b"pouette"
+        self.loop.run_until_complete(photo_sync.sync_photos(None, validators))
+        with open(img_path, 'rb') as fd:
+            self.assertEqual(fd.read(), b"pouette")